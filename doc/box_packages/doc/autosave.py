@@ -0,0 +1,315 @@
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+from PySide2.QtCore import QObject, QTimer, Signal
+import globalvars
+from htmlwriter import writeHtml, partToHtml
+from filetask import FileTask
+from journal import InsertText, DelText
+
+GlobalVars = globalvars.GlobalVars
+
+
+# 自动保存，文件写入都在后台线程中进行，下面的函数在后台线程调用，只能使用字符串和段落快照
+def logPathOf(path):  # 日志保存在文档旁边
+    return path + ".autosave"
+
+
+def checkpointPathOf(path):  # 检查点也保存在文档旁边，自动保存不会改变文档文件
+    return path + ".autosave.html"
+
+
+def startLog(path, ids, isCheckpoint=False, task=None):
+    """
+    新建日志，开头记录文档文件的大小和修改时间，以及各段的编号
+    isCheckpoint为True时，各段的编号和之后的修改以检查点文件为准，否则以文档文件为准
+    打开时文档文件与日志开头记录的不一致，说明日志不属于此文件，不会重放
+    """
+    stat = os.stat(path)
+    header = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "ids": ids, "checkpoint": isCheckpoint}
+    writeHtml(logPathOf(path), [json.dumps(header), "\n"])
+
+
+def writeCheckpoint(path, parts, ids, task=None):  # 完整的文档写入检查点，之前的日志不再需要
+    writeHtml(checkpointPathOf(path), parts, task)
+    startLog(path, ids, True)
+
+
+def saveFile(path, parts, ids, task=None):
+    """
+    保存，完整的文档写入文档文件，之前的检查点和日志不再需要
+    """
+    writeHtml(path, parts, task)
+    startLog(path, ids)
+    try:
+        os.remove(checkpointPathOf(path))
+    except FileNotFoundError:
+        pass
+
+
+def appendLog(path, records, task=None):
+    """
+    修改记录追加到日志，记录中的段落快照在这里转换为html
+    """
+    with open(logPathOf(path), "a", encoding="UTF-8") as f:
+        for record in records:
+            if record[0] == "put":
+                record = record[:3] + [partToHtml(record[3])]
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def readLog(path):
+    """
+    读取path的自动保存日志，日志属于当前文件时返回(打开的文件, 各段的编号, 修改记录)，否则返回None
+    有检查点时打开的文件为检查点，包含上次没有保存的修改，否则为文档文件
+    """
+    try:
+        with open(logPathOf(path), encoding="UTF-8") as f:
+            header = json.loads(f.readline())
+            stat = os.stat(path)
+            if header.get("size") != stat.st_size or header.get("mtime") != stat.st_mtime_ns:
+                return None
+            basePath = path
+            if header.get("checkpoint"):
+                basePath = checkpointPathOf(path)
+                if not os.path.isfile(basePath):  # 检查点已经被删除，日志不能重放
+                    return None
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:  # 崩溃时最后一行可能没有写完
+                    break
+    except (OSError, ValueError):
+        return None
+    return basePath, header.get("ids", []), records
+
+
+def itemIndexOf(textItem):  # 文本条在段落中的序号，已经移出段落时返回None
+    i = 0
+    item = textItem.textBlock.RootTextItem
+    while item:
+        if item is textItem:
+            return i
+        i += 1
+        item = item.nextTextItem
+    return None
+
+
+def editRecord(op, isUndo):
+    """
+    文字的插入和删除返回[类型, 文本条序号, 位置, 插入的文字或删除的长度]，其余操作返回None，需要记录整段
+    撤销时插入变为删除，删除变为插入
+    """
+    if type(op) is not InsertText and type(op) is not DelText:
+        return None
+    itemIndex = itemIndexOf(op.textItem)
+    if itemIndex is None:
+        return None
+    if (type(op) is InsertText) != isUndo:
+        return ["ins", itemIndex, op.index, op.text]
+    return ["cut", itemIndex, op.index, len(op.text)]
+
+
+def mergeRecord(last, record):
+    """
+    连续输入或删除的编辑合并到上一条记录中，返回是否合并了
+    """
+    if last[0] != record[0] or last[1] != record[1]:
+        return False
+    if record[0] == "ins":
+        if last[2] + len(last[3]) != record[2]:
+            return False
+        last[3] += record[3]
+    elif record[2] + record[3] == last[2]:  # 退格
+        last[2] = record[2]
+        last[3] += record[3]
+    elif record[2] == last[2]:  # 向后删除
+        last[3] += record[3]
+    else:
+        return False
+    return True
+
+
+def snapshotSize(snapshot):  # 估计日志记录的大小，不需要生成html
+    if isinstance(snapshot, str):
+        return len(snapshot)
+    return sum(len(item.text) for item in snapshot.items) + 200 * len(snapshot.items)
+
+
+class Autosave(QObject):
+    """
+    文档的自动保存，修改定时追加到日志，日志过大时将完整的文档写入文档旁边的检查点
+    只有保存时才写入文档文件，打开时有日志就从检查点或文档文件重放，恢复的修改在保存之前不会写入文档文件
+    输入和删除文字记录为["ins", 段落编号, 文本条序号, 位置, 文字]和["cut", 段落编号, 文本条序号, 位置, 长度]，
+    其余修改记录整段，格式为["put", 段落编号, 前一段的编号, 段落的html]和["del", 段落编号]
+    界面线程只复制段落快照，生成html和文件写入按顺序在后台线程中进行，不会影响输入
+    """
+    modifiedChanged = Signal(bool)  # 文档与文档文件是否一致发生变化
+    failed = Signal(str)  # 后台写入失败，与FileTask.failed相同
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.document = document
+        self.isModified = False  # 有没有保存到文档文件的修改
+        self.pending = set()  # 修改后还没有写入日志、需要记录整段的段落
+        self.edits = []  # 还没有写入日志的文字编辑，每项为(段落, 记录)
+        self.snapshotCache = {}  # 各段的快照，检查点时不需要重新复制没有修改的段落
+        self.nextId = 0
+        self.logSize = 0  # 检查点之后日志的大小
+        self.executor = ThreadPoolExecutor(max_workers=1)  # 只有一个线程，写入的顺序与提交的顺序相同
+        self.timer = QTimer(document)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(GlobalVars.AutosaveInterval)
+        self.timer.timeout.connect(self.flush)
+        document.journal.listeners.append(self.changed)
+
+    def setModified(self, isModified):
+        if self.isModified != isModified:
+            self.isModified = isModified
+            self.modifiedChanged.emit(isModified)
+
+    def changed(self, group, isUndo):
+        self.setModified(True)
+        if not self.document.path:  # 没有保存过的文档，第一次保存时写入完整的文档
+            return
+        pending = self.pending
+        for op in reversed(group) if isUndo else group:  # 按执行的顺序
+            block = op.changedBlock()
+            if block in pending:  # 整段记录，不需要再记录编辑
+                continue
+            record = editRecord(op, isUndo)
+            if record is None:
+                pending.add(block)
+            else:
+                edits = self.edits
+                if not (edits and edits[-1][0] is block and mergeRecord(edits[-1][1], record)):
+                    edits.append((block, record))
+                self.logSize += len(record[3]) if record[0] == "ins" else 1
+        if not self.timer.isActive():
+            self.timer.start()
+
+    def blockId(self, block):
+        if block.autosaveId is None:
+            block.autosaveId = self.nextId
+            self.nextId += 1
+        return block.autosaveId
+
+    def blockSnapshot(self, block):
+        snapshot = self.snapshotCache.get(block)
+        if snapshot is None:
+            snapshot = self.snapshotCache[block] = block.snapshot(optimize=False)
+        return snapshot
+
+    def submit(self, func, *args, start=True):
+        """
+        在自动保存的线程中执行，返回FileTask，同一文档的写入按开始的顺序进行
+        start为False时不开始，连接信号之后由调用者立即调用task.start()，避免任务在连接之前就已经完成
+        """
+        task = FileTask(func, *args, executor=self.executor)
+        task.failed.connect(self.reportError)
+        return task.start() if start else task
+
+    def reportError(self, error):
+        self.failed.emit(error)
+
+    def takePending(self):
+        """
+        取出修改过的段落和文字编辑，更新快照缓存，返回(需要记录整段的段落, 已经删除的段落的编号, 文字编辑)
+        整段记录的段落不再需要之前的编辑，没有写入过日志的段落也要记录整段
+        """
+        pending = self.pending
+        edits = self.edits
+        self.pending = set()
+        self.edits = []
+        self.timer.stop()
+        for block, record in edits:
+            self.snapshotCache.pop(block, None)
+            if block.autosaveId is None and not block.isDetached:
+                pending.add(block)
+        edits = [(block, record) for block, record in edits if block not in pending and not block.isDetached]
+        deletedIds = []
+        for block in pending:
+            self.snapshotCache.pop(block, None)
+            if block.isDetached and block.autosaveId is not None:
+                deletedIds.append(block.autosaveId)
+                block.autosaveId = None
+        return pending, deletedIds, edits
+
+    def flush(self):
+        """
+        修改写入日志，文字编辑按输入的顺序记录，新增的段落按文档中的顺序记录，保证重放时前一段已经存在
+        """
+        path = self.document.path
+        if not (self.pending or self.edits) or not path:
+            return
+        pending, deletedIds, edits = self.takePending()
+        records = [["del", i] for i in deletedIds]
+        records.extend([[record[0], block.autosaveId] + record[1:] for block, record in edits])
+        preId = None
+        block = self.document.RootBlock
+        while block:
+            if block in pending:
+                snapshot = self.blockSnapshot(block)
+                records.append(["put", self.blockId(block), preId, snapshot])
+                self.logSize += snapshotSize(snapshot)
+            preId = self.blockId(block)
+            block = block.nextBlock
+        self.submit(appendLog, path, records)
+        if self.logSize > GlobalVars.AutosaveLogLimit:  # 日志过大，重放太慢，写入完整的文档
+            self.checkpoint()
+
+    def blockIds(self):
+        ids = []
+        block = self.document.RootBlock
+        while block:
+            ids.append(self.blockId(block))
+            block = block.nextBlock
+        return ids
+
+    def startLog(self, isCheckpoint=False):
+        """
+        打开文档后开始记录日志，isCheckpoint为True时文档从检查点打开，否则文档文件的内容就是日志的起点
+        """
+        self.pending.clear()
+        self.logSize = 0
+        return self.submit(startLog, self.document.path, self.blockIds(), isCheckpoint)
+
+    def documentParts(self):
+        """
+        复制完整的文档，返回(html的各部分, 各段的编号)，同时去掉快照缓存中已经删除的段落
+        """
+        document = self.document
+        self.takePending()
+        snapshotCache = {}  # 重新生成缓存，去掉已经删除的段落
+        parts = [document.htmlHead()]
+        ids = []
+        block = document.RootBlock
+        while block:
+            snapshot = snapshotCache[block] = self.blockSnapshot(block)
+            parts.append(snapshot)
+            parts.append("\n")
+            ids.append(self.blockId(block))
+            block = block.nextBlock
+        parts.append(document.htmlTail())
+        self.snapshotCache = snapshotCache
+        self.logSize = 0
+        return parts, ids
+
+    def checkpoint(self):
+        """
+        将完整的文档写入检查点，并重新开始记录日志，返回后台写入的FileTask，文档文件不变
+        检查点不能取消，之后的日志依赖写入的检查点
+        """
+        return self.submit(writeCheckpoint, self.document.path, *self.documentParts())
+
+    def save(self, start=True):
+        """
+        保存，将完整的文档写入文档文件，并重新开始记录日志，返回后台写入的FileTask，start与submit相同
+        """
+        task = self.submit(saveFile, self.document.path, *self.documentParts(), start=False)
+        task.failed.connect(lambda error: self.setModified(True))  # 没有保存成功
+        self.setModified(False)
+        return task.start() if start else task
@@ -0,0 +1,273 @@
+"""
+性能测试，生成指定规模的文档，测量断行、分页、导出、打开、鼠标定位和拖动选择的用时，结果保存为json
+默认在QT_QPA_PLATFORM=offscreen下运行，不需要显示器，同样的参数和随机种子生成的文档完全相同
+    python benchmark.py -o result.json
+    python benchmark.py --blocks 5000 --repeat 3 -o new.json --compare old.json
+"""
+import os
+import sys
+import json
+import random
+import platform
+import argparse
+import shutil
+import tempfile
+import statistics
+import subprocess
+from time import perf_counter
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import PySide2
+from PySide2.QtWidgets import QApplication
+from PySide2.QtCore import Qt, QPoint, QEvent
+from PySide2.QtGui import QMouseEvent
+
+App = QApplication.instance() or QApplication(sys.argv)  # 必须在新建字体之前
+
+import doc
+import globalvars
+import htmlreader
+from document import Document
+from htmlwriter import ItemSnapshot, BlockSnapshot, writeHtml
+from layout import getLineHeight
+
+GlobalVars = globalvars.GlobalVars
+
+Words = ("layout", "page", "block", "text", "item", "fragment", "cursor", "select", "render", "document",
+         "a", "of", "the", "incomprehensibilities", "internationalization", "x")
+CjkText = "我们的世界文档编辑排版分页段落文字光标选择字体颜色标题正文打开保存撤销重做自动"
+FontFamilies = ("微软雅黑", "宋体", "Arial", "Times New Roman")
+
+
+def makeText(rand, length, cjk):
+    """
+    生成约length个字符的文字，cjk为中文所占的比例
+    """
+    parts = []
+    size = 0
+    while size < length:
+        if rand.random() < cjk:
+            word = "".join(rand.choice(CjkText) for i in range(rand.randint(2, 12)))
+        else:
+            word = rand.choice(Words) + " "
+        parts.append(word)
+        size += len(word)
+    return "".join(parts)
+
+
+def makeDocument(path, blocks, spans, spanLength, cjk, seed):
+    """
+    生成有blocks段的html文件，正文每段有1到spans个格式不同的文本条，每10段有一个标题
+    """
+    rand = random.Random(seed)
+    document = Document()  # 只用于生成html的开头和结尾
+    parts = [document.htmlHead()]
+    width = document.RootPage.PageContentWidth
+    for i in range(blocks):
+        if i % 10 == 0:
+            titleLevel = rand.choice(GlobalVars.TitleLevels[1:])
+            item = ItemSnapshot(makeText(rand, 30, cjk), "", False, False, 0, 0, (0, 0, 0, 255), None)
+            parts.append(BlockSnapshot(titleLevel.toHtmlFormat, True, width,
+                                       GlobalVars.CurrentLineSpacing, GlobalVars.CurrentLineSpacingPolicy, (item,)))
+        else:
+            items = []
+            for j in range(rand.randint(1, spans)):
+                fontSize = rand.choice((9, 10.5, 12, 12, 12, 14, 16, 20))
+                items.append(ItemSnapshot(makeText(rand, rand.randint(spanLength // 4, spanLength), cjk),
+                                          rand.choice(FontFamilies),
+                                          rand.random() < 0.2,
+                                          rand.random() < 0.2,
+                                          int(fontSize),
+                                          getLineHeight(int(fontSize), GlobalVars.CurrentLineSpacing,
+                                                        GlobalVars.CurrentLineSpacingPolicy),
+                                          (rand.randint(0, 128), rand.randint(0, 128), rand.randint(0, 128), 255),
+                                          None if rand.random() < 0.8 else (255, 255, 0, 255)))
+            parts.append(BlockSnapshot("p", False, width, GlobalVars.CurrentLineSpacing,
+                                       GlobalVars.CurrentLineSpacingPolicy, tuple(items)))
+        parts.append("\n")
+    parts.append(document.htmlTail())
+    document.deleteLater()
+    writeHtml(path, parts)
+
+
+def iterBlocks(document):
+    block = document.RootBlock
+    while block:
+        yield block
+        block = block.nextBlock
+
+
+def blockTop(block):  # 段落在文档中的纵坐标
+    return block.page.PosY[0] + block.posY[0]
+
+
+def mouseEvent(eventType, x, y):
+    return QMouseEvent(eventType, QPoint(x, y), Qt.LeftButton, Qt.LeftButton, Qt.NoModifier)
+
+
+class Benchmark():
+    """
+    依次运行各项测试，每项重复repeat次，记录每次的用时，结果中比较最小值，受其他程序的影响最小
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.results = {}
+        self.document = None
+        self.directory = tempfile.mkdtemp(prefix="docbench")  # 生成的文档和导出的文件，结束时删除
+        self.path = os.path.join(self.directory, "bench.html")
+
+    def measure(self, name, func, count=1, setup=None):
+        """
+        重复运行func，count为每次运行包含的操作数，setup在每次运行之前调用，不计入用时
+        """
+        times = []
+        for i in range(self.args.repeat):
+            if setup:
+                setup()
+            start = perf_counter()
+            func()
+            times.append(perf_counter() - start)
+            App.processEvents()
+        self.results[name] = {"min": min(times), "median": statistics.median(times), "count": count, "runs": times}
+        print("{:<16}{:>10.4f}s{:>10.4f}s  x{}".format(name, min(times), statistics.median(times), count), file=sys.stderr)
+
+    def run(self):
+        args = self.args
+        makeDocument(self.path, args.blocks, args.spans, args.span_length, args.cjk, args.seed)
+        self.measure("load", self.load)
+        self.measure("parseMapped", self.parseMapped)
+        document = self.document
+        blocks = list(iterBlocks(document))
+        self.measure("layoutAll", lambda: [block.RootTextItem.updateAllTextFragments() for block in blocks])
+        self.measure("layoutTyping", self.typing, args.edits)
+        self.measure("pagination", self.paginate, setup=self.growRootBlock)
+        self.measure("toHtml", document.toHtml)
+        self.measure("snapshot", document.snapshot)
+        parts = document.snapshot()
+        self.measure("writeHtml", lambda: writeHtml(self.path + ".out", parts))
+        self.measure("findTextIndex", self.hitTest, args.hits)
+        self.measure("dragSelect", self.drag, setup=document.deSelEvent)
+        document.deSelEvent()
+        shutil.rmtree(self.directory, ignore_errors=True)
+        return self.results
+
+    def load(self):
+        """
+        与ToolWidget.analysisHtml相同，同步打开并新建全部段落
+        """
+        if self.document:
+            self.document.deleteLater()
+        with open(self.path, encoding="UTF-8") as f:
+            self.document = htmlreader.readHtml(f)
+        self.document.resize(self.document.width(), self.document.height())
+
+    def parseMapped(self):
+        reader, log = htmlreader.parseHtml(self.path)
+        for i in range(len(reader.blocks)):
+            reader.blocks[i]
+        htmlreader.closeReader(reader)
+
+    def typing(self):
+        """
+        在随机的位置输入一个字符再删除，测试增量断行，位置包括文本条的开头和结尾
+        与实际输入相同，每次修改都记入撤销记录，并像回到事件循环一样结束本组
+        """
+        document = self.document
+        journal = document.journal
+        rand = random.Random(self.args.seed)
+        textItems = [block.RootTextItem for block in iterBlocks(document) if len(block.RootTextItem.buffer) > 2]
+        for i in range(self.args.edits // 2):
+            textItem = rand.choice(textItems)
+            index = rand.randint(0, len(textItem.buffer))
+            textItem.insertText("w", index)
+            journal.closeGroup()
+            textItem.delText(index, index)
+            journal.closeGroup()
+
+    def growRootBlock(self):  # 首段交替变高、变低三分之一页，后面各页的分页位置都会改变
+        block = self.document.RootBlock
+        self.isGrown = not getattr(self, "isGrown", False)
+        block.resize(block.width(), block.height() + GlobalVars.PageHeight // 3 * (1 if self.isGrown else -1))
+
+    def paginate(self):
+        self.document.RootBlock.updateBlock()
+
+    def hitTest(self):
+        rand = random.Random(self.args.seed)
+        blocks = list(iterBlocks(self.document))
+        for i in range(self.args.hits):
+            block = rand.choice(blocks)
+            block.findTextIndex(QPoint(rand.randint(0, block.width()), rand.randint(0, block.height())))
+
+    def drag(self):
+        """
+        从第二段开始，鼠标每次移动20像素，拖动选择到第drag_pages页的末尾
+        """
+        document = self.document
+        first = document.RootBlock.nextBlock
+        x, y = 100, blockTop(first) + 5
+        end = min(document.height(), GlobalVars.PageHeight * self.args.drag_pages)
+        document.FirstSelBlock = first
+        document.mousePressEvent(mouseEvent(QEvent.MouseButtonPress, x, y))
+        for posY in range(y, end, 20):
+            document.mouseMoveEvent(mouseEvent(QEvent.MouseMove, 400, posY))
+        document.mouseReleaseEvent(mouseEvent(QEvent.MouseButtonRelease, 400, end - 1))
+
+
+def revision():  # 当前代码的版本，不是git仓库时为None
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old):
+    """
+    打印与之前结果的对比，比值大于1表示变慢
+    """
+    print("{:<16}{:>10}{:>10}{:>8}".format("", "old", "new", "ratio"))
+    for name, result in results.items():
+        if name in old:
+            ratio = result["min"] / old[name]["min"] if old[name]["min"] else float("inf")
+            print("{:<16}{:>10.4f}{:>10.4f}{:>8.2f}{}".format(name, old[name]["min"], result["min"], ratio,
+                                                             "  slower" if ratio > 1.1 else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="文档编辑器性能测试")
+    parser.add_argument("-o", "--output", help="结果保存的json文件")
+    parser.add_argument("--compare", help="与之前保存的json结果对比")
+    parser.add_argument("--blocks", type=int, default=2000, help="段落数")
+    parser.add_argument("--spans", type=int, default=4, help="每段最多的文本条数")
+    parser.add_argument("--span-length", type=int, default=400, help="每个文本条最多的字符数")
+    parser.add_argument("--cjk", type=float, default=0.3, help="中文所占的比例")
+    parser.add_argument("--edits", type=int, default=400, help="增量断行测试的编辑次数")
+    parser.add_argument("--hits", type=int, default=2000, help="鼠标定位测试的次数")
+    parser.add_argument("--drag-pages", type=int, default=20, help="拖动选择的页数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项测试重复的次数")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    doc.initialize()
+    results = Benchmark(args).run()
+    output = {
+        "revision": revision(),
+        "params": vars(args),
+        "python": platform.python_version(),
+        "pyside": PySide2.__version__,
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="UTF-8") as f:
+            json.dump(output, f, indent=1)
+    if args.compare:
+        with open(args.compare, encoding="UTF-8") as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,105 +1,133 @@
-from PySide2.QtWidgets import QWidget
-from PySide2.QtCore import Qt, QEvent, QRect
-from PySide2.QtGui import QKeySequence, QPainter, QPalette
+from PySide2.QtCore import Qt, QRect, QRectF, QPoint
 import globalvars
+from rendercache import RenderCacheTable
+from journal import AddBlock, DelBlock
 
 GlobalVars = globalvars.GlobalVars
 SelStatus = globalvars.SelStatus
+UpdateView = globalvars.UpdateView
 from test import test  # 测试
 
 
 # 块，或者叫段落，是文档构成和扩展的基本要素
-class Block(QWidget):
-    @test("新建block")
-    def __init__(self, document, preBlock, float=False):  # float表示是否是浮动段落
-        super().__init__()
-        self.setFocusPolicy(Qt.ClickFocus)  # 点击获得焦点
-        self.setAttribute(Qt.WA_DeleteOnClose)  # 窗口关闭时候，自动删除,避免占用内存
-
-        # 默认段落可以接受复制粘贴事件，具体方法可重写copy 和paste类函数
-        self.grabShortcut(QKeySequence("ctrl+c"), Qt.ApplicationShortcut)
-        self.grabShortcut(QKeySequence("ctrl+v"), Qt.ApplicationShortcut)
+# 段落不是QWidget，只记录在页面中的位置和大小，由document绘制可见的段落，并把鼠标、键盘事件转交给段落
+# 文档的段落再多，也只有document一个窗口
+class Block():
+    renderCached = False  # 是否缓存绘制结果，不在编辑状态时重绘直接使用缓存，子类可以开启
+    renderGeneration = 0  # 绘制内容的版本，每次update都会增加，与缓存的版本不同时缓存失效
+    isDetached = False  # 是否已经移出文档，删除的段落保留在撤销记录中，撤销时放回
+    autosaveId = None  # 自动保存日志中的段落编号，写入日志时才分配
 
+    @test("新建block")
+    def __init__(self, document, preBlock, float=False,
+                 updateView=UpdateView.updateAll):  # float表示是否是浮动段落，updateView为updateNone时不分页，用于批量新建
         self.document = document
         self.SelStatus = SelStatus.SelNone  # 拖动选择的时候，变成SelAll
         self.BlockWidth = document.RootPage.PageContentWidth  # 预设块宽度等于页面内容的宽度，updateBlock会重新更新
-        self.posY = [0, 0]  # 初始化widget左侧两点的纵坐标，updateBlock会重新更新
+        self.posX = 0  # 在页面中的横坐标
+        self.posY = [0, 0]  # 在页面中的纵坐标范围，updateBlock会重新更新
+        self.size_ = (0, 0)  # 宽度和高度
+        self.page = None  # 所在的页面，updateBlock会重新更新
         self.resize(self.BlockWidth, 100)  # 默认高度为20
 
         if float:  # 浮动段落
             pass  # 待完善
         else:  # 不是浮动段落，根据上一段位置，自上而下排列
-            # 主要属性self.preblock self.nextblock self.documeny.Rootblock self.document.lastblock
-            self.preBlock = preBlock
-            if preBlock:  # 不是文档首段
-                self.nextBlock = preBlock.nextBlock  # 复制preblock 的nextBlock属性
-                preBlock.nextBlock = self  # 更新preblock
-                if self.nextBlock:  # 有后段，本段为插入段
-                    self.nextBlock.preBlock = self
-                else:  # 本段为末段
-                    self.document.LastBlock = self
-
-            else:  # preBlock为None,本段为文档首段
-                self.nextBlock = self.document.RootBlock
-                self.document.RootBlock = self
-                if self.nextBlock:  # 文档不是空的，在文档首处插入新段
-                    self.nextBlock.preBlock = self
-                else:  # 文档新建后的第一段
-                    self.document.LastBlock = self
-            self.updateBlock()  # 更新段落在页面上所处的位置
+            self.linkBlock(preBlock)
+            document.journal.record(AddBlock(self, preBlock))
+            if updateView:
+                self.updateBlock()  # 更新段落在页面上所处的位置
         self.setAsCurrentBlock()
-        self.setFocus()  # 获取焦点
-        self.show()
+        if updateView:
+            self.setFocus()  # 获取焦点
 
     # 更新段坐标
     @test("段落位置更新")
     def updateBlock(self):
         """
-        # 更新段落在页面上所处的位置
+        # 更新本段及后面各段在页面上所处的位置，后面的段落位置不再变化时停止
+        # 批量编辑时只做标记，结束时统一分页
+        """
+        if self.document.layoutLock:
+            self.document.markDirty(self)
+        else:
+            self.document.paginate(self)
+
+    def linkBlock(self, preBlock):
+        """
+        加入文档的段落链表，preBlock为None，表示作为文档首段
+        """
+        # 主要属性self.preblock self.nextblock self.documeny.Rootblock self.document.lastblock
+        self.preBlock = preBlock
+        if preBlock:  # 不是文档首段
+            self.nextBlock = preBlock.nextBlock  # 复制preblock 的nextBlock属性
+            preBlock.nextBlock = self  # 更新preblock
+            if self.nextBlock:  # 有后段，本段为插入段
+                self.nextBlock.preBlock = self
+            else:  # 本段为末段
+                self.document.LastBlock = self
+
+        else:  # preBlock为None,本段为文档首段
+            self.nextBlock = self.document.RootBlock
+            self.document.RootBlock = self
+            if self.nextBlock:  # 文档不是空的，在文档首处插入新段
+                self.nextBlock.preBlock = self
+            else:  # 文档新建后的第一段
+                self.document.LastBlock = self
+
+    def unlinkBlock(self):
+        """
+        从文档的段落链表中移除，不更新视图
         """
-        # 待完善，每次全部更新浪费性能，应在换页符或恰好占满一页停止
         preBlock = self.preBlock
-        if preBlock:  # 不是首段
-            page = preBlock.page
-            if self.height() + preBlock.posY[1] > page.PageContentHeight:  # 超过当前页的高度，需要新增页或移到下一页
-                if page.nextPage:  # 移到下一页
-                    page = page.nextPage
-                    if self.height() > page.PageContentHeight:  # 段落高度超过了页面高度
-                        page.PageHeight = self.height() + page.PageVerticalMargin * 2  # 设置页面高度，保证每页至少能容纳一段
-                        page.resize(page.PageWidth, page.PageHeight)
-                    self.setPage(page)
-                    self.move(page.PageHorizontalMargin, page.PageVerticalMargin)
-                    page.updatePage()
-                else:  # 新建页
-                    newPage = self.document.addPage(page)  # 新增页
-                    if self.height() > newPage.PageContentHeight:  # 段落高度超过了页面高度
-                        newPage.PageHeight = self.height() + newPage.PageVerticalMargin * 2  # 设置页面高度，保证每页至少能容纳一段
-                        newPage.resize(newPage.PageWidth, newPage.PageHeight)
-                    self.setPage(newPage)
-                    self.move(newPage.PageHorizontalMargin, newPage.PageVerticalMargin)  # 会自动更新posY
-                    page.updatePage()
-            else:
-                self.setPage(page)
-                self.move(page.PageHorizontalMargin, preBlock.posY[1])  # 会自动更新posY
+        nextBlock = self.nextBlock
+        if preBlock:
+            preBlock.nextBlock = nextBlock
+        else:
+            self.document.RootBlock = nextBlock
+        if nextBlock:
+            nextBlock.preBlock = preBlock
         else:
-            page = self.document.RootPage
-            self.setPage(page)
-            if self.height() > page.PageContentHeight:  # 第一段超过第一页的高度，调整页大小
-                page.PageHeight = self.height() + page.PageVerticalMargin * 2  # 设置页面高度，保证每页至少能容纳一段
-                page.resize(page.PageWidth, page.PageHeight)
-                page.updatePage()
-            self.move(page.PageHorizontalMargin, page.PageVerticalMargin)
-
-        if self.nextBlock:  # 不是尾段，调整后一段
-            self.nextBlock.updateBlock()
-        else:  # 已经是最后一段，查看是否删除无用的页面
-            while self.page is not self.document.LastPage:  # 不是最后一页
-                self.document.LastPage.delPage()  # 删除空页 待完善，没有考虑浮动段落的存在
+            self.document.LastBlock = preBlock
+
+    def detachBlock(self):
+        """
+        移出链表后隐藏段落并脱离页面，不销毁，撤销删除时可以放回
+        """
+        document = self.document
+        document.unmarkDirty(self)
+        RenderCacheTable.discard(self)
+        self.updateArea()  # 原来的位置需要重绘
+        self.isDetached = True
+        self.page = None
+        if document.focusBlock is self:
+            document.focusBlock = None
+
+    def detach(self):
+        """
+        撤销新建或重做删除时移出文档，在批量编辑中调用，前后段落结束时统一分页
+        """
+        neighbor = self.nextBlock or self.preBlock
+        self.unlinkBlock()
+        if neighbor:
+            self.document.markDirty(neighbor)
+        else:
+            self.document.initialization()
+        if GlobalVars.CurrentBlock is self:
+            GlobalVars.CurrentBlock = neighbor
+        self.detachBlock()
+
+    def attach(self, preBlock):
+        """
+        撤销删除或重做新建时放回文档，在批量编辑中调用
+        """
+        self.linkBlock(preBlock)
+        self.isDetached = False
+        self.document.markDirty(self, True)
 
     def setPage(self, page):
+        self.updateArea()  # 原来的页面需要重绘
         self.page = page
-        self.setParent(page)
-        self.show()  # 不可少，当移动到别的页时，可能不会正常更新
 
     def setAsCurrentBlock(self):
         GlobalVars.CurrentBlock = self
@@ -108,75 +136,139 @@ class Block(QWidget):
     def delBlock(self):
         preBlock = self.preBlock
         nextBlock = self.nextBlock
+        self.document.journal.record(DelBlock(self, preBlock))
+        self.unlinkBlock()
         if preBlock:  # 删除的不是首段
-            preBlock.nextBlock = nextBlock
             if nextBlock:  # 删除的不是最后一段
-                nextBlock.preBlock = preBlock
                 nextBlock.updateBlock()
             else:  # 删除的是最后一段
-                self.document.LastBlock = preBlock
                 preBlock.updateBlock()
             preBlock.setFocus_(False)  # false表示定位到段尾部 最后一段删除，因此获得焦点
         else:  # 删除的是首段
             if nextBlock:  # 不是最后一段
-                nextBlock.preBlock = None
-                self.document.RootBlock = nextBlock
                 nextBlock.updateBlock()
                 nextBlock.setFocus_(True)  # 首段删除获得焦点，定位到头部
             else:  # 唯一一段
                 self.document.initialization()  # 初始化document参数设置
-        self.close()  # 关闭窗口，也是删除窗口
+        self.detachBlock()  # 不再关闭窗口，撤销记录不再引用时自动删除
+
+    def update(self, *args):  # 内容发生了变化，绘制缓存失效，参数与QWidget.update相同，没有参数时重绘整段
+        self.renderGeneration += 1
+        if len(args) == 4:
+            self.updateArea(QRectF(*args).toAlignedRect())  # 行的坐标可能是小数
+        else:
+            self.updateArea(*args)
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        p = QPainter(self)
+    def updateArea(self, rect=None):
+        """
+        重绘段落中rect的区域，为None时重绘整段，内容没有变化，比如段落移动
+        """
+        if self.page:
+            self.document.update(self.mapToDocument(rect or self.rect()))
+
+    def paint(self, p, rect):
+        """
+        由document调用，p已经平移到段落的左上角并裁剪到rect，rect为段落中需要重绘的区域
+        """
+        pixmap = None
+        if self.renderCached and self is not GlobalVars.CurrentBlock:  # 正在编辑的段落变化频繁，直接绘制
+            pixmap = RenderCacheTable.pixmap(self)
+        if pixmap:
+            p.drawPixmap(0, 0, pixmap)  # 已经裁剪到需要重绘的区域
+        else:
+            self.paintContent(p, rect)
         return
         # 测试代码，调试时候使用
         if self is GlobalVars.CurrentBlock:
             p.setPen(Qt.red)
-            p.drawRect(2, 2, self.size().width() - 4, self.size().height() - 4)
+            p.drawRect(2, 2, self.width() - 4, self.height() - 4)
         elif GlobalVars.CurrentBlock.preBlock and GlobalVars.CurrentBlock.preBlock is self:
             p.setPen(Qt.green)
-            p.drawRect(2, 2, self.size().width() - 4, self.size().height() - 4)
+            p.drawRect(2, 2, self.width() - 4, self.height() - 4)
         elif GlobalVars.CurrentBlock.nextBlock and GlobalVars.CurrentBlock.nextBlock is self:
             p.setPen(Qt.blue)
-            p.drawRect(2, 2, self.size().width() - 4, self.size().height() - 4)
+            p.drawRect(2, 2, self.width() - 4, self.height() - 4)
         if self is self.document.RootBlock:
             p.setPen(Qt.darkYellow)
-            p.drawRect(8, 8, self.size().width() - 16, self.size().height() - 16)
+            p.drawRect(8, 8, self.width() - 16, self.height() - 16)
         if self is self.document.LastBlock:
             p.setPen(Qt.darkCyan)
-            p.drawRect(8, 8, self.size().width() - 16, self.size().height() - 16)
+            p.drawRect(8, 8, self.width() - 16, self.height() - 16)
+
+    # 绘制段落的内容，rect为需要重绘的区域，可重写
+    def paintContent(self, painter, rect):
+        pass
 
+    # 位置和大小，与QWidget的同名函数相同，坐标相对于所在的页面
     def move(self, x, y):
-        super().move(x, y)
-        self.posY[0] = y  # 更新posY值，减少重复计算
-        self.posY[1] = y + self.height()
+        self.updateArea()  # 原来的位置需要重绘
+        self.posX = int(x)
+        self.posY[0] = int(y)  # 更新posY值，减少重复计算
+        self.posY[1] = self.posY[0] + self.size_[1]
+        self.updateArea()
 
     def resize(self, w, h):
-        super().resize(w, h)
-        self.posY[1] = self.posY[0] + h  # 更新posY值，减少重复计算
+        size = (int(w), int(h))  # 与QWidget相同，大小为整数
+        if size != self.size_:
+            self.updateArea()  # 变小时，原来的区域也需要重绘
+            self.size_ = size
+            self.posY[1] = self.posY[0] + size[1]  # 更新posY值，减少重复计算
+            self.updateArea()
+
+    def width(self):
+        return self.size_[0]
+
+    def height(self):
+        return self.size_[1]
+
+    def rect(self):
+        return QRect(0, 0, self.size_[0], self.size_[1])
+
+    def pos(self):
+        return QPoint(self.posX, self.posY[0])
+
+    def mapFromParent(self, point):  # 页面中的坐标转换为段落中的坐标
+        return point - QPoint(self.posX, self.posY[0])
+
+    def mapToDocument(self, rect):  # 段落中的矩形转换为文档中的坐标
+        return rect.translated(self.posX, self.page.PosY[0] + self.posY[0])
+
+    def devicePixelRatioF(self):
+        return self.document.devicePixelRatioF()
+
+    def setUpdatesEnabled(self, enable):
+        self.document.setUpdatesEnabled(enable)
+
+    def setFocus(self):  # 键盘和输入法事件由document转交给获得焦点的段落，与隐藏的QWidget相同，还没有分页的段落不能获得焦点
+        if self.page:
+            self.document.setFocusBlock(self)
+
+    def hasFocus(self):
+        return self.document.focusBlock is self and self.document.hasFocus()
 
     @test("获取焦点")
     def focusInEvent(self, event):
-        super().focusInEvent(event)
         self.setAsCurrentBlock()
-        self.document.update()  # 测试，对文档进行重绘以显示当前取得焦点的块
+
+    def focusOutEvent(self, event):
+        pass
 
     @test("获取焦点")
     def setFocus_(self, sign=True):  # sign为True是定位到段首，比如删除第一段,或使用向下键，False表示定位到段尾，比如删除后一段或使用向上键,默认定位到段首
         self.setFocus()
 
-    def event(self, event):
-        if event.type() == QEvent.Shortcut:
-            # 复制粘贴的快捷键设置
-            if event.key() == QKeySequence("ctrl+c"):
-                self.copy()
-            if event.key() == QKeySequence("ctrl+v"):
-                self.paste()
-        return super().event(event)  # 必须用return
+    # 导出html，逐个生成html的各个部分，默认没有内容，可重写，optimize为False时不能修改段落，用于自动保存
+    def iterHtml(self, optimize=True):
+        return iter(())
+
+    def toHtml(self, optimize=True):
+        return "".join(self.iterHtml(optimize))
 
-    # 复制
+    # 导出用的快照，在后台线程中生成html，默认直接使用html字符串，可重写
+    def snapshot(self, optimize=True):
+        return self.toHtml(optimize)
+
+    # 复制，快捷键由document统一处理，具体方法可重写copy 和paste类函数
     def copy(self):
         pass
 
@@ -184,21 +276,24 @@ class Block(QWidget):
     def paste(self):
         pass
 
+    # 鼠标、键盘和输入法事件，由document转交，鼠标事件的坐标已经转换为段落中的坐标
     def mousePressEvent(self, event):
-        super().mousePressEvent(event)
         self.document.FirstSelBlock = self  # 第一个选中的块
 
     def keyPressEvent(self, event):
         if event.key() == Qt.Key_Delete:  # 删除段落
             self.delBlock()
 
+    def inputMethodEvent(self, event):
+        pass
+
     # 默认向下拖动选中的事件，可以重写
     def downSelEvent(self):
         pass
 
-    # 鼠标释放的时候的事件，目的是将一些消耗性能的操作放到最后完成
+    # 鼠标释放的时候的事件，目的是将一些消耗性能的操作放到最后完成，拖动时已经调用过downSelEvent，默认不需要处理
     def downSelConfirmEvent(self):
-        self.downSelEvent()
+        pass
 
     # 默认向上拖动选择的事件
     def upSelEvent(self):
@@ -206,7 +301,7 @@ class Block(QWidget):
 
     # 鼠标释放的时候的事件，目的是将一些消耗性能的操作放到最后完成
     def upSelConfirmEvent(self):
-        self.upSelEvent()
+        pass
 
     # 取消选择
     def deSelEvent(self):
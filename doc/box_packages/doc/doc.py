@@ -4,8 +4,11 @@ from PySide2.QtCore import QPoint
 from PySide2.QtGui import QFont, QColor, QIcon, QFontDatabase, QPalette
 from box_widget import *
 from document import Document
+from textblock import TextBlock
+import htmlreader
+from htmlwriter import writeHtml
+from filetask import FileTask
 import os
-import re
 from test import test  # 测试
 import globalvars
 import sys
@@ -146,6 +149,8 @@ class ToolWidget(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.DocWidget = parent
+        self.loader = None  # 正在打开、还没有显示的文档
+        self.saveAsTask = None  # 正在另存为的任务
         self.setFocusPolicy(Qt.NoFocus)
         self.ui()
 
@@ -280,6 +285,8 @@ class ToolWidget(QWidget):
 
     def saveDocument(self):
         document = GlobalVars.CurrentDocument
+        if document.loader:  # 还没有全部新建，先新建剩余的段落
+            document.loader.buildAll()
         if not document.path:
             if document.title:
                 file, format = QFileDialog.getSaveFileName(self, "保存文件", "../../files/" + document.title,
@@ -293,11 +300,14 @@ class ToolWidget(QWidget):
                 document.path = file
             else:
                 return  # 不可少
-        with open(document.path, "w", encoding="UTF-8") as f:
-            f.write(document.toHtml())
+        task = document.autosave.save(start=False)  # 在后台线程写入临时文件，再替换原文件，不会阻塞输入
+        self.trackTask(task, "保存")
+        task.start()  # 连接信号之后再开始，很快完成时也能显示结果
 
     def saveDocumentAs(self):
         document = GlobalVars.CurrentDocument
+        if document.loader:
+            document.loader.buildAll()
         path = document.path
         if path:
             name, suffix = os.path.basename(path).split(".")  # 名字和后缀
@@ -306,8 +316,11 @@ class ToolWidget(QWidget):
             file, format = QFileDialog.getSaveFileName(self, "保存文件", newPath, "网页格式(*.html);;所有(*)")
 
             if file:
-                with open(file, "w", encoding="UTF-8") as f:
-                    f.write(document.toHtml())
+                if self.saveAsTask:  # 之前的另存为还没有完成
+                    self.saveAsTask.cancel()
+                self.saveAsTask = FileTask(writeHtml, file, document.snapshot())  # 界面线程只复制快照，在后台线程生成html
+                self.trackTask(self.saveAsTask, "另存为")
+                self.saveAsTask.start()
                 # 待完善 ，关闭旧文档，打开新文档
         else:
             self.saveDocument()
@@ -316,20 +329,68 @@ class ToolWidget(QWidget):
         # 待完善，判断是否保存现有文档或者新建文档选项卡
         file, suffix = QFileDialog.getOpenFileName(self, "打开文件", "../../files", "网页格式(*.html)")
         if file:
-            with open(file, "r", encoding="UTF-8") as f:
-                document = self.analysisHtml(f)  # 解析html文档
-                document.path = file
-                self.DocWidget.documentScrollArea.setWidget(document)
-                self.update()
-                print(True)
+            if self.loader:  # 之前打开的文档还没有显示
+                self.loader.cancel()
+            self.loader = htmlreader.HtmlLoader(file)  # 在后台解析html文档，同时恢复自动保存的修改
+            self.loader.progress.connect(lambda percent: self.showProgress("打开", percent))
+            self.loader.ready.connect(self.documentOpened)  # 前几页新建完成后先显示，其余的继续新建
+            self.loader.finished.connect(lambda document: self.showProgress())
+            self.loader.failed.connect(lambda error: self.showProgress("打开失败 " + error))
+            self.loader.cancelled.connect(lambda: self.showProgress())
+            self.loader.start()
+
+    def documentOpened(self, document):
+        self.loader = None  # 已经显示，不能再取消，剩余的段落由document.loader继续新建
+        document.setAsCurrentDocument()
+        self.watchDocument(document)
+        self.DocWidget.documentScrollArea.setWidget(document)
+        document.show()
+        self.showProgress()  # 恢复了没有保存的修改时，标题显示修改状态
+        self.update()
+
+    def watchDocument(self, document):
+        """
+        文档的修改状态变化时更新窗口标题，自动保存失败时与保存失败一样在标题显示
+        """
+        document.autosave.modifiedChanged.connect(lambda isModified: self.showProgress())
+        document.autosave.failed.connect(lambda error: self.showProgress("自动保存失败 " + error))
+
+    def documentScrolled(self, value):  # 滚动到还没有新建的位置时，立即新建
+        loader = GlobalVars.CurrentDocument.loader
+        if loader:
+            loader.ensureHeight(value + self.DocWidget.documentScrollArea.viewport().height())
+
+    def trackTask(self, task, name):
+        """
+        在窗口标题显示后台任务的进度
+        """
+        task.progress.connect(lambda done, total: self.showProgress(name, done * 100 // max(total, 1)))
+        task.finished.connect(lambda result: self.showProgress())
+        task.failed.connect(lambda error: self.showProgress(name + "失败 " + error))
+        task.cancelled.connect(lambda: self.showProgress())
+
+    def showProgress(self, name=None, percent=None):
+        """
+        在窗口标题显示进度，没有参数时恢复标题，当前文档有没有保存的修改时标题后加*
+        """
+        title = "Doc"
+        document = GlobalVars.CurrentDocument
+        if document and document.autosave.isModified:
+            title += "*"
+        if name:
+            title += " - " + name
+        if percent is not None:
+            title += " {}%".format(percent)
+        self.DocWidget.setWindowTitle(title)
 
     def setTextColor(self):
         color = QColorDialog.getColor(GlobalVars.CurrentTextColor, self, title="选择文字颜色")
         GlobalVars.CurrentTextColor = color
-        if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态 待优化，多个段落反复更新坐标降低性能
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setTextColor"):
-                    block.setTextColor(color)
+        if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setTextColor"):
+                        block.setTextColor(color)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setTextColor"):
                 GlobalVars.CurrentBlock.setTextColor(color)
@@ -338,9 +399,10 @@ class ToolWidget(QWidget):
         color = QColorDialog.getColor(GlobalVars.CurrentBackgroundColor, self, title="选择背景颜色")
         GlobalVars.CurrentBackgroundColor = color
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setBackgroundColor"):
-                    block.setBackgroundColor(color)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setBackgroundColor"):
+                        block.setBackgroundColor(color)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setBackgroundColor"):
                 GlobalVars.CurrentBlock.setBackgroundColor(color)
@@ -350,9 +412,10 @@ class ToolWidget(QWidget):
         if ok:
             GlobalVars.CurrentFont = font
             if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-                for block in GlobalVars.CurrentDocument.SelBlocks:
-                    if hasattr(block, "setFont_"):
-                        block.setFont_(font)
+                with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                    for block in GlobalVars.CurrentDocument.SelBlocks:
+                        if hasattr(block, "setFont_"):
+                            block.setFont_(font)
             else:
                 if hasattr(GlobalVars.CurrentBlock, "setFont_"):
                     GlobalVars.CurrentBlock.setFont_(font)
@@ -362,9 +425,10 @@ class ToolWidget(QWidget):
         font.setFamily(family)
         GlobalVars.CurrentFont = font  # 更新当前字体
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setFontFamily"):
-                    block.setFontFamily(family)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setFontFamily"):
+                        block.setFontFamily(family)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setFontFamily"):
                 GlobalVars.CurrentBlock.setFontFamily(family)
@@ -377,9 +441,10 @@ class ToolWidget(QWidget):
         font.setItalic(italic)
         GlobalVars.CurrentFont = font  # 刷新界面
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setFontItalic"):
-                    block.setFontItalic(italic)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setFontItalic"):
+                        block.setFontItalic(italic)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setFontItalic"):
                 GlobalVars.CurrentBlock.setFontItalic(italic)
@@ -392,9 +457,10 @@ class ToolWidget(QWidget):
         font.setWeight(weight)
         GlobalVars.CurrentFont = font  # 刷新界面
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setFontWeight"):
-                    block.setFontWeight(weight)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setFontWeight"):
+                        block.setFontWeight(weight)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setFontWeight"):
                 GlobalVars.CurrentBlock.setFontWeight(weight)
@@ -405,9 +471,10 @@ class ToolWidget(QWidget):
         font.setPointSize(size)
         GlobalVars.CurrentFont = font  # 刷新界面
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setFontSize"):
-                    block.setFontSize(size)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setFontSize"):
+                        block.setFontSize(size)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setFontSize"):
                 GlobalVars.CurrentBlock.setFontSize(size)
@@ -417,9 +484,10 @@ class ToolWidget(QWidget):
     def setTitleLevel(self, titleLevel):
         GlobalVars.CurrentTitleLevel = titleLevel
         if GlobalVars.CurrentDocument.SelBlocks:  # 选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setTitleLevel"):
-                    block.setTitleLevel(titleLevel)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setTitleLevel"):
+                        block.setTitleLevel(titleLevel)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setTitleLevel"):
                 GlobalVars.CurrentBlock.setTitleLevel(titleLevel)
@@ -427,9 +495,10 @@ class ToolWidget(QWidget):
     def setLineSpacing(self, spacing):
         GlobalVars.CurrentLineSpacing = spacing
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setLineSpacing"):
-                    block.setLineSpacing(spacing)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setLineSpacing"):
+                        block.setLineSpacing(spacing)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setLineSpacing"):
                 GlobalVars.CurrentBlock.setLineSpacing(spacing)
@@ -443,70 +512,18 @@ class ToolWidget(QWidget):
                 policy = GlobalVars.relLineSpacingPolicy
         GlobalVars.CurrentLineSpacingPolicy = policy
         if GlobalVars.CurrentDocument.SelBlocks:  # 处于选中状态
-            for block in GlobalVars.CurrentDocument.SelBlocks:
-                if hasattr(block, "setLineSpacingPolicy"):
-                    block.setLineSpacingPolicy(policy)
+            with GlobalVars.CurrentDocument.layoutTransaction():  # 多个段落统一断行、分页
+                for block in GlobalVars.CurrentDocument.SelBlocks:
+                    if hasattr(block, "setLineSpacingPolicy"):
+                        block.setLineSpacingPolicy(policy)
         else:
             if hasattr(GlobalVars.CurrentBlock, "setLineSpacingPolicy"):
                 GlobalVars.CurrentBlock.setLineSpacingPolicy(policy)
         GlobalVars.currentLineSpacingPolicyPanel.listWidget.hide()
 
-    # 解析html格式 待优化,用beautifulsoap
+    # 解析html格式
     def analysisHtml(self, f):
-        document = Document()
-        text = f.readline()
-        while text:
-            if text.startswith("<body"):
-                document.documentWidth = int(self.analysisStyle(text)["width"][:-2])  # 去掉px字符
-            if text.startswith("<title"):
-                document.title = self.analysisText(text)
-            if text.startswith("<h1") or text.startswith("<h2") or text.startswith("<h3") or text.startswith("<h4"):
-                block = document.addTextBlock()
-                text_ = self.analysisText(text)  # 文本内容
-
-                block.addTextItem(text_, preTextItem=None)
-                exec("block.setTitleLevel_(GlobalVars.T{})".format(text[2]))
-            if text.startswith("<p"):
-                block = document.addTextBlock()
-            if text.startswith("<span"):
-                attr = self.analysisStyle(text)  # 属性
-                text = self.analysisText(text)  # 文本内容
-
-                font = QFont()
-                font.setFamily(attr["font-family"])
-                font.setPointSize(int(attr["font-size"][0:-2]))
-
-                textColor = attr["color"]
-                textColor = textColor[5:-1].split(",")
-                textColor = [int(textColor[i]) for i in range(3)] + [int(float(textColor[3]) * 255)]
-                textColor = QColor(*textColor)
-
-                backgroundColor = attr["background-color"]
-                if backgroundColor == "none":
-                    backgroundColor = None
-                else:
-                    backgroundColor = backgroundColor[5:-1].split(",")
-                    backgroundColor = [int(backgroundColor[i]) for i in range(3)] + [
-                        int(float(backgroundColor[3]) * 255)]
-                    backgroundColor = QColor(*backgroundColor)
-
-                block.addTextItem(text, font=font, textColor=textColor, backgroundColor=backgroundColor)
-            text = f.readline()
-        return document
-
-    # 分析html的style属性，返回字典
-    def analysisStyle(self, text):
-        text = re.search('style=".*"', text).group()  # style字段
-        attr = text[text.find('"') + 1:text.rfind('"')]  # 属性字段
-        attr = dict((i.split(":") for i in attr.split(";")))  # 属性转化为字典
-        return attr
-
-    # 分析html的字段，返回文字内容，限制在同一行
-    def analysisText(self, text):
-        text = re.search(">.*<", text).group()
-        text = text.strip(">")
-        text = text.lstrip("<")
-        return text
+        return htmlreader.readHtml(f)
 
 
 class DocWidget(QWidget):
@@ -524,9 +541,12 @@ class DocWidget(QWidget):
         self.toolWidget.move(0, 0)
 
         self.documentScrollArea = DocumentScrollArea(self)
+        self.documentScrollArea.verticalScrollBar().valueChanged.connect(self.toolWidget.documentScrolled)
         self.document = Document(self)
         self.documentScrollArea.setDocument(self.document)
-        self.document.addTextBlockWithTextItem()  # 初始化
+        self.toolWidget.watchDocument(self.document)
+        with self.document.journal.paused():  # 初始的段落不能撤销
+            self.document.addTextBlockWithTextItem()  # 初始化
 
         layout = QVBoxLayout()
         layout.addWidget(self.toolWidget)
@@ -551,6 +571,8 @@ def initialize():
     GlobalVars.T3 = globalvars.TitleLevel("三级标题", QFont("微软雅黑", pointSize=14, weight=QFont.Bold), toHtmlFormat="h3")
     GlobalVars.T4 = globalvars.TitleLevel("四级标题", QFont("微软雅黑", pointSize=12, weight=QFont.Bold), toHtmlFormat="h4")
     GlobalVars.CurrentTitleLevel = GlobalVars.T0  # 默认为正文格式
+    for t in GlobalVars.TitleLevels:  # 打开html时，各级标题对应的标签都由textBlock处理
+        GlobalVars.htmlFormat[t.toHtmlFormat] = TextBlock
 
 
 def main():
@@ -1,38 +1,103 @@
-from PySide2.QtWidgets import QWidget
-from PySide2.QtCore import Qt
-from PySide2.QtGui import QFont, QColor
+from bisect import bisect_left, bisect_right
+from contextlib import contextmanager
+from html import escape
+from PySide2.QtWidgets import QWidget, QShortcut
+from PySide2.QtCore import Qt, QEvent, QPoint
+from PySide2.QtGui import QFont, QColor, QKeySequence, QPainter, QMouseEvent, QFocusEvent
 from page import Page
-from test import test  # 测试
+from test import test, IsStats, dump  # 测试
 import globalvars
-from textblock import TextBlock
+from textblock import TextBlock, Cursor
 from block import Block
+from layout import placeBlock
+from journal import Journal
+from autosave import Autosave
 
 GlobalVars = globalvars.GlobalVars
 SelStatus = globalvars.SelStatus
+UpdateView = globalvars.UpdateView
 
 
+class BlockIndex():
+    """
+    各段在文档中的纵坐标范围，按段落顺序排列，拖动选择时二分查找鼠标所在的段落
+    分页或页面移动后失效，下一次使用时重新生成
+    """
+
+    def __init__(self, document):
+        self.blocks = []  # 所有段落，按顺序排列
+        self.tops = []  # 各段在文档中的起始纵坐标
+        self.bottoms = []  # 各段在文档中的结束纵坐标
+        block = document.RootBlock
+        while block:  # 待完善，没有考虑浮动段落的存在
+            pageY = block.page.PosY[0]
+            self.blocks.append(block)
+            self.tops.append(pageY + block.posY[0])
+            self.bottoms.append(pageY + block.posY[1])
+            block = block.nextBlock
+        self.positions = {block: i for i, block in enumerate(self.blocks)}  # 段落对应的序号
+
+    def lastAbove(self, posY):
+        """
+        返回起始纵坐标小于posY的最后一段的序号
+        """
+        return bisect_left(self.tops, posY) - 1
+
+    def firstBelow(self, posY):
+        """
+        返回结束纵坐标大于posY的第一段的序号
+        """
+        return bisect_right(self.bottoms, posY)
+
+
+# 文档是唯一的窗口，页面和段落都不是QWidget，文档只绘制可见的页面和段落
+# 鼠标事件交给所在位置的段落，键盘、输入法和焦点事件交给获得焦点的段落
 class Document(QWidget):
     @test("新建文档")
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.setFocusPolicy(Qt.NoFocus)  # 文档捕获的焦点
+        self.setFocusPolicy(Qt.ClickFocus)  # 点击获得焦点，再交给段落
+        self.setAttribute(Qt.WA_InputMethodEnabled)  # 接受输入法事件，交给获得焦点的段落
 
         self.initialization()  # 初始化，文档不包含任何block
+        self.cursor_ = Cursor(self)  # 所有段落共用的光标，页面和段落移动时随之移动
         self.DocumentWidth = GlobalVars.PageWidth  # 文档宽度
         self.path = ""  # 文档保存路径
         self.title = ""  # 文档标题
 
         self.SelArea = [0, 0, 0, 0]  # 鼠标拖选的起始点的横纵坐标和结束点的横纵坐标
         self.FirstSelBlock = None  # 当前获得焦点的块，也是第一个选中的块
-        self.SelBlocks = []  # 所有选中的块
+        self.selBlocks = []  # 所有选中的块，拖动时为None，用到时才由SelRange取出
+        self.SelRange = None  # 选中的段落范围，格式为(第一段的序号, 最后一段的序号, 是否向下选择)
+        self.blockIndex = None  # 各段的纵坐标索引，拖动选择时才生成
 
         # 新建页面
-        self.RootPage = self.LastPage = None
+        self.Pages = []  # 所有页面，按顺序排列
+        self.pageUpdateIndex = None  # 批量更新时，需要更新页码和位置的第一页的序号
+        self.pageUpdateLock = 0  # 大于0时处于批量更新状态，页面的变化统一在最后更新
+        self.estimatedHeight = 0  # 分批打开时估计的文档高度，全部分页后为0
+        self.loader = None  # 分批打开时为HtmlLoader，全部新建后为None
         page = self.addPage(None)  # 新建第一页
 
+        # 批量编辑
+        self.layoutLock = 0  # 大于0时处于批量编辑状态，断行、分页、光标统一在最后更新
+        self.dirtyBlocks = {}  # 批量编辑期间需要更新的段落，值为True表示需要重新断行
+        self.cursorBlock = None  # 批量编辑期间最后一个需要更新光标的段落
+        self.journal = Journal(self, GlobalVars.UndoDepth)  # 撤销记录
+        self.autosave = Autosave(self)  # 有保存路径时自动保存
+
         # 键盘按键
         self.isShiftPressed = False  # shift键是否按下
         self.isAltPressed = False  # alt键是否按下
+        # 复制粘贴、撤销重做的快捷键，所有段落共用
+        for key, func in (("ctrl+c", self.copy), ("ctrl+v", self.paste), ("ctrl+z", self.undo), ("ctrl+y", self.redo)):
+            shortcut = QShortcut(QKeySequence(key), self)
+            shortcut.setContext(Qt.WidgetWithChildrenShortcut)
+            shortcut.activated.connect(func)
+        if IsStats:  # 开启统计时，随时输出目前为止的统计结果，见test.py
+            shortcut = QShortcut(QKeySequence("ctrl+shift+d"), self)
+            shortcut.setContext(Qt.WidgetWithChildrenShortcut)
+            shortcut.activated.connect(lambda: dump())
 
         self.setAsCurrentDocument()
         self.show()
@@ -41,6 +106,26 @@ class Document(QWidget):
         GlobalVars.CurrentBlock = None
         self.RootBlock = None
         self.LastBlock = None
+        self.blockIndex = None
+        self.focusBlock = None  # 获得焦点的段落
+
+    def copy(self):
+        if GlobalVars.CurrentBlock:
+            GlobalVars.CurrentBlock.copy()
+
+    def paste(self):
+        if GlobalVars.CurrentBlock:
+            GlobalVars.CurrentBlock.paste()
+
+    def undo(self):
+        with self.journal.amending():  # 取消选择时整理文本条的修改，与之前的修改一起撤销
+            self.deSelEvent()  # 选中的内容可能不再存在
+        self.journal.undo()
+
+    def redo(self):
+        with self.journal.amending():
+            self.deSelEvent()
+        self.journal.redo()
 
     def setAsCurrentDocument(self):
         GlobalVars.CurrentDocument = self
@@ -95,14 +180,230 @@ class Document(QWidget):
         newPage = Page(self, page)
         return newPage
 
+    @property
+    def RootPage(self):
+        return self.Pages[0] if self.Pages else None
+
+    @property
+    def LastPage(self):
+        return self.Pages[-1] if self.Pages else None
+
+    def beginPageUpdate(self):
+        """
+        开始批量更新页面，期间页码、页面位置和文档大小只记录不更新
+        """
+        self.pageUpdateLock += 1
+
+    def endPageUpdate(self):
+        """
+        结束批量更新页面，统一更新页码、页面位置和文档大小
+        """
+        self.pageUpdateLock -= 1
+        if not self.pageUpdateLock and self.pageUpdateIndex is not None:
+            index = self.pageUpdateIndex
+            self.pageUpdateIndex = None
+            self.updatePages(index)
+
+    def updatePages(self, index=0):
+        """
+        从第index页开始，更新页码和页面位置，最后调整一次文档大小
+        """
+        if self.pageUpdateLock:  # 批量更新状态，只记录需要更新的第一页
+            if self.pageUpdateIndex is None or index < self.pageUpdateIndex:
+                self.pageUpdateIndex = index
+            return
+        pages = self.Pages
+        posY = pages[index - 1].PosY[1] if index else 0
+        for i in range(index, len(pages)):
+            page = pages[i]
+            page.PageNumber = i + 1
+            if page.PosY[0] != posY:
+                page.move(0, posY)
+            posY = page.PosY[1]
+        self.resize(GlobalVars.PageWidth, max(posY, self.estimatedHeight))
+        self.blockIndex = None  # 页面移动，各段的纵坐标改变
+        self.cursor_.updatePosition()
+        self.update()
+
+    def setEstimatedHeight(self, height):
+        """
+        分批打开时，按估计的高度设置文档大小，使滚动条接近最终的长度，为0时按实际的页面设置
+        """
+        self.estimatedHeight = height
+        self.resize(GlobalVars.PageWidth, max(self.LastPage.PosY[1], height))
+
+    def getBlockIndex(self):
+        """
+        返回各段的纵坐标索引，分页后第一次使用时重新生成
+        """
+        if self.blockIndex is None:
+            self.blockIndex = BlockIndex(self)
+        return self.blockIndex
+
+    @contextmanager
+    def layoutTransaction(self, startBlock=None):
+        """
+        批量编辑，期间段落的断行、分页和光标只做标记，结束时统一更新一次，可以嵌套
+        startBlock为已知的分页起点，如分批新建段落时上一批的最后一段，不需要从头查找第一个标记的段落
+        with document.layoutTransaction():
+            ...
+        """
+        self.layoutLock += 1
+        try:
+            yield self
+        finally:
+            self.layoutLock -= 1
+            if not self.layoutLock:
+                self.flushLayout(startBlock)
+
+    def markDirty(self, block, layout=False):
+        """
+        批量编辑时标记需要更新的段落，layout为True表示需要重新断行，否则只需要分页
+        """
+        self.dirtyBlocks[block] = layout or self.dirtyBlocks.get(block, False)
+
+    def unmarkDirty(self, block):
+        """
+        段落删除时取消标记
+        """
+        self.dirtyBlocks.pop(block, None)
+        if self.cursorBlock is block:
+            self.cursorBlock = None
+
+    @test("批量更新")
+    def flushLayout(self, startBlock=None):
+        """
+        批量编辑结束，需要断行的段落统一断行，再从第一个标记的段落开始分页一次，最后更新光标
+        """
+        dirtyBlocks = self.dirtyBlocks
+        if dirtyBlocks:
+            self.dirtyBlocks = {}
+            for block, layout in dirtyBlocks.items():
+                if layout:
+                    block.updateTextItems(UpdateView.updateNone)
+                block.update()
+            block = startBlock if startBlock and not startBlock.isDetached else self.RootBlock
+            while block and block not in dirtyBlocks:  # 第一个标记的段落
+                block = block.nextBlock
+            if block:
+                self.paginate(block, dirtyBlocks)
+        cursorBlock = self.cursorBlock
+        if cursorBlock:
+            self.cursorBlock = None
+            cursorBlock.updateCursor()
+
+    @test("分页")
+    def paginate(self, startBlock, dirtyBlocks=()):
+        """
+        分页，从startBlock开始依次计算各段所在的页面和纵坐标，全部计算完成后再统一移动
+        startBlock之后的某一段落在与之前相同的页面和位置时，后面的段落都不会变化，直接停止
+        dirtyBlocks为批量编辑时标记的段落，全部经过之后才能停止
+        """
+        self.beginPageUpdate()  # 新增和放大的页面最后统一更新
+        try:
+            self.paginateBlocks(startBlock, dirtyBlocks)
+        finally:
+            self.blockIndex = None  # 段落的位置或高度改变
+            self.endPageUpdate()
+
+    def paginateBlocks(self, startBlock, dirtyBlocks):  # 分页的具体过程，供paginate调用
+        moves = []  # 需要移动的段落，格式为(block, page, posY)
+        remaining = len(dirtyBlocks)  # 还没有经过的标记段落
+        resizedPage = None  # 第一个被放大的页面，之后页面的位置需要更新
+        preBlock = startBlock.preBlock
+        if preBlock:
+            page = preBlock.page
+            preBlockEndY = preBlock.posY[1]
+        block = startBlock
+        while block:
+            height = block.height()
+            if preBlock:  # 不是首段
+                posY = placeBlock(height, preBlockEndY, page.PageContentHeight, page.PageVerticalMargin)
+                if posY is None:  # 超过当前页的高度，需要移到下一页或新增页
+                    page = page.nextPage if page.nextPage else self.addPage(page)
+                    posY = page.PageVerticalMargin
+            else:
+                page = self.RootPage
+                posY = page.PageVerticalMargin
+            if posY == page.PageVerticalMargin and height > page.PageContentHeight:  # 段落高度超过了页面高度
+                page.PageHeight = height + page.PageVerticalMargin * 2  # 设置页面高度，保证每页至少能容纳一段
+                if resizedPage is None:
+                    resizedPage = page
+            if block in dirtyBlocks:  # 标记的段落高度可能改变，不能在此停止
+                remaining -= 1
+            elif not remaining and block is not startBlock and block.page is page and block.posY[0] == posY:
+                break  # 位置与之前相同，后面的段落不需要更新 待完善，没有考虑浮动段落的存在
+            moves.append((block, page, posY))
+            preBlockEndY = posY + height
+            preBlock = block
+            block = block.nextBlock
+
+        isBatch = len(moves) > 1
+        if isBatch:  # 统一移动，避免每一段都引起重绘
+            self.setUpdatesEnabled(False)
+        for b, p, posY in moves:
+            if b.page is not p:
+                b.setPage(p)
+            b.move(p.PageHorizontalMargin, posY)
+            if posY == p.PageVerticalMargin:  # 页面的第一段
+                p.firstBlock = b
+        if resizedPage:
+            resizedPage.updatePage()  # 更新后面页面的位置
+        if block is None:  # 已经是最后一段，删除无用的页面
+            while self.LastPage is not page and self.LastPage.prePage:
+                self.LastPage.delPage()  # 删除空页 待完善，没有考虑浮动段落的存在
+        if isBatch:
+            self.setUpdatesEnabled(True)
+        if moves:
+            self.cursor_.updatePosition()
+
     @test("导出html")
     def toHtml(self):
         """
-        导出html格式
+        导出html格式，返回整个文档的文字，兼容旧的接口
+        """
+        return "".join(self.iterHtml())
+
+    def writeHtml(self, f):
+        """
+        将html逐段写入文件对象f，不会在内存中拼接整个文档
+        """
+        write = f.write
+        for text in self.iterHtml():
+            write(text)
+
+    def iterHtml(self):
+        """
+        依次生成html的各个部分，按段落输出
+        """
+        yield self.htmlHead()
+        # 待完善 只处理段落，没有处理页面
+        block = self.RootBlock
+        while block:
+            yield from block.iterHtml()
+            yield "\n"
+            block = block.nextBlock
+        yield self.htmlTail()
+
+    def snapshot(self, optimize=True):
+        """
+        复制导出需要的数据，返回由字符串和段落快照组成的列表，交给后台线程生成html并写入文件
+        """
+        parts = [self.htmlHead()]
+        block = self.RootBlock
+        while block:
+            parts.append(block.snapshot(optimize))
+            parts.append("\n")
+            block = block.nextBlock
+        parts.append(self.htmlTail())
+        return parts
+
+    def htmlHead(self):
+        """
+        返回段落之前的部分，包括标题格式、文档标题和宽度
         """
-        # text表示输出的html文字
-        text = "<html>\n<style>\n"
         # css格式，定义标题关键字的格式
+        text = "<html>\n<style>\n"
         for t in GlobalVars.TitleLevels:  # 将标题格式记录到css,包括默认正文格式
             font = t.font
             fontFamily = font.family()
@@ -129,20 +430,79 @@ class Document(QWidget):
                 textColor,
                 backgroundColor)
         text += '</style>\n<head>\n'
-        text += '<title>{}</title>\n'.format(self.title)
+        text += '<title>{}</title>\n'.format(escape(self.title, quote=False))
         text += '<docversion style="docVersion:{}"></docversion>\n'.format(GlobalVars.DocVersion)
         text += '</head>\n<body style="width:{}px">\n'.format(self.DocumentWidth)
-        # 待完善 只处理段落，没有处理页面
-        block = self.RootBlock
-        while block:
-            text += block.toHtml() + "\n"
-            block = block.nextBlock
-        text += '</body>\n</html>'
-        print(text)
         return text
 
-    def update(self):
-        super().update()
+    def htmlTail(self):
+        return '</body>\n</html>'
+
+    def pagesIn(self, top, bottom):
+        """
+        依次返回与纵坐标范围[top, bottom]相交的页面，二分查找第一页
+        """
+        pages = self.Pages
+        low, high = 0, len(pages)
+        while low < high:  # 第一个结束纵坐标大于top的页面
+            mid = (low + high) // 2
+            if pages[mid].PosY[1] <= top:
+                low = mid + 1
+            else:
+                high = mid
+        while low < len(pages) and pages[low].PosY[0] <= bottom:
+            yield pages[low]
+            low += 1
+
+    def blocksIn(self, top, bottom):
+        """
+        依次返回与纵坐标范围[top, bottom]相交的段落，从页面的第一段开始查找
+        """
+        for page in self.pagesIn(top, bottom):
+            pageY = page.PosY[0]
+            block = page.firstBlock
+            while block and block.page is page:  # 待完善，没有考虑浮动段落的存在
+                if pageY + block.posY[0] > bottom:
+                    return
+                if pageY + block.posY[1] > top:
+                    yield block
+                block = block.nextBlock
+
+    def blockAt(self, x, y):
+        """
+        返回文档坐标(x, y)处的段落，没有时返回None
+        """
+        for block in self.blocksIn(y, y):
+            if block.posX <= x < block.posX + block.width():
+                return block
+        return None
+
+    def toBlockEvent(self, event, block):
+        """
+        将鼠标事件的坐标转换为段落中的坐标
+        """
+        pos = event.localPos() - QPoint(block.posX, block.page.PosY[0] + block.posY[0])
+        return QMouseEvent(event.type(), pos, event.button(), event.buttons(), event.modifiers())
+
+    def paintEvent(self, event):
+        rect = event.rect()
+        top, bottom = rect.top(), rect.bottom()
+        p = QPainter(self)
+        for page in self.pagesIn(top, bottom):
+            page.paint(p)
+        for block in self.blocksIn(top, bottom):
+            offset = QPoint(block.posX, block.page.PosY[0] + block.posY[0])
+            area = rect.translated(-offset).intersected(block.rect())  # 段落中需要重绘的区域
+            if area.isEmpty():
+                continue
+            p.save()
+            p.translate(offset)
+            p.setClipRect(area)
+            block.paint(p, area)
+            p.restore()
+
+    def update(self, *args):
+        super().update(*args)
         return  # 测试，对所有块进行重绘，显示当前选中的块，rootBlock lastBlock
         block = self.RootBlock
         while block:
@@ -157,7 +517,18 @@ class Document(QWidget):
         if self.SelBlocks:
             for block in self.SelBlocks:
                 block.deSelEvent()  # 对每个block进行操作
-            self.SelBlocks = []  # 没有选中的块
+        self.selBlocks = []  # 没有选中的块
+        self.SelRange = None
+
+    @property
+    def SelBlocks(self):
+        """
+        所有选中的块，拖动选择时不逐次生成，第一次用到时才从段落索引中取出，之后不随段落的增删改变
+        """
+        if self.selBlocks is None:
+            start, end = self.SelRange[:2]
+            self.selBlocks = self.getBlockIndex().blocks[start:end + 1]
+        return self.selBlocks
 
     def delSelected(self):
         """
@@ -167,21 +538,63 @@ class Document(QWidget):
             b.delSelected()  # 对每个block进行操作
         self.deSelEvent()  # 清空选择
 
-    def keyPressEvent(self, event):  # 选中状态有document处理空格
-        super().keyPressEvent(event)
+    def setFocusBlock(self, block):
+        """
+        block获得焦点，原来获得焦点的段落失去焦点，文档没有焦点时，在文档获得焦点时通知block
+        """
+        focusBlock = self.focusBlock
+        if focusBlock is not block:
+            self.focusBlock = block
+            if self.hasFocus():
+                if focusBlock:
+                    focusBlock.focusOutEvent(QFocusEvent(QEvent.FocusOut))
+                block.focusInEvent(QFocusEvent(QEvent.FocusIn))
+        self.setFocus()
+
+    def focusInEvent(self, event):
+        super().focusInEvent(event)
+        if self.focusBlock:
+            self.focusBlock.focusInEvent(event)
+
+    def focusOutEvent(self, event):
+        super().focusOutEvent(event)
+        if self.focusBlock:
+            self.focusBlock.focusOutEvent(event)
+
+    def inputMethodEvent(self, event):
+        if self.focusBlock:
+            self.focusBlock.inputMethodEvent(event)
+        event.accept()
+
+    def inputMethodQuery(self, query):
+        if query == Qt.ImCursorRectangle and self.cursor_.block:  # 输入法的候选框显示在光标处
+            return self.cursor_.geometry()
+        return super().inputMethodQuery(query)
+
+    def keyPressEvent(self, event):  # 先交给获得焦点的段落，段落不处理时（选中状态）由document处理
+        if self.focusBlock:
+            event.accept()
+            self.focusBlock.keyPressEvent(event)
+            if event.isAccepted():
+                return
         event.accept()  # 事件不再向上传递
         key = event.key()
         if key == Qt.Key_Backspace:  # 选择状态下的退格删除命令
             self.delSelected()  # 此函数会判断是否有选中的内容
 
     def mouseDoubleClickEvent(self, event):
-        super().mouseDoubleClickEvent(event)
         event.accept()
+        block = self.blockAt(event.x(), event.y())
+        if block:  # 与QWidget相同，双击时段落先按单击处理
+            block.mousePressEvent(self.toBlockEvent(event, block))
         self.addTextBlockWithTextItem()  # 双击增加新的文本段落
 
     def mousePressEvent(self, event):
-        super().mousePressEvent(event)
         event.accept()
+        block = self.blockAt(event.x(), event.y())
+        if block:  # 点击的段落获得焦点，先处理点击
+            block.setFocus()
+            block.mousePressEvent(self.toBlockEvent(event, block))
 
         if self.SelBlocks:  # 之前选中了块# 取消之前的选择
             self.deSelEvent()
@@ -197,42 +610,65 @@ class Document(QWidget):
         super().mouseReleaseEvent(event)
         event.accept()
         self.mouseMoveAndReleaseEvent(event)
+        if self.SelRange:  # 拖动结束，确认选中的内容
+            isDown = self.SelRange[2]
+            for block in self.SelBlocks:
+                if isDown:
+                    block.downSelConfirmEvent()
+                else:
+                    block.upSelConfirmEvent()
 
     def mouseMoveAndReleaseEvent(self, event):  # 拖动选择事件，供mouseMoveEvent 和mouseReleaseEvent使用
         x, y = event.x(), event.y()
         self.SelArea[2], self.SelArea[3] = x, y
         x1 = x - self.SelArea[0]
         y1 = y - self.SelArea[1]  # 坐标y的差值
-        if self.SelBlocks:  # 每一次移动，先取消之前选中的块
-            for block in self.SelBlocks:
-                block.deSelEvent()
-                self.SelBlocks = []
-
-        block = self.FirstSelBlock
-        if y1 > 3 or x1 > 2:  # 向下选择
-            while block:
-                if block.page.mapToParent(block.pos()).y() < y:  # 待优化，记录block的全局坐标
-                    block.SelStatus = SelStatus.SelAll  # 第一个和最后一个是部分选中
-                    self.SelBlocks.append(block)
-                    block = block.nextBlock
+        blockIndex = self.getBlockIndex()
+        first = blockIndex.positions.get(self.FirstSelBlock)  # 第一个选中的块的序号
+        if first is None:  # 没有点击任何段落
+            return
+
+        if y1 > 3 or x1 > 2:  # 向下选择，到起始纵坐标在鼠标之上的最后一段为止
+            self.updateSelection((first, max(blockIndex.lastAbove(y), first), True))
+        elif y1 < -3 or x1 < -2:  # 向上选择，到结束纵坐标在鼠标之下的第一段为止
+            self.updateSelection((min(blockIndex.firstBelow(y), first), first, False))
+        else:
+            self.deSelEvent()
+
+    def updateSelection(self, selRange):
+        """
+        根据新的选择范围更新选中的段落，只处理进入、离开范围以及首尾发生变化的段落，其余段落保持不变
+        selRange的格式与SelRange相同，首尾两段部分选中，中间的段落全部选中
+        """
+        blocks = self.getBlockIndex().blocks
+        start, end, isDown = selRange
+        if self.SelRange and self.SelRange[2] == isDown:
+            oldStart, oldEnd = self.SelRange[:2]
+            for i in range(oldStart, min(oldEnd + 1, start)):  # 离开选择范围的段落
+                blocks[i].deSelEvent()
+            for i in range(max(oldStart, end + 1), oldEnd + 1):
+                blocks[i].deSelEvent()
+            changed = {oldStart, oldEnd}  # 原来的首尾两段可能变为全部选中
+        else:  # 选择的方向改变，全部重新选择
+            self.deSelEvent()
+            oldStart, oldEnd = start, start - 1
+            changed = set()
+        changed.update(range(start, min(oldStart, end + 1)))  # 新进入选择范围的段落
+        changed.update(range(max(oldEnd + 1, start), end + 1))
+        changed.update((start, end))  # 首尾两段的选中部分随鼠标改变
+
+        for i in changed:
+            if start <= i <= end:
+                block = blocks[i]
+                if block.SelStatus:
+                    block.deSelEvent()
+                if i == start or i == end:  # 有缺陷，认为不可能恰好完整的选取选中的第一段和最后一段
+                    block.SelStatus = SelStatus.SelPart
                 else:
-                    break
-            self.SelBlocks[0].SelStatus = SelStatus.SelPart  # 有缺陷，认为不可能恰好完整的选取选中的第一段和最后一段
-            self.SelBlocks[len(self.SelBlocks) - 1].SelStatus = SelStatus.SelPart
-            for b in self.SelBlocks:  # 可优化，与上面合并，但会另增判断
-                b.downSelEvent()  # 块向下选中时的事件
-
-        elif y1 < -3 or x1 < -2:  # 向上选择
-            while block:
-                if block.posY[1] > y:
-                    block.SelStatus = SelStatus.SelAll  # 第一个和最后一个是部分选中
-                    self.SelBlocks.append(block)
-                    block = block.preBlock
+                    block.SelStatus = SelStatus.SelAll
+                if isDown:
+                    block.downSelEvent()  # 块向下选中时的事件
                 else:
-                    break
-            self.SelBlocks[0].SelStatus = SelStatus.SelPart  # 有缺陷，认为不肯能恰好完整的选取选中的第一段和最后一段
-            self.SelBlocks[len(self.SelBlocks) - 1].SelStatus = SelStatus.SelPart
-            for b in self.SelBlocks:  # 可优化，与上面合并，但会另增判断
-                b.upSelEvent()  # 块向下选中时的事件
-
-        self.update()
+                    block.upSelEvent()
+        self.SelRange = selRange
+        self.selBlocks = None  # 用到时再生成
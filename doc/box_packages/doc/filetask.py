@@ -0,0 +1,68 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from PySide2.QtCore import QObject, Signal, QTimer
+
+SharedExecutor = ThreadPoolExecutor(max_workers=2)  # 没有指定线程时使用，如打开文档、另存为
+
+
+class TaskCancelled(Exception):
+    """
+    后台任务被取消
+    """
+
+
+class FileTask(QObject):
+    """
+    在后台线程中执行func(*args, task=self)，func只能使用不会改变的数据，如文档快照、文件路径
+    func通过task.report报告进度，并经常调用task.checkCancel，取消时停止
+    进度和结果通过信号返回界面线程
+    """
+    progress = Signal(int, int)  # 已完成的数量, 总数
+    finished = Signal(object)  # func的返回值
+    failed = Signal(str)
+    cancelled = Signal()
+    tasks = set()  # 正在执行的任务，避免信号传递之前被回收
+
+    def __init__(self, func, *args, executor=None):
+        super().__init__()
+        self.func = func
+        self.args = args
+        self.executor = executor or SharedExecutor  # 同一个executor只有一个线程时，任务按提交的顺序执行
+        self.cancelEvent = threading.Event()
+        self.future = None
+        for signal in (self.finished, self.failed, self.cancelled):
+            signal.connect(self.release)
+
+    def start(self):
+        FileTask.tasks.add(self)
+        self.future = self.executor.submit(self.run)
+        return self
+
+    def run(self):  # 在后台线程中执行
+        try:
+            result = self.func(*self.args, task=self)
+        except TaskCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit("{}: {}".format(type(e).__name__, e))
+        else:
+            self.finished.emit(result)
+
+    def release(self):  # 在界面线程中执行，等其他连接的函数都执行完之后再释放
+        QTimer.singleShot(0, lambda: FileTask.tasks.discard(self))
+
+    def report(self, done, total):
+        self.progress.emit(done, total)
+
+    def checkCancel(self):
+        if self.cancelEvent.is_set():
+            raise TaskCancelled()
+
+    def cancel(self):
+        self.cancelEvent.set()
+
+    def wait(self):
+        """
+        等待后台执行结束，信号仍在界面线程的事件循环中传递
+        """
+        self.future.result()
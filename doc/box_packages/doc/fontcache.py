@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from itertools import accumulate
+from PySide2.QtGui import QFontMetrics
+
+
+class FontAdvances():
+    """
+    某一字体的字符宽度表，所有使用该字体的textItem共用，测量文字宽度时查表即可，不需要反复调用Qt
+    常用字符（拉丁字母、标点、常用汉字等）长期保存，其余生僻字符放到有容量限制的LRU中
+    """
+    CommonCodePointLimit = 0xA000  # 码位小于此值的字符长期保存，包括中日韩统一表意文字基本区
+    RareCacheSize = 2048  # 生僻字符最多缓存的数量
+
+    def __init__(self, font):
+        self.fontMetrics = QFontMetrics(font)
+        self.height = self.fontMetrics.height()
+        self.table = {}  # 常用字符的宽度表
+        self.rareTable = OrderedDict()  # 生僻字符的宽度，按最近使用排序
+
+    def charWidth(self, c):
+        """
+        返回单个字符的宽度
+        """
+        w = self.table.get(c)
+        if w is not None:
+            return w
+        if ord(c) < self.CommonCodePointLimit:
+            w = self.table[c] = self.fontMetrics.width(c)
+            return w
+        rareTable = self.rareTable
+        w = rareTable.get(c)
+        if w is None:
+            w = rareTable[c] = self.fontMetrics.width(c)
+            if len(rareTable) > self.RareCacheSize:
+                rareTable.popitem(last=False)  # 删除最久没有使用的字符
+        else:
+            rareTable.move_to_end(c)
+        return w
+
+    def width(self, text):
+        """
+        返回文字的宽度，等于每个字符宽度之和
+        """
+        table = self.table
+        try:
+            return sum([table[c] for c in text])  # 绝大多数情况，全部字符都已经在表中
+        except KeyError:
+            charWidth = self.charWidth
+            return sum([charWidth(c) for c in text])
+
+    def prefixWidths(self, text):
+        """
+        返回文字的累计宽度，第i项为前i个字符的宽度，长度为len(text)+1
+        """
+        table = self.table
+        try:
+            widths = [table[c] for c in text]
+        except KeyError:
+            charWidth = self.charWidth
+            widths = [charWidth(c) for c in text]
+        return [0] + list(accumulate(widths))
+
+
+FontAdvancesTable = {}  # 全局的字符宽度表，以字体的key区分
+
+
+def getFontAdvances(font):
+    """
+    返回字体对应的字符宽度表，同一字体只会创建一次
+    """
+    key = font.key()
+    fontAdvances = FontAdvancesTable.get(key)
+    if fontAdvances is None:
+        fontAdvances = FontAdvancesTable[key] = FontAdvances(font)
+    return fontAdvances
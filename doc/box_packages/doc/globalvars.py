@@ -22,6 +22,15 @@ class SelStatus():
     SelPart = 2  # 部分选中
 
 
+class UpdateView():
+    """
+    决定是否立马更新视图等
+    当需要界面更新时候,会更新坐标、大小、光标 等,反之,只更新基本属性即可，以节约性能
+    """
+    updateNone = 0  # 不更新
+    updateAll = 1  # 更新所有，会影响后面的部分
+
+
 # 全局变量设置
 class GlobalVars_Class():
     def __init__(self):
@@ -54,6 +63,17 @@ class GlobalVars_Class():
         self.TitleLevels = []  # 不同的标题等级的集合，如正文、一级标题等，标题格式在doc中定义，否则会出现pointsize计算不准确的问题
         # 读取html
         self.htmlFormat = {}  # 不同的html标签对应的类，决定了html格式如何打开
+        self.FileBufferSize = 1024 * 64  # 读写文件时的缓冲区大小
+        self.BuildTimeSlice = 20  # 后台打开文件时，每批新建段落的最长时间，单位为毫秒
+        self.ScrollBuildTimeSlice = 100  # 滚动到还没有新建的位置时，立即新建段落的最长时间，单位为毫秒
+        self.FirstScreenPages = 2  # 分批打开时，新建完前几页就先显示文档
+        # 绘制
+        self.RenderCacheBudget = 1024 * 1024 * 64  # 段落绘制缓存最多占用的内存，单位为字节
+        # 撤销
+        self.UndoDepth = 200  # 最多可以撤销的次数，连续输入的文字算一次
+        # 自动保存
+        self.AutosaveInterval = 1000  # 修改后多久写入日志，单位为毫秒
+        self.AutosaveLogLimit = 1024 * 1024  # 日志超过此大小时写入完整的文档，单位为字符
 
         return super().__init__()
 
@@ -0,0 +1,534 @@
+import os
+import re
+import mmap
+from array import array
+from time import perf_counter
+from html.parser import HTMLParser
+from PySide2.QtGui import QFont, QColor
+from PySide2.QtCore import QObject, Signal, QTimer
+from document import Document
+from textblock import keepCurrent
+from autosave import readLog
+from filetask import FileTask
+import globalvars
+
+GlobalVars = globalvars.GlobalVars
+
+
+# 解析Document.toHtml导出的html格式，先生成中间结构，再统一新建段落
+# 解析只生成python对象，可以在后台线程中进行，QFont、QColor等到新建段落时才在界面线程中生成
+def parseStyle(text):
+    """
+    分析html的style属性，返回字典，如"width:960px; lineSpacing:0.25"
+    """
+    attr = {}
+    for i in text.split(";"):
+        key, sep, value = i.partition(":")
+        if sep:
+            attr[key.strip()] = value.strip()
+    return attr
+
+
+def parseColor(text):
+    """
+    将rgba(0, 0, 0, 1.0)格式转换为(r, g, b, a)，none返回None
+    """
+    if not text or text == "none":
+        return None
+    color = text[text.find("(") + 1:text.rfind(")")].split(",")
+    return int(color[0]), int(color[1]), int(color[2]), int(float(color[3]) * 255)
+
+
+def parseSize(text, default=None):
+    """
+    去掉px、pt等单位，返回数值
+    """
+    try:
+        return float(text.rstrip("ptx"))
+    except (AttributeError, ValueError):
+        return default
+
+
+class HtmlItem():
+    """
+    span对应的文本条，记录文字和格式
+    """
+
+    def __init__(self, style):
+        self.text = ""
+        self.fontFamily = style.get("font-family")  # 没有时使用当前字体
+        self.fontSize = parseSize(style.get("font-size"))
+        self.italic = style.get("font-style") == "italic"
+        self.bold = style.get("font-weight") == "bold"
+        self.rgba = parseColor(style.get("color")) or (0, 0, 0, 255)
+        self.backgroundRgba = parseColor(style.get("background-color"))
+
+    @property
+    def font(self):
+        font = QFont()
+        font.setFamily(self.fontFamily or GlobalVars.CurrentFont.family())
+        font.setPointSize(int(self.fontSize or GlobalVars.CurrentFont.pointSize()))
+        font.setItalic(self.italic)
+        font.setBold(self.bold)
+        return font
+
+    @property
+    def textColor(self):
+        return QColor(*self.rgba)
+
+    @property
+    def backgroundColor(self):
+        return QColor(*self.backgroundRgba) if self.backgroundRgba else None
+
+
+class HtmlBlock():
+    """
+    段落或标题，记录标签、行距和其中的文本条
+    """
+
+    def __init__(self, tag, style):
+        self.tag = tag  # 如p h1 h2
+        self.width = parseSize(style.get("width"))
+        self.lineSpacing = parseSize(style.get("lineSpacing"))
+        lineSpacingPolicy = parseSize(style.get("lineSpacingPolicy"))
+        self.lineSpacingPolicy = None if lineSpacingPolicy is None else int(lineSpacingPolicy)
+        self.text = ""  # 标题的文字
+        self.items = []  # 正文的各个span
+
+
+class HtmlReader(HTMLParser):
+    """
+    增量解析html，可以分多次feed，结果保存在blocks等属性中
+    """
+    HeadTags = ("html", "style", "head", "title", "docversion", "body")  # 不属于段落的标签
+
+    def __init__(self):
+        super().__init__()  # convert_charrefs默认为True，文字中的转义字符会自动还原
+        self.title = ""
+        self.documentWidth = None
+        self.docVersion = None
+        self.blocks = []
+        self.currentTag = None  # 正在读取的非段落标签，如title
+        self.currentBlock = None  # 正在读取的段落
+        self.currentItem = None  # 正在读取的span
+
+    def handle_starttag(self, tag, attrs):
+        style = parseStyle(dict(attrs).get("style") or "")
+        if tag in self.HeadTags:
+            self.currentTag = tag
+            if tag == "body":
+                self.documentWidth = parseSize(style.get("width"))
+            elif tag == "docversion":
+                self.docVersion = parseSize(style.get("docVersion"))
+        elif self.currentBlock is None:  # 新的段落
+            self.currentBlock = HtmlBlock(tag, style)
+            self.blocks.append(self.currentBlock)
+        elif tag == "span":
+            self.currentItem = HtmlItem(style)
+            self.currentBlock.items.append(self.currentItem)
+
+    def handle_endtag(self, tag):
+        if self.currentItem and tag == "span":
+            self.currentItem = None
+        elif self.currentBlock and tag == self.currentBlock.tag:
+            self.currentBlock = None
+            self.currentItem = None
+        elif tag == self.currentTag:
+            self.currentTag = None
+
+    def handle_data(self, data):
+        if self.currentItem:
+            self.currentItem.text += data
+        elif self.currentBlock:
+            self.currentBlock.text += data
+        elif self.currentTag == "title":
+            self.title += data
+
+
+def readHtml(f):
+    """
+    分块读取html文件f并解析，返回新建的文档
+    """
+    reader = HtmlReader()
+    size = GlobalVars.FileBufferSize
+    text = f.read(size)
+    while text:
+        reader.feed(text)
+        text = f.read(size)
+    reader.close()
+    return buildDocument(reader)
+
+
+def parseHtml(path, task=None):
+    """
+    解析html文件，同时读取自动保存的日志，返回(解析结果, 日志)，在后台线程中调用，有检查点时解析检查点
+    Document.toHtml导出的文件用MappedHtml只建立段落索引，其他文件完整解析
+    task为后台任务时按读取的字节数报告进度，并在取消时停止
+    """
+    log = readLog(path)
+    if log:
+        path = log[0]
+    reader = None
+    if os.path.getsize(path):  # 空文件不能mmap
+        reader = MappedHtml(path, task)
+        if reader.docVersion is None:  # 不是本程序导出的文件，段落不一定从行首开始
+            reader.close()
+            reader = None
+    return reader or readHtmlFile(path, task), log
+
+
+def readHtmlFile(path, task=None):
+    """
+    分块读取并完整解析html文件，返回HtmlReader
+    """
+    reader = HtmlReader()
+    total = os.path.getsize(path)
+    with open(path, "r", encoding="UTF-8") as f:  # 文本模式，换行统一为\n
+        text = f.read(GlobalVars.FileBufferSize)
+        while text:
+            reader.feed(text)
+            if task:
+                task.checkCancel()
+                task.report(f.buffer.tell(), total)  # 已经读取的字节数
+            text = f.read(GlobalVars.FileBufferSize)
+    reader.close()
+    return reader
+
+
+def decodeText(data):  # 与文本模式读取相同，换行统一为\n
+    return data.decode("UTF-8", "replace").replace("\r\n", "\n").replace("\r", "\n")
+
+
+BlockStartPattern = re.compile(rb"\n<(?:p|h[1-4])[ >]")  # Document.toHtml导出的段落都从行首开始，文字中的<已经转义，以\n开头查找更快
+
+
+class MappedHtml():
+    """
+    用mmap打开Document.toHtml导出的html文件，只解析段落之前的部分，并建立各段起始位置的索引
+    可以像列表一样按序号取得HtmlBlock，取得时才解码和解析这一段，打开大文件时只读取需要的部分
+    """
+    ChunkSize = 1024 * 1024 * 16  # 建立索引时每次查找的大小，之间报告进度
+
+    def __init__(self, path, task=None):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.offsets = self.buildIndex(task)
+        except BaseException:
+            self.close()
+            raise
+        reader = HtmlReader()  # 标题、宽度等在第一段之前
+        reader.feed(decodeText(self.map[:self.offsets[0]]))
+        self.title = reader.title
+        self.documentWidth = reader.documentWidth
+        self.docVersion = reader.docVersion
+
+    def buildIndex(self, task=None):
+        """
+        返回各段的起始位置，最后一项为最后一段的结束位置
+        """
+        data = self.map
+        size = len(data)
+        end = data.rfind(b"</body>")
+        if end < 0:
+            end = size
+        offsets = array("q")
+        for start in range(0, end, self.ChunkSize):
+            stop = min(start + self.ChunkSize, end)
+            for match in BlockStartPattern.finditer(data, start, min(stop + 8, end)):  # 多查找几个字节，避免标签被分开
+                if match.start() >= stop:
+                    break
+                offsets.append(match.start() + 1)  # 跳过\n
+            if task:
+                task.checkCancel()
+                task.report(stop, size)
+        offsets.append(end)
+        return offsets
+
+    @property
+    def blocks(self):  # 与HtmlReader一致
+        return self
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        reader = HtmlReader()
+        reader.feed(decodeText(self.map[self.offsets[index]:self.offsets[index + 1]]))
+        reader.close()
+        return reader.blocks[0] if reader.blocks else HtmlBlock("", {})  # 不支持的段落新建时忽略
+
+    def close(self):
+        """
+        关闭文件，之后不能再取得段落，保存前必须关闭，否则有些系统不能替换文件
+        """
+        self.map.close()
+        self.file.close()
+
+
+def newDocument(reader):
+    """
+    根据解析的结果新建空白文档
+    """
+    document = Document()
+    document.title = reader.title
+    if reader.documentWidth:
+        document.DocumentWidth = int(reader.documentWidth)
+    return document
+
+
+def buildBlock(document, preBlock, htmlBlock):
+    """
+    在preBlock后新建段落，返回新建的段落，不支持的标签返回None
+    """
+    blockClass = GlobalVars.htmlFormat.get(htmlBlock.tag)
+    return blockClass.fromHtml(document, preBlock, htmlBlock) if blockClass else None  # 待完善，不支持的标签直接忽略
+
+
+def buildDocument(reader):
+    """
+    根据解析的结果新建文档，段落新建时不分页，全部断行后统一分页一次
+    """
+    document = newDocument(reader)
+    block = None
+    with document.journal.paused(), document.layoutTransaction():  # 打开的文档不能撤销
+        for htmlBlock in reader.blocks:
+            block = buildBlock(document, block, htmlBlock) or block
+    return document
+
+
+def restoreLog(document, path, log):
+    """
+    新建的文档对应文件path，有自动保存的日志时，重放上一次检查点之后的修改
+    恢复的修改只在内存中，写入检查点，文档文件在保存之前不变
+    """
+    document.path = path
+    autosave = document.autosave
+    isRestored = bool(log) and replayLog(document, *log[1:])
+    isFromCheckpoint = bool(log) and log[0] != path  # 从检查点打开，包含上次没有保存的修改
+    if isRestored:
+        autosave.checkpoint()  # 重新开始记录日志
+    else:
+        autosave.startLog(isFromCheckpoint)
+    autosave.setModified(isRestored or isFromCheckpoint)
+
+
+def openHtml(path):
+    """
+    打开html文件，返回新建的文档，会阻塞界面，大文件使用HtmlLoader
+    """
+    log = readLog(path)
+    with open(log[0] if log else path, "r", encoding="UTF-8") as f:  # 有检查点时打开检查点
+        document = readHtml(f)
+    restoreLog(document, path, log)
+    return document
+
+
+def closeReader(reader):  # 关闭MappedHtml映射的文件
+    if isinstance(reader, MappedHtml):
+        reader.close()
+
+
+class HtmlLoader(QObject):
+    """
+    后台打开html文件，解析在后台线程中进行，新建段落在界面线程中分批进行，每批不超过BuildTimeSlice毫秒，不会阻塞界面
+    progressive为True时，前FirstScreenPages页新建完成后就通过ready返回文档，先显示出来，其余段落继续分批新建
+    没有新建的部分按已新建段落的平均高度估计文档高度，滚动到还没有新建的位置时优先新建
+    进度为百分比，解析占前一半，新建段落占后一半，全部完成后发出finished
+    """
+    progress = Signal(int)
+    ready = Signal(object)  # 可以显示的文档
+    finished = Signal(object)
+    failed = Signal(str)
+    cancelled = Signal()
+
+    def __init__(self, path, progressive=True):
+        super().__init__()
+        self.path = path
+        self.progressive = progressive
+        self.task = None
+        self.document = None
+        self.log = None
+        self.htmlBlocks = []
+        self.index = 0  # 下一个要新建的段落
+        self.block = None  # 最后新建的段落
+        self.isReady = False
+        self.isCancelled = False
+        self.isFinished = False
+
+    def start(self):
+        self.task = FileTask(parseHtml, self.path)
+        self.task.progress.connect(lambda done, total: self.progress.emit(done * 50 // max(total, 1)))
+        self.task.finished.connect(self.parsed)
+        self.task.failed.connect(self.failed)
+        self.task.cancelled.connect(self.cancelled)
+        self.task.start()
+        return self
+
+    def parsed(self, result):
+        reader, self.log = result
+        if self.isCancelled:  # 解析完成后才取消
+            closeReader(reader)
+            self.cancelled.emit()
+            return
+        self.htmlBlocks = reader.blocks
+        if self.log and self.log[2]:  # 需要恢复自动保存的修改，全部新建后才能显示和编辑
+            self.progressive = False
+        with keepCurrent():  # 正在编辑的文档不受影响
+            self.document = newDocument(reader)
+        self.document.hide()  # 可以显示时再显示
+        self.document.loader = self
+        self.buildSlice()
+
+    def builtHeight(self):  # 已新建的段落占用的高度
+        lastPage = self.document.LastPage
+        return lastPage.PosY[1] if lastPage else 0
+
+    def buildBlocks(self, timeSlice):
+        """
+        新建一批段落，用时不超过timeSlice毫秒
+        本批结束时从上一批的最后一段开始分页，不需要遍历之前的段落
+        """
+        document = self.document
+        htmlBlocks = self.htmlBlocks
+        block = self.block
+        if block and block.isDetached:  # 最后新建的段落已经被用户删除，继续添加到文档末尾
+            block = document.LastBlock
+        deadline = perf_counter() + timeSlice / 1000
+        with keepCurrent(), document.journal.paused(), document.layoutTransaction(block):  # 新建的段落不能撤销
+            while self.index < len(htmlBlocks) and perf_counter() < deadline:
+                block = buildBlock(document, block, htmlBlocks[self.index]) or block
+                self.index += 1
+        self.block = block
+
+    def buildSlice(self):
+        if self.isCancelled or self.isFinished:
+            return
+        self.buildBlocks(GlobalVars.BuildTimeSlice)
+        if self.index < len(self.htmlBlocks):
+            self.progress.emit(50 + self.index * 50 // len(self.htmlBlocks))
+            self.updateEstimate()
+            QTimer.singleShot(0, self.buildSlice)  # 处理完其他事件再继续
+            return
+        self.finish()
+
+    def updateEstimate(self):
+        """
+        前几页新建完成后显示文档，没有新建的部分按平均高度估计，使滚动条接近最终的长度
+        """
+        builtHeight = self.builtHeight()
+        if not self.progressive or builtHeight < GlobalVars.PageHeight * GlobalVars.FirstScreenPages:
+            return
+        self.document.setEstimatedHeight(builtHeight * len(self.htmlBlocks) // self.index)
+        if not self.isReady:
+            self.isReady = True
+            self.ready.emit(self.document)
+
+    def ensureHeight(self, height):
+        """
+        文档显示后，滚动到还没有新建的位置时调用，立即新建到height处，最多用时ScrollBuildTimeSlice毫秒
+        """
+        if not self.isReady or self.isFinished or self.isCancelled:
+            return
+        deadline = perf_counter() + GlobalVars.ScrollBuildTimeSlice / 1000
+        while self.builtHeight() < height and self.index < len(self.htmlBlocks) and perf_counter() < deadline:
+            self.buildBlocks(GlobalVars.BuildTimeSlice)
+        if self.index < len(self.htmlBlocks):
+            self.updateEstimate()
+        else:
+            self.finish()
+
+    def buildAll(self):
+        """
+        立即新建剩余的全部段落，用于保存等需要完整文档的操作
+        """
+        if self.isFinished or self.isCancelled or not self.document:
+            return
+        self.buildBlocks(float("inf"))
+        self.finish()
+
+    def finish(self):
+        document = self.document
+        self.isFinished = True
+        closeReader(self.htmlBlocks)  # 段落已经全部新建，之后可能写入同一个文件
+        document.loader = None
+        document.setEstimatedHeight(0)  # 已经全部分页
+        journal = document.journal
+        with keepCurrent():
+            if journal.undoStack or journal.group:  # 显示后用户已经修改，这些修改还没有记入日志
+                document.path = self.path
+                document.autosave.checkpoint()  # 写入检查点，打开的文件在保存之前不变
+                document.autosave.setModified(True)
+            else:
+                restoreLog(document, self.path, self.log)
+        self.progress.emit(100)
+        if not self.isReady:
+            self.isReady = True
+            self.ready.emit(document)
+        self.finished.emit(document)
+
+    def cancel(self):
+        """
+        取消打开，已经新建的文档直接丢弃，已经显示的文档不能取消
+        """
+        if self.isReady or self.isCancelled:
+            return
+        self.isCancelled = True
+        if self.task:
+            self.task.cancel()
+        if self.document:  # 正在新建段落
+            closeReader(self.htmlBlocks)
+            self.document.deleteLater()
+            self.document = None
+            self.cancelled.emit()
+
+
+def readBlock(document, preBlock, html):
+    """
+    根据一段的html在preBlock后新建段落，返回新建的段落，不支持的标签返回None
+    """
+    reader = HtmlReader()
+    reader.feed(html)
+    reader.close()
+    return buildBlock(document, preBlock, reader.blocks[0]) if reader.blocks else None
+
+
+def replayLog(document, ids, records):
+    """
+    按顺序重放自动保存日志中的修改，ids为文件中各段的编号，返回是否有修改
+    """
+    blocks = {}  # 编号:段落
+    block = document.RootBlock
+    for i in ids:
+        if block is None:  # 段落数与日志不一致，不能重放
+            return False
+        blocks[i] = block
+        block = block.nextBlock
+    if block or not records:
+        return False
+    with document.journal.paused(), document.layoutTransaction():
+        for record in records:
+            if record[0] == "del":
+                block = blocks.pop(record[1], None)
+                if block:
+                    block.detach()
+            elif record[0] in ("ins", "cut"):  # 文本条中插入或删除文字
+                blockId, itemIndex, index, value = record[1:]
+                textItem = getattr(blocks.get(blockId), "RootTextItem", None)
+                for i in range(itemIndex):
+                    textItem = textItem and textItem.nextTextItem
+                if textItem:
+                    if record[0] == "ins":
+                        textItem.buffer.insert(index, value)
+                    else:
+                        textItem.buffer.delete(index, index + value)
+                    document.markDirty(textItem.textBlock, True)
+            elif record[0] == "put":  # 新增或修改段落，修改的段落用新建的段落代替
+                blockId, preId, html = record[1:]
+                oldBlock = blocks.pop(blockId, None)
+                block = readBlock(document, blocks.get(preId), html)
+                if block:
+                    blocks[blockId] = block
+                if oldBlock:
+                    oldBlock.detach()
+    return True
@@ -0,0 +1,91 @@
+import os
+from collections import namedtuple
+from html import escape
+import globalvars
+
+GlobalVars = globalvars.GlobalVars
+
+# 导出html需要的段落数据，在界面线程中从段落复制出来，之后不会改变，可以在后台线程中生成html
+# 颜色为QColor.getRgb()的结果，backgroundColor为None表示没有填充
+ItemSnapshot = namedtuple("ItemSnapshot", "text fontFamily italic bold fontSize lineHeight textColor backgroundColor")
+BlockSnapshot = namedtuple("BlockSnapshot", "tag isTitle width lineSpacing lineSpacingPolicy items")
+
+
+def colorToHtml(rgba):
+    """
+    将(r, g, b, a)转换为rgba(0, 0, 0, 1.0)格式，None返回none
+    """
+    if not rgba:
+        return "none"
+    color = list(rgba)
+    color[3] /= 255  # 透明度转化为浮点数
+    return "rgba" + str(tuple(color))
+
+
+def iterBlockHtml(snapshot):
+    """
+    依次生成段落html的各个部分，正文每个textItem生成一个span
+    """
+    if not snapshot.isTitle:  # 正文格式
+        yield '<p style="width:{}px; lineSpacingPolicy:{}; lineSpacing:{}">\n'.format(snapshot.width,
+                                                                                        snapshot.lineSpacingPolicy,
+                                                                                        snapshot.lineSpacing)  # 一些属性，在html中没有意义
+        for item in snapshot.items:
+            yield '<span style="font-family:{};font-style:{};font-weight:{};font-size:{}pt;color:{};background-color:{};line-height:{}px">{}</span>\n'.format(
+                item.fontFamily,
+                "italic" if item.italic else "normal",
+                "bold" if item.bold else "normal",  # 待完善，不止这两种
+                item.fontSize,
+                colorToHtml(item.textColor),
+                colorToHtml(item.backgroundColor),
+                item.lineHeight,
+                escape(item.text, quote=False))  # 待完善使用pt作为单位，应该全部都使用pt，文字中的<>&需要转义
+        yield "</p>\n"
+    else:
+        yield '<{} style="width:{}px; lineSpacingPolicy:{}; lineSpacing:{}">{}</{}>\n'.format(
+            snapshot.tag,
+            snapshot.width,
+            snapshot.lineSpacingPolicy,
+            snapshot.lineSpacing,
+            escape(snapshot.items[0].text, quote=False),
+            snapshot.tag)  # 一些属性，在html中没有意义
+
+
+def partToHtml(part):  # 文档快照的每一部分是字符串或段落快照
+    return part if isinstance(part, str) else "".join(iterBlockHtml(part))
+
+
+def iterDocumentHtml(parts):
+    for part in parts:
+        if isinstance(part, str):
+            yield part
+        else:
+            yield from iterBlockHtml(part)
+
+
+def writeHtml(path, parts, task=None):
+    """
+    将文档快照写入path，先写入临时文件，写完后再替换原文件，写入过程中崩溃或取消都不会损坏原文件
+    task为后台任务时报告进度，并在取消时停止
+    """
+    tempPath = path + ".tmp"
+    try:
+        with open(tempPath, "w", encoding="UTF-8", buffering=GlobalVars.FileBufferSize) as f:
+            write = f.write
+            total = len(parts)
+            for i, part in enumerate(parts):
+                write(partToHtml(part))
+                if task and not i % 256:
+                    task.checkCancel()
+                    task.report(i, total)
+            f.flush()
+            os.fsync(f.fileno())
+    except BaseException:
+        try:
+            os.remove(tempPath)
+        except FileNotFoundError:  # 临时文件还没有新建，比如目录不存在，保留原来的异常
+            pass
+        raise
+    os.replace(tempPath, path)
+    if task:
+        task.report(total, total)
@@ -0,0 +1,327 @@
+from collections import deque
+from contextlib import contextmanager
+from PySide2.QtCore import QTimer
+
+
+# 撤销记录中的各种操作，每个操作只记录修改的对象和修改前后的值，undo和redo返回之后光标的位置(textItem, index)
+# 删除的文本条和段落不会销毁，只是移出链表，撤销时原样放回，所以操作可以直接引用这些对象
+def relayout(block, layout=True):  # 重做或撤销后标记段落，批量编辑结束时统一断行、分页
+    if not block.isDetached:
+        block.document.markDirty(block, layout)
+
+
+def nearPosition(preItem, nextItem):  # 删除文本条或段落后光标的位置，优先定位到前面的末尾
+    if preItem:
+        return preItem, len(preItem.buffer)
+    if nextItem:
+        return nextItem, 0
+
+
+class InsertText():
+    """
+    插入文字，连续输入的文字合并为一个操作
+    """
+
+    def __init__(self, textItem, index, text):
+        self.textItem = textItem
+        self.index = index
+        self.text = text
+
+    def changedBlock(self):  # 修改的段落，用于自动保存
+        return self.textItem.textBlock
+
+    def undo(self):
+        self.textItem.buffer.delete(self.index, self.index + len(self.text))
+        relayout(self.textItem.textBlock)
+        return self.textItem, self.index
+
+    def redo(self):
+        self.textItem.buffer.insert(self.index, self.text)
+        relayout(self.textItem.textBlock)
+        return self.textItem, self.index + len(self.text)
+
+    def merge(self, op):
+        if type(op) is not InsertText or op.textItem is not self.textItem or op.index != self.index + len(self.text):
+            return False
+        if self.text[-1].isspace() and not op.text.isspace():  # 按单词撤销，空白之后的新单词单独记录
+            return False
+        self.text += op.text
+        return True
+
+
+class DelText():
+    """
+    删除文字，记录删除的文字，连续的退格或删除合并为一个操作
+    """
+
+    def __init__(self, textItem, index, text):
+        self.textItem = textItem
+        self.index = index
+        self.text = text
+
+    def changedBlock(self):
+        return self.textItem.textBlock
+
+    def undo(self):
+        self.textItem.buffer.insert(self.index, self.text)
+        relayout(self.textItem.textBlock)
+        return self.textItem, self.index + len(self.text)
+
+    def redo(self):
+        self.textItem.buffer.delete(self.index, self.index + len(self.text))
+        relayout(self.textItem.textBlock)
+        return self.textItem, self.index
+
+    def merge(self, op):
+        if type(op) is not DelText or op.textItem is not self.textItem:
+            return False
+        if op.index + len(op.text) == self.index:  # 退格
+            self.text = op.text + self.text
+            self.index = op.index
+        elif op.index == self.index:  # 向后删除
+            self.text += op.text
+        else:
+            return False
+        return True
+
+
+class SetText():
+    """
+    替换文本条的全部文字
+    """
+
+    def __init__(self, textItem, oldText, newText):
+        self.textItem = textItem
+        self.oldText = oldText
+        self.newText = newText
+
+    def changedBlock(self):
+        return self.textItem.textBlock
+
+    def undo(self):
+        self.textItem.text = self.oldText
+        relayout(self.textItem.textBlock)
+        return self.textItem, len(self.oldText)
+
+    def redo(self):
+        self.textItem.text = self.newText
+        relayout(self.textItem.textBlock)
+        return self.textItem, len(self.newText)
+
+    def merge(self, op):
+        return False
+
+
+class SetAttr():
+    """
+    修改格式，如字体、颜色、行距、标题等级，setter(target, value)为设置该属性的函数
+    """
+
+    def __init__(self, target, setter, oldValue, newValue):
+        self.target = target  # textItem或textBlock
+        self.setter = setter
+        self.oldValue = oldValue
+        self.newValue = newValue
+
+    def changedBlock(self):
+        return getattr(self.target, "textBlock", self.target)
+
+    def apply(self, value):
+        self.setter(self.target, value)  # 批量编辑中，需要断行的setter只会标记段落
+        relayout(self.changedBlock(), False)  # 颜色等只需要重绘
+
+    def undo(self):
+        self.apply(self.oldValue)
+
+    def redo(self):
+        self.apply(self.newValue)
+
+    def merge(self, op):
+        return False
+
+
+class AddTextItem():
+    """
+    新建文本条，preTextItem为新建时的前一个文本条
+    """
+
+    def __init__(self, textItem, preTextItem):
+        self.textItem = textItem
+        self.preTextItem = preTextItem
+
+    def changedBlock(self):
+        return self.textItem.textBlock
+
+    def undo(self):
+        textItem = self.textItem
+        preTextItem, nextTextItem = textItem.preTextItem, textItem.nextTextItem
+        textItem.unlinkTextItem()
+        relayout(textItem.textBlock)
+        return nearPosition(preTextItem, nextTextItem)
+
+    def redo(self):
+        self.textItem.linkTextItem(self.preTextItem)
+        relayout(self.textItem.textBlock)
+        return self.textItem, len(self.textItem.buffer)
+
+    def merge(self, op):
+        return False
+
+
+class DelTextItem(AddTextItem):
+    """
+    删除文本条，与新建相反
+    """
+    undo, redo = AddTextItem.redo, AddTextItem.undo
+
+
+class AddBlock():
+    """
+    新建段落，preBlock为新建时的前一段
+    """
+
+    def __init__(self, block, preBlock):
+        self.block = block
+        self.preBlock = preBlock
+
+    def changedBlock(self):
+        return self.block
+
+    def undo(self):
+        block = self.block
+        preBlock, nextBlock = block.preBlock, block.nextBlock
+        block.detach()
+        return nearPosition(getattr(preBlock, "LastTextItem", None), getattr(nextBlock, "RootTextItem", None))
+
+    def redo(self):
+        self.block.attach(self.preBlock)
+
+    def merge(self, op):
+        return False
+
+
+class DelBlock(AddBlock):
+    """
+    删除段落，与新建相反
+    """
+    undo, redo = AddBlock.redo, AddBlock.undo
+
+
+class Journal():
+    """
+    文档的撤销记录，保存修改文字、文本条、段落和格式的操作
+    同一次事件中产生的操作为一组，一起撤销；连续输入或删除文字时，相邻的组合并为一个
+    撤销和重做在批量编辑中进行，无论涉及多少段落，都只在最后断行、分页一次
+    每组操作结束、撤销或重做后，将这一组操作通知listeners，如自动保存
+    """
+
+    def __init__(self, document, depth):
+        self.document = document
+        self.undoStack = deque(maxlen=depth)  # 超过depth时自动丢弃最早的记录
+        self.redoStack = []
+        self.group = None  # 正在记录的一组操作，事件处理完后结束
+        self.lock = 0  # 大于0时不记录，如撤销、重做和打开文件的过程中
+        self.amendLock = 0  # 大于0时并入上一组，如撤销前取消选择引起的整理
+        self.listeners = []  # 段落修改后调用，格式为listener(这一组操作, 是否为撤销)，撤销时操作按相反的顺序执行
+        self.groupTimer = QTimer(document)  # 回到事件循环时结束本组，只有一个，不会每组新建一个定时器
+        self.groupTimer.setSingleShot(True)
+        self.groupTimer.setInterval(0)
+        self.groupTimer.timeout.connect(self.closeGroup)
+
+    def record(self, op):
+        """
+        记录一个操作，同一次事件中的操作放到同一组
+        """
+        if self.lock:
+            return
+        if self.amendLock and self.undoStack:
+            self.undoStack[-1].append(op)
+            self.redoStack.clear()
+            self.notify([op])
+            return
+        if self.group is None:
+            self.group = []
+            self.groupTimer.start()
+        self.group.append(op)
+
+    def closeGroup(self):
+        group = self.group
+        self.group = None
+        if not group:
+            return
+        self.notify(group)
+        self.redoStack.clear()  # 有了新的修改，不能再重做
+        undoStack = self.undoStack
+        if len(group) == 1 and undoStack and len(undoStack[-1]) == 1 and undoStack[-1][0].merge(group[0]):
+            return
+        undoStack.append(group)
+
+    def notify(self, group, isUndo=False):
+        for listener in self.listeners:
+            listener(group, isUndo)
+
+    def clear(self):
+        self.group = None
+        self.undoStack.clear()
+        self.redoStack.clear()
+
+    @contextmanager
+    def paused(self):
+        """
+        期间的修改不记录，可以嵌套
+        with journal.paused():
+            ...
+        """
+        self.lock += 1
+        try:
+            yield self
+        finally:
+            self.lock -= 1
+
+    @contextmanager
+    def amending(self):
+        """
+        期间的修改并入上一组，与上一组一起撤销
+        """
+        self.closeGroup()
+        self.amendLock += 1
+        try:
+            yield self
+        finally:
+            self.amendLock -= 1
+
+    def undo(self):
+        """
+        撤销最近一组操作，返回是否撤销了
+        """
+        self.closeGroup()
+        if not self.undoStack:
+            return False
+        group = self.undoStack.pop()
+        self.replay([op.undo for op in reversed(group)])
+        self.redoStack.append(group)
+        self.notify(group, True)
+        return True
+
+    def redo(self):
+        """
+        重做最近撤销的一组操作，返回是否重做了
+        """
+        self.closeGroup()
+        if not self.redoStack:
+            return False
+        group = self.redoStack.pop()
+        self.replay([op.redo for op in group])
+        self.undoStack.append(group)
+        self.notify(group)
+        return True
+
+    def replay(self, funcs):
+        position = None
+        with self.paused(), self.document.layoutTransaction():
+            for func in funcs:
+                position = func() or position
+            if position:  # 光标定位到最后修改的位置
+                textItem, index = position
+                if not textItem.textBlock.isDetached:
+                    textItem.textBlock.setCursorPosition(textItem, index)
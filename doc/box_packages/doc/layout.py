@@ -0,0 +1,843 @@
+import re
+import argparse
+from abc import ABC, abstractmethod
+from array import array
+from bisect import bisect_left, bisect_right
+from time import perf_counter
+from PySide2.QtGui import QGuiApplication
+from fontcache import getFontAdvances
+from textbuffer import TextBuffer
+import globalvars
+from test import test
+
+GlobalVars = globalvars.GlobalVars
+
+
+# 排版核心，只依赖文字和字符宽度表，不依赖QWidget、当前段落和当前文本条等全局状态
+# 可以在后台、命令行或测试性能时直接断行、分页，界面只负责绘制排版的结果
+
+
+# 断行规则，简化的UAX#14：连续的拉丁字母和数字组成单词，不能断开，其他字符如汉字后面都可以断行；
+# 结束标点不能在行首，开始标点不能在行尾，与相邻的字符不断开。
+# 能否断行只取决于前后两个字符，编辑后只有编辑位置前后的断行位置会改变，增量断行依赖这一点
+WordChars = "0-9A-Za-z\u00C0-\u00D6\u00D8-\u00F6\u00F8-\u024F"  # 数字、拉丁字母，包括带重音的字母
+OpenPunctuation = "([{“‘（【《「『〈"
+ClosePunctuation = ",.;:!?)]}%”’，。、；：？！）】》」』〉…"
+WordCharPattern = re.compile("[{}]".format(WordChars))
+SegmentPattern = re.compile("[{o}]*(?:[{w}]+|[\\s\\S])[{c}]*".format(
+    o=re.escape(OpenPunctuation), w=WordChars, c=re.escape(ClosePunctuation)))  # 中间不能断开的一段文字
+NoBreakPattern = re.compile("[{w}]{{2}}|[{o}][\\s\\S]|[\\s\\S][{c}]".format(
+    o=re.escape(OpenPunctuation), w=WordChars, c=re.escape(ClosePunctuation)))  # 不能断开的两个字符
+
+
+def segmentBreaks(text, start=0, end=None):
+    """
+    一次正则匹配找出text从start到end之间所有可以断行的位置，返回索引数组，每一项为一段不能断开的文字的结束索引
+    比如 "ab，我1(2)"返回[3, 4, 5, 8]，最后一项为end
+    """
+    if end is None:
+        end = len(text)
+    return array("l", [m.end() for m in SegmentPattern.finditer(text, start, end)])
+
+
+def canBreakAt(text, index):
+    """
+    判断能否在text[index]之前断行，与segmentBreaks一致，index为0时不判断
+    """
+    a = text[index - 1]
+    b = text[index]
+    return not (a in OpenPunctuation or b in ClosePunctuation or (
+            WordCharPattern.match(a) and WordCharPattern.match(b)))
+
+
+class BreakStrategy(ABC):
+    """
+    断行策略的接口，决定文本条的文字在哪里换行，段落的breakStrategy指定使用的策略
+    子类必须实现iterLines，否则创建时就会报错，不会等到断行时才发现
+    """
+
+    @abstractmethod
+    def iterLines(self, item, text, startIndex, posX):
+        """
+        从startIndex开始，第一行的起始横坐标为posX，依次返回每一行的(起始索引, 结束索引, 宽度)，
+        除最后一行外，每一行都占满一行，下一行从行首开始；返回None表示posX处一个字符也放不下，直接换到下一行
+        """
+
+
+class WordBreakStrategy(BreakStrategy):
+    """
+    在segmentBreaks的位置断行，单词和标点不会被拆开，除非在行首也放不下
+    每次读取一段文字，计算累计宽度和断行位置，二分查找能放下的最后一个字符，再找它之前最后一个断行位置
+    斜体要加上最后一个字符倾斜的宽度，宽度不随位置单调增加，只能逐个断行位置判断
+    """
+    WindowSize = 1024  # 每次读取的字符数，增量断行对齐后就不再需要后面的文字
+
+    def windowBreaks(self, item, window):
+        """
+        返回窗口中所有可以断行的位置，None表示每个字符之后都可以断行，不需要查找断行位置
+        """
+        return segmentBreaks(window)
+
+    def iterLines(self, item, text, startIndex, posX):
+        prefixWidths = item.fontAdvances.prefixWidths
+        italic = item.italic
+        blockWidth = item.textBlock.BlockWidth
+        length = len(text)
+        size = self.WindowSize
+        while True:
+            window = text[startIndex:startIndex + size]
+            n = len(window)
+            isLast = startIndex + n == length  # 窗口包含了剩余的全部文字
+            advances = prefixWidths(window)
+            breaks = self.windowBreaks(item, window)
+            if breaks is not None and not isLast and breaks[-1] == n:  # 窗口末尾的单词可能还没有读完
+                breaks.pop()
+            breakCount = len(breaks) if breaks is not None else 0
+
+            def italicFits(b, limit):  # 斜体时，到b为止的文字加上最后一个字符倾斜的宽度能否放下
+                return advances[b] + (advances[b] - advances[b - 1]) / 2 <= limit
+
+            i = 0  # 窗口中当前行的起始位置
+            k = 0  # breaks中第一个大于i的断行位置
+            while True:
+                base = advances[i]
+                limit = base + blockWidth - posX
+                j = bisect_right(advances, limit, i) - 1  # 不考虑斜体，当前行最多能放下到j为止的字符
+                if j == n and not isLast:  # 窗口剩下的文字都能放下，读取后面的文字再断行
+                    break
+                end = i  # 当前行的结束位置
+                if breaks is None:  # 能放下的字符都放在本行
+                    if j > i:
+                        end = j
+                elif italic:
+                    while k < breakCount and breaks[k] <= j and italicFits(breaks[k], limit):
+                        end = breaks[k]
+                        k += 1
+                else:
+                    m = bisect_right(breaks, j, k)  # breaks[k:m]都能放下
+                    if m > k:
+                        end = breaks[m - 1]
+                        k = m
+                if end == i:  # 第一段文字就放不下
+                    if posX != 0:  # 前面有别的文字，直接新起一行
+                        yield None
+                        posX = 0
+                        continue
+                    if breaks is None:
+                        segmentEnd = i + 1
+                    else:
+                        segmentEnd = breaks[k] if k < breakCount else n + 1  # 单词在窗口之后才结束，拆分的位置不会超过窗口
+                    if segmentEnd == i + 1:  # 单个字符就超出了行宽，每行至少要有一个字符
+                        end = segmentEnd
+                        k += 1
+                        if italic:  # 只是倾斜的宽度超出行宽时，后面的文字仍可能放得下
+                            while k < breakCount and breaks[k] <= j and italicFits(breaks[k], limit):
+                                end = breaks[k]
+                                k += 1
+                    else:  # 单词位于行首依然放不下，拆分单词，至少留一个字符到下一行
+                        end = i + 1
+                        while end < segmentEnd - 1 and (
+                                italicFits(end + 1, limit) if italic else advances[end + 1] <= limit):
+                            end += 1
+                width = advances[end] - base
+                if italic:
+                    width += (advances[end] - advances[end - 1]) / 2
+                yield startIndex + i, startIndex + end - 1, width
+                posX = 0
+                i = end
+                if i == n:  # 窗口的文字正好用完
+                    if isLast:
+                        return
+                    break
+            if i == 0:  # 一行比整个窗口还长
+                size *= 2
+            startIndex += i
+
+
+class CharBreakStrategy(BreakStrategy):
+    """
+    每个字符后面都可以断行，如中文，不需要分词
+    每次读取一段文字计算累计宽度，在累计宽度中二分查找每一行能放下的字符数
+    不考虑斜体增加的宽度，斜体的文本条应使用WordBreakStrategy
+    """
+    WindowSize = 1024  # 每次读取的字符数，增量断行对齐后就不再需要后面的文字
+
+    def iterLines(self, item, text, startIndex, posX):
+        prefixWidths = item.fontAdvances.prefixWidths
+        blockWidth = item.textBlock.BlockWidth
+        length = len(text)
+        size = self.WindowSize
+        while True:
+            window = text[startIndex:startIndex + size]
+            n = len(window)
+            isLast = startIndex + n == length  # 窗口包含了剩余的全部文字
+            advances = prefixWidths(window)
+            i = 0  # 窗口中当前行的起始位置
+            while True:
+                base = advances[i]
+                j = bisect_right(advances, base + blockWidth - posX, i) - 1  # 当前行最多能放下到j为止的字符
+                if j == n and not isLast:  # 窗口剩下的文字都能放下，读取后面的文字再断行
+                    break
+                if j <= i:  # 一个字符也放不下
+                    if posX != 0:
+                        yield None
+                        posX = 0
+                        continue
+                    j = i + 1  # 每行至少要有一个字符
+                yield startIndex + i, startIndex + j - 1, advances[j] - base
+                posX = 0
+                i = j
+                if i == n:  # 窗口的文字正好用完
+                    if isLast:
+                        return
+                    break
+            if i == 0:  # 一行比整个窗口还长
+                size *= 2
+            startIndex += i
+
+
+class AutoBreakStrategy(WordBreakStrategy):
+    """
+    默认的断行策略，与WordBreakStrategy的断行结果相同，按每次读取的窗口判断是否需要分词
+    窗口中任意两个字符之间都可以断行且不是斜体时，如中文，每个字符之后都是断行位置，不需要分词
+    只检查当前窗口，增量断行时的开销与文本条的长度无关
+    """
+
+    def windowBreaks(self, item, window):
+        if item.italic or NoBreakPattern.search(window):
+            return segmentBreaks(window)
+        return None
+
+
+DefaultBreakStrategy = AutoBreakStrategy()
+
+
+class TextFragments():
+    """
+    文本条断行生成的所有textFragment，每个属性一个数组(struct of arrays)，不需要为每一行新建对象
+    分别保存片段的起始x,y值，宽度，所占行高，文字的起始纵坐标，文字的高度，在文本条中所占的索引范围
+    下标访问和遍历返回TextFragment视图，文字从buffer中按索引读取
+    """
+
+    def __init__(self, buffer=None):
+        self.buffer = buffer  # 断行时的文字
+        self.posX = array("d")
+        self.posY = array("d")
+        self.width = array("d")
+        self.lineHeight = array("d")
+        self.contentPosY = array("d")
+        self.fontHeight = array("d")
+        self.startIndex = array("l")
+        self.endIndex = array("l")
+        self.lastLine = None  # 最后一个fragment所在的行与其他文本条共用时的TextLine
+        self.advances = None  # 各fragment文字的累计宽度，定位光标时才计算
+
+    def __len__(self):
+        return len(self.startIndex)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self.startIndex)
+        if not 0 <= i < len(self.startIndex):
+            raise IndexError("TextFragments index out of range")
+        return TextFragment(self, i)
+
+    def __iter__(self):
+        for i in range(len(self.startIndex)):
+            yield TextFragment(self, i)
+
+    def append(self, posX, posY, width, lineHeight, contentPosY, fontHeight, startIndex, endIndex):
+        self.posX.append(posX)
+        self.posY.append(posY)
+        self.width.append(width)
+        self.lineHeight.append(lineHeight)
+        self.contentPosY.append(contentPosY)
+        self.fontHeight.append(fontHeight)
+        self.startIndex.append(startIndex)
+        self.endIndex.append(endIndex)
+
+    def extend(self, fragments, start, end, shift=0, dy=0):
+        """
+        复制fragments中从start到end的fragment，索引平移shift，纵坐标平移dy，增量断行时沿用原来的行
+        """
+        for name in ("posX", "width", "lineHeight", "fontHeight"):
+            getattr(self, name).extend(getattr(fragments, name)[start:end])
+        if dy:  # 编辑增加或减少了行，后面的行整体上下移动
+            self.posY.extend([y + dy for y in fragments.posY[start:end]])
+            self.contentPosY.extend([y + dy for y in fragments.contentPosY[start:end]])
+        else:
+            self.posY.extend(fragments.posY[start:end])
+            self.contentPosY.extend(fragments.contentPosY[start:end])
+        if shift:
+            self.startIndex.extend([i + shift for i in fragments.startIndex[start:end]])
+            self.endIndex.extend([i + shift for i in fragments.endIndex[start:end]])
+        else:
+            self.startIndex.extend(fragments.startIndex[start:end])
+            self.endIndex.extend(fragments.endIndex[start:end])
+        if end == len(fragments):
+            self.lastLine = fragments.lastLine
+            if dy and self.lastLine:  # 原来的排版已经不再使用，共用的行直接移动
+                self.lastLine.posY += dy
+
+
+class TextFragment():
+    """
+    TextFragments中第i个fragment的只读视图，只在绘制、定位光标等需要时创建，修改直接写入TextFragments的数组
+    创建时复制各项的值，拖动选择等频繁读取属性时不需要每次查数组，重新断行后应重新取出
+    """
+    __slots__ = ("fragments", "i", "posX", "posY", "width", "lineHeight", "contentPosY", "fontHeight",
+                 "startIndex", "endIndex")
+
+    def __init__(self, fragments, i):
+        self.fragments = fragments
+        self.i = i
+        self.posX = fragments.posX[i]
+        self.posY = fragments.posY[i]
+        self.width = fragments.width[i]
+        self.lineHeight = fragments.lineHeight[i]
+        self.contentPosY = fragments.contentPosY[i]
+        self.fontHeight = fragments.fontHeight[i]
+        self.startIndex = fragments.startIndex[i]
+        self.endIndex = fragments.endIndex[i]
+
+    def __eq__(self, other):  # 每次访问都新建视图，指向同一个fragment的视图相等
+        return isinstance(other, TextFragment) and self.fragments is other.fragments and self.i == other.i
+
+    def __hash__(self):
+        return hash((id(self.fragments), self.i))
+
+    @property
+    def text(self):
+        buffer = self.fragments.buffer
+        if not buffer:
+            return ""
+        return buffer[self.startIndex:self.endIndex + 1]
+
+
+class TextLine():
+    """
+    几个文本条共用的一行，只在前一个文本条的最后一行之后接着排下一个文本条时创建，其余的行只属于一个文本条，不需要额外的对象
+    items为行内从左到右的文本条，第一个的最后一个fragment和其余的第一个fragment在本行
+    行高、文字高度和文字的起始纵坐标都取行内行高最大的文本条，换行时计算一次，写入行内的各个fragment
+    """
+    __slots__ = ("posY", "items", "lineHeight", "fontHeight", "contentPosY")
+
+    def __init__(self, posY, textItem):
+        self.posY = posY
+        self.items = [textItem]
+        self.lineHeight = self.fontHeight = self.contentPosY = None  # close之后才有
+
+    def truncate(self, textItem):  # 去掉textItem之后的文本条，它们重新断行后再加入
+        items = self.items
+        while items[-1] is not textItem:
+            items.pop()
+
+    def close(self):
+        """
+        行内的文字都已经排好，计算行高并写入行内的fragment，只与行内的文本条数有关
+        """
+        items = self.items
+        tallest = items[0]
+        for textItem in items:
+            if textItem.lineHeight >= tallest.lineHeight:  # 一样高时取后面的
+                tallest = textItem
+        lineHeight = self.lineHeight = tallest.lineHeight
+        fontHeight = self.fontHeight = tallest.fontHeight
+        contentPosY = self.contentPosY = tallest.contentPosY + self.posY
+        for k, textItem in enumerate(items):
+            fragments = textItem.textFragments
+            i = len(fragments) - 1 if k == 0 else 0
+            fragments.lineHeight[i] = lineHeight
+            fragments.fontHeight[i] = fontHeight
+            fragments.contentPosY[i] = contentPosY
+
+
+def charIndexAt(advances, x):
+    """
+    在累计宽度advances中二分查找横坐标x对应的光标索引，点击字符的前半部分定位到字符前，后半部分定位到字符后
+    """
+    j = bisect_left(advances, x)  # 第j个字符的起点不小于x
+    if j == 0:
+        return 0
+    if j == len(advances):  # 超出最后一个字符
+        return j - 1
+    return j - 1 if x * 2 <= advances[j - 1] + advances[j] else j
+
+
+def findFragment(textFragments, index):
+    """
+    二分查找文本条中包含索引index的textFragment，index位于文本条末尾时返回None
+    """
+    i = bisect_right(textFragments.startIndex, index)  # 最后一个startIndex不大于index的fragment之后
+    if i and index <= textFragments.endIndex[i - 1]:
+        return textFragments[i - 1]
+    return None
+
+
+class LineIndex():
+    """
+    段落的行索引，按纵坐标保存每一行的textFragment，鼠标定位时二分查找行和行内的fragment
+    段落重新断行或者文本条增删后失效，下一次定位时重新生成
+    """
+
+    def __init__(self, textBlock):
+        self.lineTops = []  # 每行的起始纵坐标，从上到下排列
+        self.lines = []  # 每行的(textItem, fragment的序号)，从左到右排列
+        self.lineStarts = []  # 每行各个fragment的起始横坐标
+        textItem = textBlock.RootTextItem
+        while textItem:
+            fragments = textItem.textFragments
+            for i, posY in enumerate(fragments.posY):  # 直接读取数组，不需要新建视图
+                if not self.lineTops or posY != self.lineTops[-1]:  # 新的一行
+                    self.lineTops.append(posY)
+                    self.lines.append([])
+                    self.lineStarts.append([])
+                self.lines[-1].append((textItem, i))
+                self.lineStarts[-1].append(fragments.posX[i])
+            textItem = textItem.nextTextItem
+
+    def fragmentsIn(self, left, top, right, bottom, overhang=4):
+        """
+        依次返回与矩形区域相交的(textItem, fragment)，用于只绘制需要重绘的区域
+        overhang为斜体字超出fragment右侧的宽度
+        """
+        lineTops = self.lineTops
+        i = max(bisect_right(lineTops, top) - 1, 0)  # 起始纵坐标不大于top的最后一行
+        while i < len(lineTops) and lineTops[i] <= bottom:
+            for textItem, k in self.lines[i]:
+                fragments = textItem.textFragments
+                posX = fragments.posX[k]
+                if posX <= right and posX + fragments.width[k] + overhang >= left:
+                    yield textItem, TextFragment(fragments, k)
+            i += 1
+
+    def fragmentAt(self, posX, posY):
+        """
+        返回坐标所在的(textItem, fragment)，不在任何fragment里面时返回None
+        与fragment的起点重合时属于前一个fragment，行与行的交界处不属于任何一行
+        """
+        i = bisect_left(self.lineTops, posY) - 1  # 起始纵坐标小于posY的最后一行
+        if i < 0:
+            return None
+        k = max(bisect_left(self.lineStarts[i], posX) - 1, 0)
+        textItem, k = self.lines[i][k]
+        fragments = textItem.textFragments
+        top = fragments.posY[k]
+        left = fragments.posX[k]
+        if top < posY < top + fragments.lineHeight[k] and left <= posX <= left + fragments.width[k]:
+            return textItem, TextFragment(fragments, k)
+        return None
+
+
+def getLineHeight(fontHeight, lineSpacing, lineSpacingPolicy):
+    """
+    根据行间距和行间距策略，返回字体高度对应的行高
+    """
+    if lineSpacingPolicy is GlobalVars.absLineSpacingPolicy:  # 绝对行间距
+        return fontHeight + lineSpacing * 2
+    else:
+        return fontHeight + fontHeight * lineSpacing * 2  # 相对行间距
+
+
+class LayoutItem():
+    """
+    文本条的排版数据，包括文字、字符宽度表和断行生成的textFragment
+    textBlock只需要提供BlockWidth、breakStrategy、getLineHeight、RootTextItem和LastTextItem，可以是界面上的段落，也可以是LayoutBlock
+    """
+
+    def __init__(self, textBlock, preTextItem=None):  # preTextItem为None，表示插入到段首
+        self.textBlock = textBlock
+        self.buffer = None  # 文字保存在片段表中，插入和删除不需要复制整个字符串
+        self.textFragments = TextFragments()  # 默认为空
+        self.layoutVersion = None  # 上一次断行时的片段表、版本和文字长度，用于增量断行
+        self.layoutKey = None  # 上一次断行时的字体、行高、段落宽度
+        self.dirtyTop = self.dirtyBottom = 0  # 上一次断行改变的纵坐标范围，用于只重绘变化的行
+        self.linkTextItem(preTextItem)
+
+    def linkTextItem(self, preTextItem):
+        """
+        加入段落的文本条链表，preTextItem为None，表示插入到段首
+        """
+        textBlock = self.textBlock
+        textBlock.lineIndex = None  # 文本条变化，行索引失效
+        self.preTextItem = preTextItem
+        if preTextItem:  # 不是第一个文字条
+            self.nextTextItem = preTextItem.nextTextItem
+            preTextItem.nextTextItem = self
+            if self.nextTextItem:  # 后面有文本条
+                self.nextTextItem.preTextItem = self
+            else:  # 新建的是最后一个文本条
+                textBlock.LastTextItem = self
+        else:  # 段首插入文本条
+            self.nextTextItem = textBlock.RootTextItem
+            textBlock.RootTextItem = self
+            if self.nextTextItem:  # 本段不是空段，有其他文本条
+                self.nextTextItem.preTextItem = self
+            else:  # 本段是空段
+                textBlock.LastTextItem = self
+
+    def unlinkTextItem(self):
+        """
+        从段落的文本条链表中移除，不更新视图
+        """
+        textBlock = self.textBlock
+        textBlock.lineIndex = None
+        preTextItem = self.preTextItem
+        nextTextItem = self.nextTextItem
+        if preTextItem:
+            preTextItem.nextTextItem = nextTextItem
+        else:
+            textBlock.RootTextItem = nextTextItem
+        if nextTextItem:
+            nextTextItem.preTextItem = preTextItem
+        else:
+            textBlock.LastTextItem = preTextItem
+
+    @property
+    def text(self):  # 完整的文字，需要时才拼接
+        return None if self.buffer is None else str(self.buffer)
+
+    @text.setter
+    def text(self, text):
+        self.buffer = None if text is None else TextBuffer(text)
+
+    def setFontAdvances(self, fontAdvances, italic=False):
+        """
+        设置字符宽度表，同时更新行高
+        """
+        self.fontAdvances = fontAdvances
+        self.fontMetrics = fontAdvances.fontMetrics
+        self.fontHeight = fontAdvances.height
+        self.italic = italic
+        self.updateLineHeight()
+
+    def updateLineHeight(self):
+        """
+        根据textBlock的行间距策略更新行高，字体越大，上下获得的间距也越大
+        """
+        self.lineHeight = self.textBlock.getLineHeight(self.fontHeight)
+        self.contentPosY = (self.lineHeight - self.fontHeight) / 2  # 如果有填充，填充开始的纵坐标
+
+    def italicWidth(self, text):  # 待优化，有些字符没有斜体
+        """
+        如果是斜体，要增加一定空间保证字符显示正确
+        """
+        if self.italic:
+            return self.fontAdvances.width(text) / 2
+        else:
+            return 0
+
+    def fragmentAdvances(self, fragment):
+        """
+        返回fragment文字的累计宽度，第i项为前i个字符的宽度
+        """
+        fragments = fragment.fragments
+        cache = fragments.advances
+        if cache is None:
+            cache = fragments.advances = {}
+        advances = cache.get(fragment.i)
+        if advances is None:
+            advances = cache[fragment.i] = self.fontAdvances.prefixWidths(fragment.text)
+        return advances
+
+    def findFragment(self, index):
+        return findFragment(self.textFragments, index)
+
+    def layoutFragments(self, editIndex=None, editLength=0):
+        """
+        对本文本条断行，生成textFragment，不会影响后面的文本条
+        editIndex不为None时，保留编辑位置之前的行，从编辑位置所在行的上一行开始重新断行，
+        当新的行首与原来某一行的行首对齐时，直接沿用原来后面的textFragment，行数改变时整体平移纵坐标
+        返回True表示沿用了原来尾部的textFragment，且纵坐标没有变化，后面的文本条不需要更新
+        """
+        text = self.buffer  # 只读取需要重新断行的部分，不拼接整个字符串
+        blockWidth = self.textBlock.BlockWidth
+        lineHeight = self.lineHeight
+        fontHeight = self.fontHeight
+        contentPosY = self.contentPosY  # 填充的纵坐标偏移
+        layoutKey = (self.fontMetrics, lineHeight, contentPosY, blockWidth)  # 影响断行的属性，任一改变，原来的textFragment就不能沿用
+        oldFragments = self.textFragments
+        fragments = TextFragments(text)
+        restart = 0  # 从第几个textFragment开始重新断行
+        syncIndex = None  # 原来的排版中，不小于此索引的行首才可以对齐
+
+        if all([editIndex is not None, text, oldFragments, self.layoutKey == layoutKey, self.layoutVersion is not None]):
+            oldBuffer, oldVersion, oldLength = self.layoutVersion
+            if oldBuffer is text and oldLength + editLength == len(text) and (
+                    text.version == oldVersion + (1 if editLength else 0)):  # 保证原来的排版对应编辑前的文字，之间只有这一次编辑
+                oldStarts = oldFragments.startIndex
+                k = min(bisect_left(oldFragments.endIndex, editIndex), len(oldStarts) - 1)  # 编辑位置所在的行
+                while k and (oldStarts[k] >= editIndex or not canBreakAt(text, oldStarts[k])):  # 编辑的单词从上一行开始，被拆分到了本行
+                    k -= 1
+                restart = k - 1 if k else 0  # 删除文字后，本行的单词可能移到上一行，因此从上一行开始
+                while restart and not canBreakAt(text, oldStarts[restart]):  # 行首不是断行位置，说明单词被拆分，需要继续向前，编辑位置之前的文字没有变化
+                    restart -= 1
+                syncIndex = editIndex + 1 + max(0, -editLength)
+
+        self.textFragments = fragments  # TextLine计算行高时需要使用
+        if restart:  # 保留编辑位置之前的行
+            fragments.extend(oldFragments, 0, restart)
+            preFragment = None  # 从行首开始，不需要前面的fragment
+            fragmentStartPosX = 0
+            fragmentStartPosY = oldFragments.posY[restart]
+            fragmentStartIndex = oldFragments.startIndex[restart]
+        elif self.preTextItem:  # 不是第一个item
+            preFragment = self.preTextItem.textFragments[-1]
+            fragmentStartPosX = preFragment.posX + preFragment.width
+            fragmentStartPosY = preFragment.posY
+            fragmentStartIndex = 0
+        else:  # 第一个item
+            preFragment = None
+            fragmentStartPosX = 0
+            fragmentStartPosY = 0
+            fragmentStartIndex = 0
+        oldFragmentIndex = restart  # 用于查找对齐的行
+        self.dirtyTop = fragmentStartPosY  # 从此行开始重新断行
+        sharedLine = None  # 第一行接在前一个文本条之后时的TextLine，换行时才计算行高
+
+        def addFragment(posX, posY, width, startIndex, endIndex):
+            nonlocal sharedLine
+            fragments.append(posX, posY, width, lineHeight, contentPosY + posY, fontHeight, startIndex, endIndex)
+            if posX:  # 只有第一个fragment可能不在行首，与前一个文本条共用一行
+                sharedLine = self.preTextItem.joinLine(self)
+
+        def isSynced(startIndex, posY):  # 新的一行从startIndex开始，判断能否与原来的排版对齐，返回纵坐标的偏移
+            nonlocal oldFragmentIndex
+            if syncIndex is None:
+                return None
+            oldStartIndex = startIndex - editLength
+            if oldStartIndex < syncIndex:  # 还没有越过编辑的位置
+                return None
+            oldFragmentIndex = bisect_left(oldFragments.startIndex, oldStartIndex, oldFragmentIndex)
+            if oldFragmentIndex == len(oldFragments):
+                return None
+            if oldFragments.startIndex[oldFragmentIndex] != oldStartIndex or oldFragments.posX[oldFragmentIndex] != 0:
+                return None
+            dy = posY - oldFragments.posY[oldFragmentIndex]  # 编辑增加或减少的行使后面的行上下移动
+            fragments.extend(oldFragments, oldFragmentIndex, len(oldFragments), editLength, dy)  # 沿用原来的行，只需要平移索引和纵坐标
+            return dy
+
+        if text:  # 有文字
+            isWrapped = False  # 前面有本文本条的行，下一行从行首开始
+            for line in self.textBlock.breakStrategy.iterLines(self, text, fragmentStartIndex, fragmentStartPosX):
+                if line is None:  # 前面的文字之后放不下，直接新起一行
+                    self.preTextItem.closeLine()
+                    fragmentStartPosX = 0
+                    fragmentStartPosY = preFragment.posY + self.preTextItem.textFragments.lineHeight[-1]
+                    continue
+                fragmentStartIndex, fragmentEndIndex, fragmentWidth = line
+                if isWrapped:
+                    if sharedLine:  # 第一行结束，计算与前面的文本条共用的行高
+                        sharedLine.close()
+                        sharedLine = None
+                    fragmentStartPosX = 0
+                    fragmentStartPosY = fragments.posY[-1] + fragments.lineHeight[-1]
+                    dy = isSynced(fragmentStartIndex, fragmentStartPosY)
+                    if dy == 0:  # 后面的行没有变化
+                        return self.finishLayout(layoutKey, True, fragmentStartPosY)
+                    if dy is not None:  # 后面的行只是移动了位置，需要重绘到文本条末尾，后面的文本条也要移动
+                        return self.finishLayout(layoutKey, False)
+                addFragment(fragmentStartPosX, fragmentStartPosY, fragmentWidth, fragmentStartIndex, fragmentEndIndex)
+                isWrapped = True
+        else:  # 空的item
+            addFragment(fragmentStartPosX, fragmentStartPosY, 0, 0, 0)
+        fragments.lastLine = sharedLine  # 只有一行时，后面的文本条还可以接在这一行
+        return self.finishLayout(layoutKey, False)
+
+    def finishLayout(self, layoutKey, isSynced, dirtyBottom=None):
+        """
+        记录本次断行所依据的文字和属性，供下一次增量断行判断
+        dirtyBottom为对齐的行的起始纵坐标，之后的行没有变化；为None时到最后一行为止
+        """
+        if dirtyBottom is None:
+            fragments = self.textFragments
+            dirtyBottom = fragments.posY[-1] + fragments.lineHeight[-1]
+        self.dirtyBottom = dirtyBottom
+        buffer = self.buffer
+        self.layoutVersion = (buffer, buffer.version, len(buffer))
+        self.layoutKey = layoutKey
+        self.textBlock.lineIndex = None  # 行发生了变化，行索引失效
+        if not self.nextTextItem:  # 段落的最后一行，后面没有文字了
+            self.closeLine()
+        self.updateHeightBoundary()  # 更新边界，为了鼠标定位使用
+        return isSynced
+
+    def joinLine(self, textItem):
+        """
+        textItem的第一个fragment接在本文本条的最后一个fragment之后，返回共用的TextLine
+        原来接在后面的文本条已经失效，从行中去掉
+        """
+        fragments = self.textFragments
+        line = fragments.lastLine
+        if line is None:
+            line = fragments.lastLine = TextLine(fragments.posY[-1], self)
+        else:
+            line.truncate(self)
+        line.items.append(textItem)
+        return line
+
+    def closeLine(self):
+        """
+        后面的文本条不再接在本文本条的最后一行，重新计算这一行的行高，去掉之前接在后面的文本条的影响
+        """
+        fragments = self.textFragments
+        line = fragments.lastLine
+        if line:
+            line.truncate(self)
+            line.close()
+            if len(line.items) == 1:  # 只剩本文本条，不再需要
+                fragments.lastLine = None
+
+    @test("更新textItem纵坐标范围")
+    def updateHeightBoundary(self):  # 更新item高度范围，方便文字定位
+        fragments = self.textFragments
+        self.StartY = fragments.posY[0]
+        self.EndY = fragments.posY[-1] + fragments.lineHeight[-1]
+
+
+def layoutTextItems(textBlock):
+    """
+    段落的所有文本条重新断行，返回段落的高度
+    """
+    textItem = textBlock.RootTextItem
+    while textItem:
+        textItem.layoutFragments()
+        textItem = textItem.nextTextItem
+    fragments = textBlock.LastTextItem.textFragments
+    return fragments.posY[-1] + fragments.lineHeight[-1]
+
+
+class LayoutBlock():
+    """
+    没有界面的段落，只保存排版需要的属性
+    """
+    breakStrategy = DefaultBreakStrategy  # 断行策略，可以为单个段落指定
+
+    def __init__(self, blockWidth, lineSpacing=None, lineSpacingPolicy=None):
+        self.BlockWidth = blockWidth
+        self.lineSpacing = GlobalVars.CurrentLineSpacing if lineSpacing is None else lineSpacing
+        self.lineSpacingPolicy = GlobalVars.CurrentLineSpacingPolicy if lineSpacingPolicy is None else lineSpacingPolicy
+        self.RootTextItem = None
+        self.LastTextItem = None
+        self.lineIndex = None
+        self.height = 0
+
+    def getLineHeight(self, fontHeight):
+        return getLineHeight(fontHeight, self.lineSpacing, self.lineSpacingPolicy)
+
+    def addTextItem(self, text, fontAdvances, italic=False):
+        """
+        在段尾添加文本条
+        """
+        textItem = LayoutItem(self, self.LastTextItem)
+        textItem.setFontAdvances(fontAdvances, italic)
+        textItem.text = text
+        return textItem
+
+    def layout(self):
+        """
+        断行并返回段落高度
+        """
+        if not self.RootTextItem:  # 空段落也要有一行
+            self.addTextItem("", getFontAdvances(GlobalVars.CurrentFont))
+        self.height = int(layoutTextItems(self))  # 与界面上的段落一致，QWidget的高度为整数
+        return self.height
+
+
+def placeBlock(height, preBlockEndY, pageContentHeight, pageVerticalMargin):
+    """
+    计算段落在页面中的纵坐标，preBlockEndY为本页上一段的结束位置，None表示放在页首
+    本页放不下时返回None，需要移到下一页的页首
+    """
+    if preBlockEndY is None:
+        return pageVerticalMargin
+    if height + preBlockEndY > pageContentHeight:
+        return None
+    return preBlockEndY
+
+
+def paginate(heights, pageHeight=None, pageVerticalMargin=None):
+    """
+    根据各段的高度分页，返回每段所在的(页序号, 纵坐标)和每页的高度
+    与Document.paginate规则相同，一段超过页面内容高度时，放大所在页面
+    """
+    if pageHeight is None:
+        pageHeight = GlobalVars.PageHeight
+    if pageVerticalMargin is None:
+        pageVerticalMargin = GlobalVars.PageVerticalMargin
+    positions = []
+    pageHeights = [pageHeight]
+    preBlockEndY = None
+    for height in heights:
+        pageContentHeight = pageHeights[-1] - 2 * pageVerticalMargin
+        posY = placeBlock(height, preBlockEndY, pageContentHeight, pageVerticalMargin)
+        if posY is None:  # 移到下一页
+            pageHeights.append(pageHeight)
+            pageContentHeight = pageHeight - 2 * pageVerticalMargin
+            posY = pageVerticalMargin
+        if posY == pageVerticalMargin and height > pageContentHeight:  # 段落高度超过了页面高度
+            pageHeights[-1] = height + pageVerticalMargin * 2
+        positions.append((len(pageHeights) - 1, posY))
+        preBlockEndY = posY + height
+    return positions, pageHeights
+
+
+def main():
+    """
+    在命令行中排版html文件，不新建任何窗口，如 python layout.py ../../files/blender.html
+    """
+    parser = argparse.ArgumentParser(description="排版html文档，输出段落数、行数、页数和用时")
+    parser.add_argument("path", help="Document.toHtml导出的html文件")
+    parser.add_argument("--width", type=float, default=None, help="段落宽度，默认使用文件中的宽度")
+    parser.add_argument("--lines", action="store_true", help="输出每一行的位置和文字")
+    args = parser.parse_args()
+
+    app = QGuiApplication.instance() or QGuiApplication(["layout"])  # 测量字体需要，可配合QT_QPA_PLATFORM=offscreen使用
+    import doc  # 标题格式在doc中定义
+    import htmlreader
+    doc.initialize()
+
+    sta = perf_counter()
+    reader = htmlreader.HtmlReader()
+    with open(args.path, encoding="UTF-8") as f:
+        reader.feed(f.read())
+    reader.close()
+    parseTime = perf_counter() - sta
+
+    sta = perf_counter()
+    blocks = []
+    for htmlBlock in reader.blocks:
+        block = LayoutBlock(args.width or htmlBlock.width or GlobalVars.PageWidth - 2 * GlobalVars.PageHorizontalMargin,
+                            htmlBlock.lineSpacing, htmlBlock.lineSpacingPolicy)
+        titleLevel = next((t for t in GlobalVars.TitleLevels if t.toHtmlFormat == htmlBlock.tag), GlobalVars.T0)
+        if titleLevel is GlobalVars.T0:
+            for htmlItem in htmlBlock.items:
+                block.addTextItem(htmlItem.text, getFontAdvances(htmlItem.font), htmlItem.font.italic())
+        else:
+            block.addTextItem(htmlBlock.text, getFontAdvances(titleLevel.font), titleLevel.font.italic())
+        block.layout()
+        blocks.append(block)
+    layoutTime = perf_counter() - sta
+
+    sta = perf_counter()
+    positions, pageHeights = paginate([b.height for b in blocks])
+    paginateTime = perf_counter() - sta
+
+    lineCount = 0
+    for block, (pageIndex, posY) in zip(blocks, positions):
+        textItem = block.RootTextItem
+        while textItem:
+            for f in textItem.textFragments:
+                if f.posX == 0:
+                    lineCount += 1
+                if args.lines:
+                    print("{:>4} {:>8.1f} {:>8.1f} {:>8.1f}  {}".format(pageIndex + 1, posY + f.posY, f.posX, f.width,
+                                                                     f.text))
+            textItem = textItem.nextTextItem
+    print("段落 {}  行 {}  页 {}".format(len(blocks), lineCount, len(pageHeights)))
+    print("解析 {:.1f}ms  断行 {:.1f}ms  分页 {:.1f}ms".format(parseTime * 1000, layoutTime * 1000,
+                                                           paginateTime * 1000))
+
+
+if __name__ == "__main__":
+    main()
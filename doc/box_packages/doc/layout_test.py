@@ -0,0 +1,111 @@
+"""
+排版核心的测试，使用等宽的假字符宽度表，不需要字体和界面
+    python -m unittest layout_test
+"""
+import unittest
+from itertools import accumulate
+from layout import BreakStrategy, DefaultBreakStrategy, LayoutBlock
+
+
+class FixedAdvances():
+    """
+    每个字符宽10，空格宽0，行末的空格不会挤到下一行，便于手算断行结果
+    """
+    fontMetrics = "fixed"  # 只用于比较断行的属性是否改变
+    height = 10
+
+    def width(self, text):
+        return sum([0 if c == " " else 10 for c in text])
+
+    def prefixWidths(self, text):
+        return [0] + list(accumulate([0 if c == " " else 10 for c in text]))
+
+
+class CountingStrategy(BreakStrategy):
+    """
+    统计断出的行数，判断增量断行重新断了多少行
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def iterLines(self, item, text, startIndex, posX):
+        for line in DefaultBreakStrategy.iterLines(item, text, startIndex, posX):
+            self.count += 1
+            yield line
+
+
+def fragmentsOf(block):
+    result = []
+    textItem = block.RootTextItem
+    while textItem:
+        fragments = textItem.textFragments
+        result.append([tuple(getattr(fragments, name)) for name in (
+            "posX", "posY", "width", "lineHeight", "contentPosY", "fontHeight", "startIndex", "endIndex")])
+        textItem = textItem.nextTextItem
+    return result
+
+
+class IncrementalLayoutTest(unittest.TestCase):
+    Repeat = 500
+
+    def makeBlock(self, *texts):
+        block = LayoutBlock(100, 0, 1)  # 绝对行间距为0，行高等于字体高度
+        block.breakStrategy = CountingStrategy()
+        for text in texts:
+            block.addTextItem(text, FixedAdvances())
+        block.layout()
+        return block
+
+    def assertSameAsFresh(self, block):
+        texts = []
+        textItem = block.RootTextItem
+        while textItem:
+            texts.append(textItem.text)
+            textItem = textItem.nextTextItem
+        self.assertEqual(fragmentsOf(block), fragmentsOf(self.makeBlock(*texts)))
+
+    def test_wrapWordToNewLine(self):
+        """
+        插入的单词把后面的单词挤到新的一行，行数增加，后面的行对齐后只平移纵坐标
+        每组文字占两行："aaa bbb "一行，"xxxxxxxxxx "正好占满一行
+        """
+        block = self.makeBlock("aaa bbb xxxxxxxxxx " * self.Repeat, "tail")
+        textItem = block.RootTextItem
+        lineCount = len(textItem.textFragments)
+        block.breakStrategy.count = 0
+        textItem.buffer.insert(4, "ccccc ")
+        self.assertFalse(textItem.layoutFragments(4, 6))  # 后面的文本条需要移动
+        textItem.nextTextItem.layoutFragments(0, 0)
+        self.assertLessEqual(block.breakStrategy.count, 6)
+        self.assertEqual(len(textItem.textFragments), lineCount + 1)
+        self.assertEqual(textItem.dirtyBottom, textItem.EndY)  # 重绘到文本条末尾
+        self.assertSameAsFresh(block)
+
+    def test_removeLine(self):
+        """
+        删除文字使一行消失，后面的行向上平移
+        """
+        block = self.makeBlock("aaa ccccc bbb xxxxxxxxxx " + "aaa bbb xxxxxxxxxx " * self.Repeat)
+        textItem = block.RootTextItem
+        block.breakStrategy.count = 0
+        textItem.buffer.delete(4, 10)
+        textItem.layoutFragments(4, -6)
+        self.assertLessEqual(block.breakStrategy.count, 6)
+        self.assertSameAsFresh(block)
+
+    def test_sameLineCount(self):
+        """
+        行数不变时，对齐后沿用原来的行，后面的文本条不需要更新
+        """
+        block = self.makeBlock("aaa bbb xxxxxxxxxx " * self.Repeat, "tail")
+        textItem = block.RootTextItem
+        block.breakStrategy.count = 0
+        textItem.buffer.insert(4, "c")
+        self.assertTrue(textItem.layoutFragments(4, 1))
+        self.assertLessEqual(block.breakStrategy.count, 3)
+        self.assertSameAsFresh(block)
+
+
+if __name__ == "__main__":
+    unittest.main()
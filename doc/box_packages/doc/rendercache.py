@@ -0,0 +1,64 @@
+from collections import OrderedDict
+from PySide2.QtCore import Qt
+from PySide2.QtGui import QPixmap, QPainter
+import globalvars
+
+GlobalVars = globalvars.GlobalVars
+
+
+class RenderCache():
+    """
+    段落绘制结果的缓存，没有在编辑的段落重绘时（比如滚动文档）直接复制缓存的QPixmap，不需要再逐个绘制文字
+    段落的renderGeneration、大小或设备像素比改变时，缓存失效
+    所有段落共用一个内存预算，超出时删除最久没有使用的缓存
+    """
+
+    def __init__(self, budget):
+        self.budget = budget  # 缓存最多占用的字节数
+        self.cost = 0  # 缓存当前占用的字节数
+        self.entries = OrderedDict()  # 格式为 段落:(generation, 大小, 设备像素比, pixmap, 字节数)，按最近使用排序
+
+    def pixmap(self, block):
+        """
+        返回段落的绘制结果，缓存失效时重新绘制，超出预算时返回None，由段落直接绘制
+        """
+        ratio = block.devicePixelRatioF()
+        width, height = block.width(), block.height()
+        entry = self.entries.get(block)
+        if entry:
+            generation, size, pixmapRatio, pixmap, cost = entry
+            if generation == block.renderGeneration and size == (width, height) and pixmapRatio == ratio:
+                self.entries.move_to_end(block)
+                return pixmap
+            self.discard(block)
+
+        cost = int(width * ratio) * int(height * ratio) * 4  # 每个像素4个字节
+        if not cost or cost > self.budget:
+            return None
+        pixmap = QPixmap(int(width * ratio), int(height * ratio))
+        pixmap.setDevicePixelRatio(ratio)  # 按设备像素绘制，高分屏上不会模糊
+        pixmap.fill(Qt.transparent)
+        painter = QPainter(pixmap)
+        block.paintContent(painter, block.rect())
+        painter.end()
+        self.entries[block] = (block.renderGeneration, (width, height), ratio, pixmap, cost)
+        self.cost += cost
+        while self.cost > self.budget:  # 删除最久没有使用的缓存
+            entry = self.entries.popitem(last=False)[1]
+            self.cost -= entry[4]
+        return pixmap
+
+    def discard(self, block):
+        """
+        删除段落的缓存，段落删除时使用
+        """
+        entry = self.entries.pop(block, None)
+        if entry:
+            self.cost -= entry[4]
+
+    def clear(self):
+        self.entries.clear()
+        self.cost = 0
+
+
+RenderCacheTable = RenderCache(GlobalVars.RenderCacheBudget)  # 全局的绘制缓存，所有文档共用
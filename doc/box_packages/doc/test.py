@@ -1,4 +1,28 @@
+import os
+import sys
+import atexit
+from collections import deque
 from functools import wraps
+from time import perf_counter
+
+# 跟踪模式由环境变量DOC_TRACE决定，多个模式用逗号分隔，如 DOC_TRACE=print,stats
+# print 打印调用层次；stats 统计每个函数的调用次数和累计时间，退出时输出
+# stats模式下，在编辑器中按ctrl+shift+d随时输出目前为止的统计和最近的调用，不需要退出，如
+#     DOC_TRACE=stats python doc.py
+# 打开文档或输入一段文字后按ctrl+shift+d，结果输出到标准错误
+# 没有设置或者只有不认识的模式时，test装饰器直接返回原函数，不会带来任何额外开销
+KnownModes = {"print", "stats"}
+TraceModes = set(m.strip() for m in os.environ.get("DOC_TRACE", "").split(",") if m.strip())
+if TraceModes - KnownModes:
+    print("DOC_TRACE中的模式{}无效，可用的模式为print,stats".format(",".join(sorted(TraceModes - KnownModes))),
+          file=sys.stderr)
+    TraceModes &= KnownModes
+IsPrint = "print" in TraceModes
+IsStats = "stats" in TraceModes
+RecordSize = int(os.environ.get("DOC_TRACE_SIZE", 1000))  # 最多保存最近多少次调用
+
+Stats = {}  # 每个函数的统计，格式为 名称:[调用次数, 累计时间]
+Records = deque(maxlen=RecordSize)  # 最近的调用，格式为(名称, 用时)，超出容量时自动丢弃最早的记录
 global prefix  # 前缀，方便阅读
 prefix = ""
 
@@ -6,19 +30,60 @@ prefix = ""
 # 本装饰器针对类函数,特别注意
 def test(name=""):
     def dec(func):
+        if not TraceModes:  # 没有开启跟踪，不做任何包装
+            return func
+        key = "{} {}".format(func.__qualname__, name)  # 同一个提示语可能用在不同的函数上
+        stat = Stats.setdefault(key, [0, 0.0])
+
         @wraps(func)
         def w1(*args, **argv):
             global prefix
+            if IsPrint:
+                prefix += "    "
+                print(prefix, name)  # 打印函数的提示语
+            sta = perf_counter()
             try:
-                prefix += ("    ")
-                print(prefix,name,end=" ")#打印函数的提示语
-                # print(args[0],end=" ")#打印当前类的名称
-                # print(func.__name__,end=" ")#打印当前函数名称
-                print("")
                 return func(*args, **argv)
-            except Exception as e:
-                raise e
             finally:
-                prefix = prefix[:-4]
+                t = perf_counter() - sta
+                if IsPrint:
+                    prefix = prefix[:-4]
+                if IsStats:
+                    stat[0] += 1
+                    stat[1] += t
+                    Records.append((key, t))
+
         return w1
+
     return dec
+
+
+def dump(recordCount=20, file=None):
+    """
+    输出各函数的调用次数和累计时间（包括内部调用的函数），按累计时间排序，再输出最近recordCount次调用
+    退出时自动调用，运行时由文档的ctrl+shift+d快捷键调用
+    """
+    if file is None:
+        file = sys.stderr
+    print("{:>10} {:>12} {:>12}  {}".format("调用次数", "累计时间(ms)", "平均时间(ms)", "函数"), file=file)
+    for key, (count, total) in sorted(Stats.items(), key=lambda i: i[1][1], reverse=True):
+        if count:
+            print("{:>10} {:>12.3f} {:>12.4f}  {}".format(count, total * 1000, total * 1000 / count, key), file=file)
+    if recordCount and Records:
+        print("最近{}次调用".format(min(recordCount, len(Records))), file=file)
+        for key, t in list(Records)[-recordCount:]:
+            print("{:>12.4f}  {}".format(t * 1000, key), file=file)
+
+
+def reset():
+    """
+    清空统计和调用记录
+    """
+    for stat in Stats.values():
+        stat[0] = 0
+        stat[1] = 0.0
+    Records.clear()
+
+
+if IsStats:
+    atexit.register(dump)  # 退出时输出统计结果
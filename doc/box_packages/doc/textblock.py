@@ -1,13 +1,18 @@
 from block import Block
-from time import time
-from PySide2.QtGui import QFontMetrics, QPalette, QPainter, QColor, QFont
+from contextlib import contextmanager
+from PySide2.QtGui import QColor, QFont
 from PySide2.QtCore import QRect, Qt, QPoint, QTimer
 from PySide2.QtWidgets import QApplication, QLabel
 from test import test
+from fontcache import getFontAdvances
+from layout import LayoutItem, LineIndex, charIndexAt, getLineHeight, layoutTextItems, DefaultBreakStrategy
+from journal import InsertText, DelText, SetText, SetAttr, AddTextItem, DelTextItem
+from htmlwriter import ItemSnapshot, BlockSnapshot, iterBlockHtml
 import globalvars
 
 GlobalVars = globalvars.GlobalVars
 SelStatus = globalvars.SelStatus
+UpdateView = globalvars.UpdateView
 global CurrentTextItem
 CurrentTextItem = None
 global CurrentTextItemIndex  # currentTextItem的索引位置
@@ -16,61 +21,25 @@ global CurrentTextFragment
 CurrentTextFragment = None
 
 
-class readWord():
+@contextmanager
+def keepCurrent():
     """
-    按单词读取，保证单词的连续性
-    比如 "_ab1"返回"_","ab","1"
+    期间新建的文档和段落不改变当前的文档、段落和文本条，用于后台打开文档
     """
+    global CurrentTextItem, CurrentTextItemIndex, CurrentTextFragment
+    current = (GlobalVars.CurrentDocument, GlobalVars.CurrentBlock,
+               CurrentTextItem, CurrentTextItemIndex, CurrentTextFragment)
+    try:
+        yield
+    finally:
+        (GlobalVars.CurrentDocument, GlobalVars.CurrentBlock,
+         CurrentTextItem, CurrentTextItemIndex, CurrentTextFragment) = current
 
-    def __init__(self, text):
-        self.text = str(text)
-        self.textLength = len(self.text)
 
-    def __iter__(self):
-        self.index = 0
-        return self
+# 文本条，断行由LayoutItem完成，这里负责格式、光标和视图的更新
+class TextItem(LayoutItem):
+    isRecorded = False  # 新建完成后，修改才记入撤销记录，新建时的文字和格式包含在新建操作中
 
-    def __next__(self):
-        if self.index == self.textLength:  # 到达最后一个字符
-            raise StopIteration
-        else:
-            text = ""
-            while self.index != self.textLength:
-                if self.text[self.index].encode("UTF-8").isalpha():  # 转变成utf-8判断
-                    text += self.text[self.index]
-                    self.index += 1
-                else:
-                    if not text:  # 直接读到非字母字符
-                        text = self.text[self.index]
-                        self.index += 1
-                    break
-            return text
-
-
-class UpdateView():
-    """
-    决定是否立马更新视图等
-    当需要界面更新时候,会更新坐标、大小、光标 等,反之,只更新基本属性即可，以节约性能
-    """
-    updateNone = 0  # 不更新
-    updateAll = 1  # 更新所有，会影响后面的部分
-
-
-class TextFragment():
-    # 分别表示片段的起始x,y值，宽度，所占行高，文字内容，文字的起始纵坐标，文字的高度，在文本条中所占的索引范围
-    def __init__(self, posX, posY, width, lineHeight, text, contentPosY, fontHeight, startIndex, endIndex):
-        self.posX = posX
-        self.posY = posY
-        self.width = width
-        self.lineHeight = self.preLineHeight = lineHeight  # prelinheight指的是由于前面的文字较大，导致本fragment行高较大，lineheight综合考虑前面和后面的文字大小
-        self.text = text
-        self.contentPosY = self.preContentPosY = contentPosY
-        self.fontHeight = self.preFontHeight = fontHeight
-        self.startIndex = startIndex
-        self.endIndex = endIndex
-
-
-class TextItem():
     @test("创建文本条")
     def __init__(self, textBlock=None, text="", preTextItem=False, font=None, textColor=None, backgroundColor=False,
                  updateView=UpdateView.updateAll):
@@ -86,24 +55,7 @@ class TextItem():
         if backgroundColor is False:
             backgroundColor = GlobalVars.CurrentBackgroundColor
 
-        self.textBlock = textBlock
-        self.textFragments = []  # 默认为空
-
-        self.preTextItem = preTextItem  # preTextItem为None，表示第一段
-        if preTextItem:  # 不是第一个文字条
-            self.nextTextItem = preTextItem.nextTextItem
-            preTextItem.nextTextItem = self
-            if self.nextTextItem:  # 后面有文本条
-                self.nextTextItem.preTextItem = self
-            else:  # 新建的是最后一个文本条
-                self.textBlock.LastTextItem = self
-        else:  # 段首插入文本条
-            self.nextTextItem = self.textBlock.RootTextItem
-            self.textBlock.RootTextItem = self
-            if self.nextTextItem:  # 本段不是空段，有其他文本条
-                self.nextTextItem.preTextItem = self
-            else:  # 本段是空段
-                self.textBlock.LastTextItem = self
+        super().__init__(textBlock, preTextItem)  # 加入段落的文本条链表，preTextItem为None，表示第一段
         self.isSelected = False  # 用于判断是否处于选中状态
         self.font = None  # 不可少，否则setfont出错
         self.setFont(font, updateView=UpdateView.updateNone)  # 此时没有self.text，所以不能更新视图
@@ -112,6 +64,8 @@ class TextItem():
         self.text = None  # 不可少，否则setText出错
         self.setText(text, updateView=updateView)
         self.setAsCurrentTextItem()
+        textBlock.document.journal.record(AddTextItem(self, preTextItem))
+        self.isRecorded = True
 
         if updateView:  # 跟新段落、光标等
             self.textBlock.updateSize()
@@ -125,6 +79,8 @@ class TextItem():
 
     def setText(self, text, updateView=UpdateView.updateAll):
         if self.text != text:
+            if self.isRecorded:
+                self.textBlock.document.journal.record(SetText(self, self.text, text))
             self.text = text
             if updateView:
                 self.updateAllTextFragments()  # 生成textFragment
@@ -135,31 +91,35 @@ class TextItem():
 
     def setFont(self, font, updateView=UpdateView.updateAll):  # 可优化，类变量调用改成局部变量调用
         if self.font != font:  # 刚开始没
+            if self.isRecorded:
+                self.textBlock.document.journal.record(SetAttr(self, TextItem.setFont, self.font, font))
             self.font = font
-            self.fontMetrics = QFontMetrics(font)
-            self.fontHeight = self.fontMetrics.height()
-            self.lineHeight = self.textBlock.getLineHeight(
-                self.fontHeight)  # 根据textBlock策略返回行高。默认根据字体越大，上下获得的间距也越大，产生更好的视觉效果
-            self.contentPosY = (self.lineHeight - self.fontHeight) / 2  # 如果有填充，填充开始的纵坐标
+            self.setFontAdvances(getFontAdvances(font), font.italic())  # 同一字体的textItem共用字符宽度表，同时更新行高
 
             if updateView:
                 self.updateAllTextFragments()
 
     def setTextColor(self, color):
+        if self.isRecorded and self.textColor != color:
+            self.textBlock.document.journal.record(SetAttr(self, TextItem.setTextColor, self.textColor, color))
         self.textColor = color
 
     def setBackgroundColor(self, color):  # color为None,表示没有填充
+        if self.isRecorded and self.backgroundColor != color:
+            self.textBlock.document.journal.record(
+                SetAttr(self, TextItem.setBackgroundColor, self.backgroundColor, color))
         self.backgroundColor = color
 
     @test("插入文字")
     def insertText(self, text, index=None, updateView=UpdateView.updateAll):
         global CurrentTextItemIndex
-        if not index:
+        if index is None:  # index可能为0
             index = CurrentTextItemIndex
-        t = self.text  # 当前的text
-        self.text = t[:index] + text + t[index:]
+        if self.isRecorded and text:
+            self.textBlock.document.journal.record(InsertText(self, index, text))
+        self.buffer.insert(index, text)  # 只修改片段表，不复制整个字符串
         if updateView:  # 更新视图
-            self.updateAllTextFragments()  # 之所以和updatesize分开，是因为更新textfragment会导致nextTextItem相继更新，没有必要每一次都跟新段落大小
+            self.updateAllTextFragments(index, len(text))  # 之所以和updatesize分开，是因为更新textfragment会导致nextTextItem相继更新，没有必要每一次都跟新段落大小
             CurrentTextItemIndex = index + len(text)
             self.textBlock.updateCursor()  # 更新光标
 
@@ -168,9 +128,11 @@ class TextItem():
         global CurrentTextItemIndex
         if startIndex is None:  # startindex可能为0
             startIndex = endIndex = CurrentTextItemIndex
-        self.text = self.text[0:startIndex] + self.text[endIndex + 1:]
+        if self.isRecorded and endIndex >= startIndex:
+            self.textBlock.document.journal.record(DelText(self, startIndex, self.buffer[startIndex:endIndex + 1]))
+        self.buffer.delete(startIndex, endIndex + 1)
         if updateView:  # 立刻更新视图，比如回车删除，当进行多行或段文字删除等操作的时候，只需要最后统一更新
-            self.updateAllTextFragments()
+            self.updateAllTextFragments(startIndex, startIndex - endIndex - 1)
             self.setAsCurrentTextItem()
             CurrentTextItemIndex = startIndex
             self.textBlock.updateCursor()
@@ -215,12 +177,10 @@ class TextItem():
 
         preTextItem = self.preTextItem
         nextTextItem = self.nextTextItem
+        if preTextItem or nextTextItem:  # 不是本段唯一的item，从链表中移除，撤销时放回
+            self.textBlock.document.journal.record(DelTextItem(self, preTextItem))
+            self.unlinkTextItem()
         if preTextItem:  # 删除的非首句
-            preTextItem.nextTextItem = nextTextItem
-            if nextTextItem:  # 删除的是中间的item
-                nextTextItem.preTextItem = preTextItem
-            else:  # 删除的是最后一个item
-                self.textBlock.LastTextItem = preTextItem
             if updateView:  # 是当前的textItem，因此要更新currentTextItem
                 preTextItem.setAsCurrentTextItem()
                 preTextItem.updateAllTextFragments()
@@ -228,8 +188,6 @@ class TextItem():
                 self.textBlock.updateCursor()
         else:  # 本段第一个item
             if nextTextItem:  # 不是本段最后一个item
-                nextTextItem.preTextItem = None
-                self.textBlock.RootTextItem = nextTextItem
                 if updateView:
                     nextTextItem.setAsCurrentTextItem()
                     nextTextItem.updateAllTextFragments()
@@ -249,396 +207,72 @@ class TextItem():
         if updateView:
             self.updateAllTextFragments()  # 可优化，对于颜色这些属性，不需要更新fragment 待完善，可以自由选择那些属性复制
 
-    def italicWidth(self, text):  # 待优化，有些字符没有斜体
+    @test("更新textFragment")
+    def updateAllTextFragments(self, editIndex=None, editLength=0):  # 自动区分单词
         """
-        如果是斜体，要增加一定空间保证字符显示正确
+        更新本文本条的textFragment，并依次更新后面的文本条
+        editIndex为None时全部重新断行；否则从编辑位置所在行开始增量断行，editLength为插入（正）或删除（负）的字符数
+        一旦某个文本条的行首与之前的排版重新对齐，后面的文本条和段落大小都不需要再更新
         """
-        if self.font.italic():
-            return self.fontMetrics.width(text) / 2
-        else:
-            return 0
-
-    @test("更新textFragment")
-    def updateAllTextFragments(self):  # 自动区分单词 待优化，极端情况比旧算法慢二十倍,考虑只对dangqianitem更新的情况
-        sta = time()  # 测试
-        preTextItem = self.preTextItem
-        fontMetricsWidth = self.fontMetrics.width
-        italicWidth = self.italicWidth
-        blockWidth = self.textBlock.BlockWidth
-        lineHeight = self.lineHeight
-        fontHeight = self.fontHeight
-        contentPosY = self.contentPosY  # 填充的纵坐标便宜
-        self.textFragments = []
-
-        if preTextItem:  # 不是第一个item
-            preFragment = preTextItem.textFragments[-1]
-            fragmentStartPosX = preFragment.posX + preFragment.width
-            fragmentStartPosY = preFragment.posY
-        else:  # 第一个item
-            fragmentStartPosX = 0
-            fragmentStartPosY = 0
-        if self.text:  # 有文字
-            text = iter(readWord(self.text))  # 按照单词读取
-
-            fragmentText = ""  # 当前fragment里的文字
-            fragmentWidth = 0  # 当前摄入fragment的文字宽度
-            fragmentStartIndex = 0
-            fragmentEndIndex = -1
-            # fragment 包括posX, posY, width, lineHeight, text, contentPosY, fontHeight, startIndex, endIndex这些属性，其中lineHeight fontHeight固定，只需要更新其他属性
-            while True:
-                try:
-                    w = next(text)  # 读取单词
-                    width = fontMetricsWidth(w)  # 当前摄入的单词宽度
-                    italicwidth = italicWidth(w[-1])  # 耗费大量性能
-                    while fragmentStartPosX + fragmentWidth + width + italicwidth > blockWidth:  # 超出单行限制 +fontMetricsWidth(])/2
-                        if fragmentText:  # 前面有单词，因此先记录前面的单词，并生成新行
-                            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY,
-                                                           fragmentWidth + italicWidth(
-                                                               self.text[fragmentStartIndex - 1]),
-                                                           lineHeight, fragmentText,
-                                                           contentPosY + fragmentStartPosY,
-                                                           fontHeight, fragmentStartIndex, fragmentEndIndex)
-                            self.textFragments.append(newTextFragment)
-                            self.updateLine()  # 更新行高 可优化，只有与不同大小的文字在同一行时，才需要考虑
-                            preFragment = newTextFragment
-                            fragmentStartPosX = 0
-                            fragmentStartPosY = preFragment.posY + preFragment.lineHeight
-                            fragmentText = ""  # 准备计算下一个textfragment
-                            fragmentWidth = 0
-                            fragmentStartIndex = fragmentEndIndex + 1  # fragmentendindex不变w没进行处理，因此继续循环
-                        elif fragmentStartPosX != 0:  # 没有压入新的单词，但是前面有别的文字，因此直接新起一行，同时不会更新高度，同时会继续上述的循环，这也是while存在的意义
-                            fragmentStartPosX = 0
-                            fragmentStartPosY = preFragment.posY + preFragment.lineHeight
-                            fragmentWidth = 0
-                        else:  # 文字位于行头，证明必须要进行拆解才行，注意单个文字的存在
-                            totalText = w  # 记录w，因为下面w会变化
-                            totalwidth = width  # 记录w的总长度，因为下面width会变化
-                            for c in w[1::-1]:  # 因为至少要留一个字符，所以不取第一位字符，这种方式从后向前调用，对于中文可大量节省时间
-                                cwidth = fontMetricsWidth(c)  # 字符的宽度
-                                width -= cwidth
-                                w = w[:-1]
-                                citalicwidth = italicWidth(c)
-                                if fragmentWidth + citalicwidth <= blockWidth:  # 可以放下
-                                    fragmentWidth = width  # 等同于framentWidth+=width
-                                    fragmentText = w  # 等同于ftamentText+=w
-                                    newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY,
-                                                                   fragmentWidth + citalicwidth,
-                                                                   lineHeight, fragmentText,
-                                                                   contentPosY + fragmentStartPosY,
-                                                                   fontHeight, fragmentStartIndex, fragmentEndIndex)
-                                    self.textFragments.append(newTextFragment)
-                                    preFragment = newTextFragment
-                                    fragmentStartPosX = 0
-                                    fragmentStartPosY = preFragment.posY + preFragment.lineHeight
-                                    fragmentText = ""  # 准备计算下一个textfragment
-                                    fragmentStartIndex = fragmentEndIndex + 1  # fragmentendindex不变
-                                    w = totalText[len(w):]  # 更新 剩下的字符
-                                    width = totalwidth - width  # 更新width
-                                    continue  # 处理接下来的文字，也就是w
-                            # 循环完了，依然大于宽度，证明第一个字符就很大，但是至少要压入一个字符
-                            fragmentText = w
-                            fragmentWidth = width
-                            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, fragmentWidth,
-                                                           lineHeight, fragmentText,
-                                                           contentPosY + fragmentStartPosY,
-                                                           fontHeight, fragmentStartIndex, fragmentEndIndex)
-                            self.textFragments.append(newTextFragment)
-                            preFragment = newTextFragment
-                            fragmentStartPosX = 0
-                            fragmentStartPosY = preFragment.posY + preFragment.lineHeight
-                            fragmentText = ""  # 准备计算下一个textfragment
-                            fragmentStartIndex = fragmentEndIndex + 1  # fragmentendindex不变
-                            w = totalText[1:]  # 更新 剩下的字符
-                            width = totalwidth - width  # 更新width
-
-                    fragmentText += w
-                    fragmentWidth += width
-                    fragmentEndIndex += len(w)  # 更新索引
-                except StopIteration:
-                    break
-            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY,
-                                           fragmentWidth + italicWidth(fragmentText[-1]),
-                                           lineHeight, fragmentText,
-                                           contentPosY + fragmentStartPosY,
-                                           fontHeight, fragmentStartIndex, fragmentEndIndex)  # 添加最后一个textfragment
-            self.textFragments.append(newTextFragment)
-            self.updateLine()  # 可优化，只有与不同大小的文字同处一行才需要判断
-        else:  # 空的item
-            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, 0, lineHeight, "",
-                                           contentPosY + fragmentStartPosY, fontHeight, 0, 0)
-            self.textFragments.append(newTextFragment)
-            self.updateLine()  # 可优化，只有与不同大小的文字同处一行才需要判断
-
-        t = time() - sta  # 测试
-        print(t, "稳定更新textFragment的时间")  # 测试
-        self.updateHeightBoundary()  # 更新边界，为了鼠标定位使用
-
-        if self.nextTextItem:
-            self.nextTextItem.updateAllTextFragments()
-        else:
-            self.textBlock.updateSize()
+        textBlock = self.textBlock
+        if textBlock.document.layoutLock:  # 批量编辑，结束时整段统一断行
+            textBlock.document.markDirty(textBlock, True)
+            return
+        textItem = self
+        isSynced = textItem.layoutFragments(editIndex, editLength)
+        dirtyTop = textItem.dirtyTop
+        while not isSynced and textItem.nextTextItem:  # 起始位置可能改变，后面的文本条从头断行，但允许在之后的行对齐
+            textItem = textItem.nextTextItem
+            isSynced = textItem.layoutFragments(0, 0)
 
-    # 旧算法
-    def updateAllTextFragment(self):  # 较为快速的更新方式
-        sta = time()  # 测试
-
-        self.textFragments = []  # 恢复默认
-        text = self.text
-        blockWidth = self.textBlock.BlockWidth
-        fontMetricsWidth = self.fontMetrics.width
-        fontHeight = self.fontHeight
-        lineHeight = self.lineHeight
-        contentPosY = self.contentPosY
-        textLength = len(text)
-        maxIndex = textLength - 1
-
-        # 确定起始x坐标值
-        if self.preTextItem:  # 前边有其他文本条
-            preFragment = self.preTextItem.textFragments[-1]
-            fragmentStartPosX = preFragment.posX + preFragment.width  # 可优化，可以将其存储起来，避免每次计算
-            fragmentStartPosY = preFragment.posY
-        else:  # 第一行文字
-            fragmentStartPosX = 0
-            fragmentStartPosY = 0
-        fragmentStartIndex = fragmentEndIndex = 0
-        # self, posX, posY, width, lineHeight, text, contentPosY, fontHeight, startIndex, endIndex textfragment的参数
-        if text:  # 不是空的
-            textWidth = fontMetricsWidth(text)  # 剩余文字需要的空间 总长度
-            if fragmentStartPosX != 0:  # 先计算第一行
-                line1Remainder = blockWidth - fragmentStartPosX
-                if fontMetricsWidth(text[0]) > line1Remainder:  # 字体较大 第一个文字就超过了,另起新行
-                    fragmentStartPosX = 0
-                    fragmentStartPosY += preFragment.lineHeight
-                else:
-                    line1charnum = int(
-                        line1Remainder / textWidth * textLength)  # 预估第一行的字数，lineremainder可能比textwidthremiande大，所以会越界,需要先将整个宽度计算一遍 ，可优化，取一个平均数计算
-                    line1charnum = min(line1charnum, maxIndex)  # 确保不会越界
-                    fragmentEndIndex = line1charnum
-                    text1 = text[:fragmentEndIndex + 1]
-                    text1Width = fontMetricsWidth(text1)
-                    status = None
-                    while True:
-                        if text1Width == line1Remainder:  # 恰好占满一行
-                            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text1Width,
-                                                           lineHeight, text1, contentPosY + fragmentStartPosY,
-                                                           fontHeight, fragmentStartIndex, fragmentEndIndex)
-                            self.textFragments.append(newTextFragment)
-
-                            # 下一行，不一定存在
-                            fragmentStartIndex = fragmentEndIndex + 1
-                            fragmentStartPosX = 0  # 第二行的开始横坐标
-                            fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                            break
-                        elif text1Width < line1Remainder:
-                            if status == 1:  # 上一个字符超出了文档宽度
-                                newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text1Width,
-                                                               lineHeight, text1, contentPosY + fragmentStartPosY,
-                                                               fontHeight, fragmentStartIndex, fragmentEndIndex)
-                                self.textFragments.append(newTextFragment)
-
-                                fragmentStartIndex = fragmentEndIndex + 1
-                                fragmentStartPosX = 0
-                                fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                                break
-                            else:
-                                status = 0
-                                fragmentEndIndex += 1
-                                if fragmentEndIndex == textLength:  # 全部文字都在一行以内
-                                    newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text1Width,
-                                                                   lineHeight, text1, contentPosY + fragmentStartPosY,
-                                                                   fontHeight, fragmentStartIndex, fragmentEndIndex - 1)
-                                    self.textFragments.append(newTextFragment)
-                                    fragmentStartIndex = fragmentEndIndex  # 方便之后判断
-                                    break
-                                t = text[fragmentEndIndex]
-                                text1 += t
-                                text1Width += fontMetricsWidth(t)
-                        else:
-                            if status == 0:  # 上一个文字宽度小于文档宽度
-                                text1Width -= fontMetricsWidth(text[fragmentEndIndex])
-                                newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text1Width,
-                                                               lineHeight, text1[:-1],
-                                                               contentPosY + fragmentStartPosY, fontHeight,
-                                                               fragmentStartIndex, fragmentEndIndex - 1)
-                                self.textFragments.append(newTextFragment)
-
-                                fragmentStartIndex = fragmentEndIndex
-                                fragmentStartPosX = 0
-                                fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                                break
-                            else:
-                                status = 1
-                                text1 = text1[:-1]  # 如果文字较大，会自动到第二行 不需要单独考虑
-                                text1Width -= fontMetricsWidth(text[fragmentEndIndex])
-                                fragmentEndIndex -= 1
-                    self.updateLine()
-            if fragmentStartIndex != textLength:  # textitem 从0坐标开始 或者有第二行存在
-                line2charnum = int(blockWidth / textWidth * textLength)  # 一行大概能容纳的字数
-                while True:  # 计算不同的行
-                    if fragmentStartIndex > maxIndex:  # 全部解析完毕
-                        break
-                    fragmentEndIndex = fragmentStartIndex + line2charnum  # 不需要考虑减一的问题，本来就是估计
-                    fragmentEndIndex = min(fragmentEndIndex, maxIndex)  # 保证不越界
-                    text2 = text[fragmentStartIndex:fragmentEndIndex + 1]
-                    text2Width = fontMetricsWidth(text2)
-                    status = None  # 恢复状态，用于判断
-                    while True:
-                        if text2Width == blockWidth:  # 恰好占满一行
-                            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text2Width,
-                                                           lineHeight, text2, contentPosY + fragmentStartPosY,
-                                                           fontHeight, fragmentStartIndex, fragmentEndIndex)
-                            self.textFragments.append(newTextFragment)
-
-                            # 下一行
-                            fragmentStartIndex = fragmentEndIndex + 1
-                            fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                            break
-                        elif text2Width < blockWidth:
-                            if status == 1:  # 上一个字符超出了文档宽度
-                                newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text2Width,
-                                                               lineHeight, text2, contentPosY + fragmentStartPosY,
-                                                               fontHeight, fragmentStartIndex, fragmentEndIndex)
-                                self.textFragments.append(newTextFragment)
-
-                                fragmentStartIndex = fragmentEndIndex + 1
-                                fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                                break
-                            else:
-                                status = 0
-                                if fragmentEndIndex == maxIndex:  # 已经是最后一个字符
-                                    newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text2Width,
-                                                                   lineHeight, text2, contentPosY + fragmentStartPosY,
-                                                                   fontHeight, fragmentStartIndex, fragmentEndIndex)
-                                    self.textFragments.append(newTextFragment)
-
-                                    fragmentStartIndex = fragmentEndIndex + 1  # 之后判断需要
-                                    break
-                                fragmentEndIndex += 1
-                                t = text[fragmentEndIndex]
-                                text2 += t
-                                text2Width += fontMetricsWidth(t)
-                        else:
-                            if status == 0:  # 上一个文字宽度小于文档宽度
-                                text2Width -= fontMetricsWidth(text[fragmentEndIndex])
-                                newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text2Width,
-                                                               lineHeight, text2[:-1],
-                                                               contentPosY + fragmentStartPosY, fontHeight,
-                                                               fragmentStartIndex, fragmentEndIndex - 1)
-                                self.textFragments.append(newTextFragment)
-
-                                fragmentStartIndex = fragmentEndIndex
-                                fragmentStartPosY = newTextFragment.posY + newTextFragment.lineHeight
-                                break
-                            else:
-                                status = 1
-                                t = text2[:-1]
-                                if not t:  # 字体较大，字符本身已经超出了行范围,但是每行至少应该有一个字符，否则会无休止循环下去
-                                    newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, text2Width,
-                                                                   lineHeight, text2, contentPosY + fragmentStartPosY,
-                                                                   fontHeight, fragmentStartIndex, fragmentEndIndex)
-                                    self.textFragments.append(newTextFragment)
-
-                                    fragmentStartIndex = fragmentEndIndex + 1
-                                    break
-                                text2 = t
-                                text2Width -= fontMetricsWidth(text[fragmentEndIndex])
-                                fragmentEndIndex -= 1
+        lastFragment = textBlock.LastTextItem.textFragments[-1]
+        if textBlock.height() == int(lastFragment.posY + lastFragment.lineHeight):  # 段落高度没变，只需要重绘变化的行
+            textBlock.update(0, dirtyTop, textBlock.width(), textItem.dirtyBottom - dirtyTop)  # 没有对齐时到段尾为止
         else:
-            newTextFragment = TextFragment(fragmentStartPosX, fragmentStartPosY, 0,
-                                           lineHeight, "", contentPosY + fragmentStartPosY,
-                                           fontHeight, fragmentStartIndex,
-                                           fragmentEndIndex)  # fragmentStartIndex, fragmentEndIndex均为0
-            self.textFragments.append(newTextFragment)
-            self.updateLine()
-
-        self.updateHeightBoundary()  # 更新边界，为了鼠标定位使用
-
-        t = time() - sta  # 测试
-        print(t, "更新textFragment的时间")  # 测试
-
-        if self.nextTextItem:
-            self.nextTextItem.updateAllTextFragments()
-        else:
-            self.textBlock.updateSize()
-
-    def updateLine(self):  # 在产生新行也就是产生新的textFragment的时候使用
-        lastFragment = self.textFragments[-1]
-        if lastFragment.posX != 0:  # 同一行中，前面有fragment
-            preTextItem = self.preTextItem
-            preFragment = preTextItem.textFragments[-1]
-            if preFragment.preLineHeight <= lastFragment.preLineHeight:  # 当前的字符大小大于之前的
-                preFragment.lineHeight = lastFragment.lineHeight
-                preFragment.fontHeight = lastFragment.fontHeight
-                preFragment.contentPosY = lastFragment.contentPosY
-                preTextItem.updateLine()  # 前面的textitem更新 因为处于同行的一定是最后一个textFragment，不必担心出错
-
-            else:  # 之前的大于当前的
-                lastFragment.lineHeight = preFragment.lineHeight
-                lastFragment.preLineHeight = preFragment.preLineHeight
-
-                lastFragment.fontHeight = preFragment.fontHeight
-                lastFragment.preFontHeight = preFragment.preFontHeight
-
-                lastFragment.contentPosY = preFragment.contentPosY
-                lastFragment.preContentPosY = preFragment.preContentPosY
-
-    @test("更新textItem纵坐标范围")
-    def updateHeightBoundary(self):  # 更新item高度范围，方便文字定位
-        self.StartY = self.textFragments[0].posY
-        self.EndY = self.textFragments[-1].posY + self.textFragments[-1].lineHeight
-
-    def paint(self, painter):
-        if self.textFragments:
-            painter.setFont(self.font)
-            painter.setPen(self.textColor)
-            if self.backgroundColor:  # 有背景色
-                for f in self.textFragments:
-                    if self.isSelected:
-                        painter.fillRect(QRect(f.posX, f.contentPosY, f.width, f.fontHeight),
-                                         self.backgroundColor)  # 同行的填充色高度相同
-                        painter.drawText(QRect(f.posX, f.contentPosY, f.width, f.fontHeight),
-                                         int(Qt.AlignLeft | Qt.AlignBottom),
-                                         f.text)  # 字体
-                        painter.fillRect(QRect(f.posX, f.posY, f.width, f.lineHeight),
-                                         GlobalVars.SelColor)
-                    else:
-                        painter.fillRect(QRect(f.posX, f.contentPosY, f.width, f.fontHeight),
-                                         self.backgroundColor)  # 同行的填充色高度相同
-                        painter.drawText(QRect(f.posX, f.contentPosY, f.width, f.fontHeight),
-                                         int(Qt.AlignLeft | Qt.AlignBottom),
-                                         f.text)  # 字体
-            else:
-                for f in self.textFragments:
-                    if self.isSelected:
-                        painter.drawText(QRect(f.posX, f.contentPosY, f.width + 4, f.fontHeight),  # 待优化 +4是为了应对斜体字的存在
-                                         int(Qt.AlignLeft | Qt.AlignBottom),
-                                         f.text)  # 字体
-                        painter.fillRect(QRect(f.posX, f.posY, f.width, f.lineHeight),
-                                         GlobalVars.SelColor)
-                    else:
-                        painter.drawText(QRect(f.posX, f.contentPosY, f.width + 4, f.fontHeight),  # 待优化 +4是为了应对斜体字的存在
-                                         int(Qt.AlignLeft | Qt.AlignBottom),
-                                         f.text)  # 字体
+            textBlock.updateSize()
 
 
 class Cursor(QLabel):
     """
-    textblock的光标
+    光标，一个文档只有一个，是document的子窗口，显示在获得焦点的textblock上，不需要每一段都有自己的光标和计时器
     """
 
     def __init__(self, parent=None):
         super().__init__(parent)
+        self.block = None  # 光标所在的textBlock
         self.isOpacity = False  # 用于光标的闪烁
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.cursorBlink)
 
         self.setFocusPolicy(Qt.NoFocus)
+        self.setAttribute(Qt.WA_TransparentForMouseEvents)  # 点击交给document处理
         self.resize(2, 20)
-        self.show()
+        self.hide()
+
+    def setBlock(self, block):
+        """
+        将光标移到block上，位置为block记录的光标位置，还没有分页时，分页后由document更新
+        """
+        self.block = block
+        if block.page:
+            x, y, height = block.cursorPos
+            self.move(int(block.posX + x), int(block.page.PosY[0] + block.posY[0] + y))  # 转换为文档中的坐标
+            self.resize(3, height)
+
+    def updatePosition(self):
+        """
+        段落或页面移动后，光标随之移动
+        """
+        if self.block:
+            self.setBlock(self.block)
 
-    def move(self, *args, **argv):
-        super().move(*args, **argv)
-        self.resize(3, CurrentTextFragment.fontHeight)
+    def release(self, block):
+        """
+        block删除时，隐藏光标
+        """
+        if self.block is block:
+            self.hide()
+            self.block = None
 
     def show(self):
         super().show()
@@ -657,72 +291,94 @@ class Cursor(QLabel):
 
 
 class TextBlock(Block):
+    renderCached = True  # 没有在编辑的段落使用绘制缓存
+    breakStrategy = DefaultBreakStrategy  # 断行策略，见layout.BreakStrategy
+    cursorPos = (0, 0, 20)  # 本段光标的横纵坐标和高度，获得焦点时文档的光标移到这里，Block初始化时就可能获得焦点，所以定义为类属性
 
     # 默认lineSpacing为fontHeight的1/8,相对行间距
     @test("创建textblock")
     def __init__(self, document, preBlock=None, float=False, lineSpacing=None,
-                 lineSpacingPolicy=None, titleLevel=None):
-        super().__init__(document, preBlock, float)
+                 lineSpacingPolicy=None, titleLevel=None, updateView=UpdateView.updateAll):
+        super().__init__(document, preBlock, float, updateView)
         self.RootTextItem = None
         self.LastTextItem = None
+        self.lineIndex = None  # 行索引，鼠标定位时才生成
         self.SelItems = []  # 当拖动选择或搜索时候，存储选中的item
 
         global CurrentTextItem
         CurrentTextItem = None  # 不可少
 
-        self.setAttribute(Qt.WA_InputMethodEnabled)  # 接受输入法事件
         self.lastInputMethodLength = 0  # 记录输入法predding的字符数，为了之后后删除输入的临时性的文字，以实现输入法更新
         self.disableInputMethod = False  # 用于输入法，避免调用输入法的同时，用户点击其他地方造成错误
 
-        pal = QPalette()
-        pal.setColor(QPalette.Background, Qt.red)
-        self.setPalette(pal)
-
-        if not lineSpacing:
+        if lineSpacing is None:
             lineSpacing = GlobalVars.CurrentLineSpacing
         self.lineSpacing = lineSpacing  # 行高
-        if not lineSpacingPolicy:  # 设置行间距的方法
+        if lineSpacingPolicy is None:  # 设置行间距的方法，相对行间距为0，所以用None判断
             lineSpacingPolicy = GlobalVars.CurrentLineSpacingPolicy
         self.lineSpacingPolicy = lineSpacingPolicy
 
         self.Selector = []  # 选中的item和对应的index，支持多选，但现在不支持，格式为[firsritem startindex,lastitem,endindex]
         self.selDrawRects = []  # 拖动选择绘制的选区，是显示效果
+        self.selRange = None  # 拖动时选中的内容，松开鼠标时放入Selector
 
         if not titleLevel:
             titleLevel = GlobalVars.T0
         self.TitleLevel = titleLevel
 
-        self.cursor_ = Cursor(self)
-        self.setFocus()
+        if updateView:
+            self.setFocus()
+
+    @classmethod
+    def fromHtml(cls, document, preBlock, htmlBlock):
+        """
+        根据htmlreader解析出的段落新建textBlock，打开文件时使用
+        在批量编辑中调用时，分页在结束时统一进行
+        """
+        titleLevel = GlobalVars.T0
+        for t in GlobalVars.TitleLevels:
+            if t.toHtmlFormat == htmlBlock.tag:
+                titleLevel = t
+                break
+        block = cls(document, preBlock, lineSpacing=htmlBlock.lineSpacing, lineSpacingPolicy=htmlBlock.lineSpacingPolicy,
+                    titleLevel=titleLevel, updateView=UpdateView.updateNone)
+        textItem = None
+        if titleLevel is GlobalVars.T0:  # 正文，每个span对应一个textItem
+            for htmlItem in htmlBlock.items:
+                textItem = block.addTextItem(htmlItem.text, textItem, htmlItem.font, htmlItem.textColor,
+                                             htmlItem.backgroundColor, updateView=UpdateView.updateNone)
+        else:  # 标题只有一个textItem，格式由标题等级决定
+            textItem = block.addTextItem(htmlBlock.text, textItem, titleLevel.font, titleLevel.textColor,
+                                         titleLevel.backgroundColor, updateView=UpdateView.updateNone)
+        if not textItem:  # 空段落
+            block.addTextItem("", None, updateView=UpdateView.updateNone)
+        block.updateTextItems()
+        return block
 
     # 根据textblock的spacingpolicy和textitem的字体大小，返回该textItem应有的行高
     def getLineHeight(self, fontHeight):
-        if self.lineSpacingPolicy is GlobalVars.absLineSpacingPolicy:  # 绝对行间距
-            return fontHeight + self.lineSpacing * 2
-        else:
-            return fontHeight + fontHeight * self.lineSpacing * 2  # 相对行间距
+        return getLineHeight(fontHeight, self.lineSpacing, self.lineSpacingPolicy)
 
     # 设置行间距 待完善
     def setLineSpacing(self, spacing):
         if self.lineSpacing != spacing:
+            self.document.journal.record(SetAttr(self, TextBlock.setLineSpacing, self.lineSpacing, spacing))
             self.lineSpacing = spacing
             textItem = self.RootTextItem
             while textItem:
-                textItem.lineHeight = self.getLineHeight(
-                    textItem.fontHeight)  # 根据textBlock策略返回行高。默认根据字体越大，上下获得的间距也越大，产生更好的视觉效果
-                textItem.contentPosY = (textItem.lineHeight - textItem.fontHeight) / 2  # 如果有填充，填充开始的纵坐标
+                textItem.updateLineHeight()  # 根据textBlock策略返回行高
                 textItem = textItem.nextTextItem
             self.RootTextItem.updateAllTextFragments()  # 统一更新
 
     # 设置行间距策略 待完善
     def setLineSpacingPolicy(self, policy):
         if self.lineSpacingPolicy is not policy:
+            self.document.journal.record(
+                SetAttr(self, TextBlock.setLineSpacingPolicy, self.lineSpacingPolicy, policy))
             self.lineSpacingPolicy = policy
             textItem = self.RootTextItem
             while textItem:
-                textItem.lineHeight = self.getLineHeight(
-                    textItem.fontHeight)  # 根据textBlock策略返回行高。默认根据字体越大，上下获得的间距也越大，产生更好的视觉效果
-                textItem.contentPosY = (textItem.lineHeight - textItem.fontHeight) / 2  # 如果有填充，填充开始的纵坐标
+                textItem.updateLineHeight()  # 根据textBlock策略返回行高
                 textItem = textItem.nextTextItem
             self.RootTextItem.updateAllTextFragments()  # 统一更新
 
@@ -745,7 +401,12 @@ class TextBlock(Block):
             self.RootTextItem.setBackgroundColor(titleLevel.backgroundColor)
             self.RootTextItem.updateAllTextFragments()
             self.update()
-        self.TitleLevel = titleLevel
+        self.setTitleLevelAttr(titleLevel)
+
+    def setTitleLevelAttr(self, titleLevel):  # 只修改标题等级，文本条的格式单独设置
+        if self.TitleLevel is not titleLevel:
+            self.document.journal.record(SetAttr(self, TextBlock.setTitleLevelAttr, self.TitleLevel, titleLevel))
+            self.TitleLevel = titleLevel
 
     # 根据选择设置标题
     def setTitleLevel(self, titleLevel=None):
@@ -754,22 +415,23 @@ class TextBlock(Block):
             startItem, startIndex, endItem, endIndex = selContext
             if not all([startItem is self.RootTextItem, startIndex == 0, endItem is self.LastTextItem,
                         endIndex == len(self.LastTextItem.text) - 1]):  # 部分选中
-                selItems = self.splitSeleted()
-                nextBlock = TextBlock(self.document, preBlock=self)
-                nextBlock.copyFrom(self, startTextItem=selItems[0], endTextItem=selItems[-1])
-                nextBlock.setTitleLevel_(titleLevel)
-                if selItems[-1].nextTextItem:  # 有后面的部分
-                    nnextBlock = TextBlock(self.document, preBlock=nextBlock)
-                    nnextBlock.copyFrom(self, startTextItem=selItems[-1].nextTextItem)
-                item = selItems[0]
-
-                while item:  # 可优化，判断是否已经是空段
-                    nextItem = item.nextTextItem
-                    item.delTextItem(updateView=UpdateView.updateNone)
-                    item = nextItem
-
-                self.RootTextItem.updateAllTextFragments()
-                self.optimize()  # 优化
+                with self.document.layoutTransaction():  # 拆分成多个段落，统一断行、分页
+                    selItems = self.splitSeleted()
+                    nextBlock = TextBlock(self.document, preBlock=self)
+                    nextBlock.copyFrom(self, startTextItem=selItems[0], endTextItem=selItems[-1])
+                    nextBlock.setTitleLevel_(titleLevel)
+                    if selItems[-1].nextTextItem:  # 有后面的部分
+                        nnextBlock = TextBlock(self.document, preBlock=nextBlock)
+                        nnextBlock.copyFrom(self, startTextItem=selItems[-1].nextTextItem)
+                    item = selItems[0]
+
+                    while item:  # 可优化，判断是否已经是空段
+                        nextItem = item.nextTextItem
+                        item.delTextItem(updateView=UpdateView.updateNone)
+                        item = nextItem
+
+                    self.RootTextItem.updateAllTextFragments()
+                    self.optimize()  # 优化
 
             else:
                 self.setTitleLevel_(titleLevel)
@@ -990,10 +652,31 @@ class TextBlock(Block):
             self.RootTextItem.updateAllTextFragments()  # 最后统一更新
 
     def showCursor(self):
-        self.cursor_.show()
+        cursor = self.document.cursor_
+        cursor.setBlock(self)
+        cursor.show()
 
     def hideCursor(self):
-        self.cursor_.hide()
+        cursor = self.document.cursor_
+        if cursor.block is self:
+            cursor.hide()
+
+    def moveCursor(self, x, y):
+        """
+        记录本段光标的位置，光标在本段时同时移动
+        """
+        self.cursorPos = (x, y, CurrentTextFragment.fontHeight)
+        cursor = self.document.cursor_
+        if cursor.block is self:
+            cursor.setBlock(self)
+
+    def delBlock(self):
+        self.document.cursor_.release(self)
+        super().delBlock()
+
+    def detachBlock(self):
+        self.document.cursor_.release(self)
+        super().detachBlock()
 
     @test("根据点击位置更新索引和光标")
     def findTextIndexWithCursorUpdate(self, pos):  # 鼠标点击,更新curtextItem index和光标
@@ -1005,40 +688,31 @@ class TextBlock(Block):
         GlobalVars.CurrentTextColor = CurrentTextItem.textColor  # 待完善，应该同步更新按钮颜色
         GlobalVars.CurrentBackgroundColor = CurrentTextItem.backgroundColor
         GlobalVars.CurrentFont = CurrentTextItem.font
-        self.cursor_.move(pos)
+        self.moveCursor(pos.x(), pos.y())
+
+    def getLineIndex(self):
+        """
+        返回本段的行索引，断行后第一次使用时生成
+        """
+        if self.lineIndex is None:
+            self.lineIndex = LineIndex(self)
+        return self.lineIndex
 
     def findTextIndex(self, cursorPos):  # 根据坐标,返回准确的光标位置,currentTextItem和currentIndex
-        textItem = self.RootTextItem
         cursorPosY = cursorPos.y()
         cursorPosX = cursorPos.x()
-        while textItem:
-            if textItem.StartY <= cursorPosY <= textItem.EndY:  # 点击点可能在此textitem里面，不确定
-                for fragment in textItem.textFragments:
-                    if (fragment.posY < cursorPosY < fragment.posY + fragment.lineHeight) and (
-                            fragment.posX <= cursorPosX <= fragment.posX + fragment.width):  # 在此fragment里面,待优化，避免每次计算fragment.PosX+fragment.LineHeight，之所以只用大于，是为了排除空的textItem，因为具有行间距，一般人也不会在两行汇交的中间点击
-                        currentTextItem = textItem
-                        currentTextFragment = fragment
-                        t = fragment.text
-                        localCursorPosX = cursorPosX - fragment.posX  # 鼠标在fragment中的相对位置
-                        x = 0
-                        preX = 0  # 第一个字符所占的水平位置上界限是fragment的起始坐标
-                        textLength = len(t)
-                        for i in range(textLength):
-                            tt = t[i]
-                            xx = textItem.fontMetrics.width(tt)  # 字符ss的长度
-                            x += xx  # i字符的位置
-                            nextX = x - xx / 2  # i字符的水平方向的下界
-                            if preX <= localCursorPosX <= nextX:  # 证明定位到i字符
-                                currentTextItemIndex = i + fragment.startIndex
-
-                                return QPoint(x - xx + fragment.posX,
-                                              fragment.contentPosY), currentTextItem, currentTextItemIndex, currentTextFragment
-                            else:
-                                preX = nextX  # 上一个字符的下界是下一个字符的上界
-                        currentTextItemIndex = textLength + fragment.startIndex  # 没有找到位置，证明在fragment的最后一个字符的后半部分点击
-                        return QPoint(fragment.posX + fragment.width,
-                                      fragment.contentPosY), currentTextItem, currentTextItemIndex, currentTextFragment
-            textItem = textItem.nextTextItem
+        found = self.getLineIndex().fragmentAt(cursorPosX, cursorPosY)  # 二分查找行，再二分查找行内的fragment
+        if found:  # 之所以行与行的交界处不算，是为了排除空的textItem，因为具有行间距，一般人也不会在两行汇交的中间点击
+            currentTextItem, currentTextFragment = found
+            fragment = currentTextFragment
+            advances = currentTextItem.fragmentAdvances(fragment)  # 查表得到的累计宽度
+            i = charIndexAt(advances, cursorPosX - fragment.posX)  # 鼠标在fragment中的相对位置对应的索引
+            currentTextItemIndex = i + fragment.startIndex
+            if i <= fragment.endIndex - fragment.startIndex:  # 不需要取出fragment的文字
+                return QPoint(advances[i] + fragment.posX,
+                              fragment.contentPosY), currentTextItem, currentTextItemIndex, currentTextFragment
+            return QPoint(fragment.posX + fragment.width,  # 在fragment的最后一个字符的后半部分点击
+                          fragment.contentPosY), currentTextItem, currentTextItemIndex, currentTextFragment
 
         currentTextItem = self.LastTextItem  # 点击空白位置，定位到段尾
         currentTextItemIndex = len(currentTextItem.text)
@@ -1047,21 +721,36 @@ class TextBlock(Block):
         return QPoint(lastFragment.posX + lastFragment.width,
                       lastFragment.contentPosY), currentTextItem, currentTextItemIndex, currentTextFragment
 
+    def setCursorPosition(self, textItem, index):
+        """
+        将光标定位到本段textItem的index处，撤销、重做后使用
+        """
+        global CurrentTextItem
+        global CurrentTextItemIndex
+        CurrentTextItem = textItem
+        CurrentTextItemIndex = index
+        self.setAsCurrentBlock()
+        self.setFocus()
+        self.updateCursor()
+
     # 根据当前的textItem和index更新光标
     @test("根据索引更新光标")
     def updateCursor(self):
         global CurrentTextFragment
+        if self.document.layoutLock:  # 批量编辑，结束时统一更新光标
+            self.document.cursorBlock = self
+            return
         index = CurrentTextItemIndex
         currentTextItem = CurrentTextItem
-        for fragment in currentTextItem.textFragments:  # 需要保证currenttextitem，currenttextfragment 和index正确性
-            if fragment.startIndex <= index <= fragment.endIndex:  # 在其此fragment中
-                CurrentTextFragment = fragment
-                posX = currentTextItem.fontMetrics.width(fragment.text[:index - fragment.startIndex]) + fragment.posX
-                self.cursor_.move(posX, fragment.contentPosY)
-                return
-        CurrentTextFragment = fragment
-        self.cursor_.move(fragment.posX + currentTextItem.fontMetrics.width(fragment.text),
-                          fragment.contentPosY)  # 位于textItem末尾
+        fragment = currentTextItem.findFragment(index)  # 需要保证currenttextitem和index正确性
+        if fragment:  # 在其此fragment中
+            CurrentTextFragment = fragment
+            posX = currentTextItem.fragmentAdvances(fragment)[index - fragment.startIndex] + fragment.posX
+            self.moveCursor(posX, fragment.contentPosY)
+            return
+        fragment = CurrentTextFragment = currentTextItem.textFragments[-1]
+        self.moveCursor(fragment.posX + currentTextItem.fragmentAdvances(fragment)[-1],
+                        fragment.contentPosY)  # 位于textItem末尾
 
     def paste(self):  # 待完善，需要处理不同的格式
         cliboard = QApplication.clipboard()
@@ -1132,9 +821,8 @@ class TextBlock(Block):
             else:  # 段末没有全部选中
                 selAreaEndPos, selEndTextItem, selEndTextItemIndex, selEndTextFragment = self.findTextIndex(
                     QPoint(endX, endY))  # 找出最终坐标
-            self.Selector.append(
-                [selStartTextItem, selStartTextItemIndex, selEndTextItem,
-                 selEndTextItemIndex - 1])  # textItem要减去1 待优化当选择空白区域时出错
+            self.selRange = [selStartTextItem, selStartTextItemIndex, selEndTextItem,
+                             selEndTextItemIndex - 1]  # textItem要减去1 待优化当选择空白区域时出错
 
             # 绘制选择区域
             if selAreaStartPos.y() == selAreaEndPos.y():  # 同一行
@@ -1153,9 +841,14 @@ class TextBlock(Block):
             self.selDrawRects.append(QRect(0,0,self.width(),self.height()))
         self.update()
 
+    def downSelConfirmEvent(self):  # 拖动时只绘制选区，松开鼠标时才记录选中的内容
+        if self.SelStatus is SelStatus.SelPart and self.selRange:
+            self.Selector.append(self.selRange)
+
     def deSelEvent(self):
         super().deSelEvent()
         self.Selector = []
+        self.selRange = None
         self.selDrawRects = []
         if self.SelItems:
             self.optimize()  # 有选中，证明进行了更改
@@ -1164,59 +857,86 @@ class TextBlock(Block):
         self.SelItems = []
         self.update()
 
-    @test("转换为html")
-    def toHtml(self):
-        self.optimize()  # 先进行优化
-        if self.TitleLevel is GlobalVars.T0:  # 正文格式
-            text = '<p style="width:{}px; lineSpacingPolicy:{}; lineSpacing:{}">\n'.format(self.BlockWidth,
-                                                                                           self.lineSpacingPolicy,
-                                                                                           self.lineSpacing)  # 一些属性，在html中没有意义
-            textItem = self.RootTextItem
-            while textItem:
-                font = textItem.font
-                fontFamily = font.family()
-                fontSize = font.pointSize()
-                italic = "italic" if font.italic() else "normal"
-                weight = "bold" if font.bold() else "normal"  # 待完善，不止这两种
-                lineHeight = self.getLineHeight(fontSize)  # 行高
-                textColor = list(textItem.textColor.getRgb())
-                textColor[3] /= 255  # 透明度转化为浮点数
-                textColor = "rgba" + str(tuple(textColor))  # 转化为html格式
-                backgroundColor = textItem.backgroundColor
-                if backgroundColor:
-                    backgroundColor = list(backgroundColor.getRgb())
-                    backgroundColor[3] /= 255  # 透明度转化为小数
-                    backgroundColor = "rgba" + str(tuple(backgroundColor))
-                else:
-                    backgroundColor = "none"
-                text += '<span style="font-family:{};font-style:{};font-weight:{};font-size:{}pt;color:{};background-color:{};line-height:{}px">{}</span>\n'.format(
-                    fontFamily, italic, weight, fontSize, textColor, backgroundColor, lineHeight,
-                    textItem.text)  # 待完善使用pt作为单位，应该全部都使用pt
-                textItem = textItem.nextTextItem
-            text += "</p>\n"
-        else:
-            text = '<{} style="width:{}px; lineSpacingPolicy:{}; lineSpacing:{}">{}</{}>\n'.format(
-                self.TitleLevel.toHtmlFormat,
-                self.BlockWidth,
-                self.lineSpacingPolicy,
-                self.lineSpacing,
-                self.RootTextItem.text,
-                self.TitleLevel.toHtmlFormat)  # 一些属性，在html中没有意义
-        return text
+    @test("段落快照")
+    def snapshot(self, optimize=True):
+        """
+        复制导出html需要的数据，返回不会改变的BlockSnapshot，可以在后台线程中生成html
+        optimize为False时不整理文本条，导出不会修改段落
+        """
+        if optimize:
+            self.optimize()  # 先进行优化
+        items = []
+        textItem = self.RootTextItem
+        while textItem:
+            font = textItem.font
+            fontSize = font.pointSize()
+            backgroundColor = textItem.backgroundColor
+            items.append(ItemSnapshot(textItem.text,
+                                      font.family(),
+                                      font.italic(),
+                                      font.bold(),
+                                      fontSize,
+                                      self.getLineHeight(fontSize),  # 行高
+                                      textItem.textColor.getRgb(),
+                                      backgroundColor.getRgb() if backgroundColor else None))
+            textItem = textItem.nextTextItem
+        return BlockSnapshot(self.TitleLevel.toHtmlFormat,
+                             self.TitleLevel is not GlobalVars.T0,
+                             self.BlockWidth,
+                             self.lineSpacing,
+                             self.lineSpacingPolicy,
+                             tuple(items))
+
+    def iterHtml(self, optimize=True):
+        """
+        依次生成本段html的各个部分，正文每个textItem生成一个span
+        """
+        return iterBlockHtml(self.snapshot(optimize))
+
+    def updateTextItems(self, updateView=UpdateView.updateAll):
+        """
+        所有textItem重新断行，并调整段落大小
+        updateView为updateNone时不更新段落位置，用于批量新建段落，最后统一分页
+        """
+        self.resize(self.BlockWidth, layoutTextItems(self))
+        if updateView:
+            self.updateBlock()
+            self.update()
 
     def updateSize(self):  # textItem变动，进行更新
+        if self.document.layoutLock:  # 批量编辑，textFragment可能还没有更新，结束时统一断行
+            self.document.markDirty(self, True)
+            return
         lastItem_LastFragment = self.LastTextItem.textFragments[-1]
         self.resize(self.BlockWidth, lastItem_LastFragment.posY + lastItem_LastFragment.lineHeight)
         self.updateBlock()  # 之所以不用nextBlock.updayeBlock是因为nextblock可能为None，减少判断
         self.update()
 
-    def paintEvent(self, event):
-        super().paintEvent(event)
-        p = QPainter(self)
-        textItem = self.RootTextItem
-        while textItem:
-            textItem.paint(p)
-            textItem = textItem.nextTextItem
+    def paintContent(self, p, rect):  # 只绘制需要重绘的区域，比如光标闪烁时只有光标所在的位置
+        groups = {}  # 字体和颜色相同的fragment一起绘制，减少painter状态的切换
+        for textItem, f in self.getLineIndex().fragmentsIn(rect.left(), rect.top(), rect.right(), rect.bottom()):
+            key = (textItem.fontAdvances, textItem.textColor.rgba())  # 同一字体共用一个字符宽度表
+            group = groups.get(key)
+            if group is None:
+                group = groups[key] = []
+            group.append((textItem, f))
+            if textItem.backgroundColor:  # 有背景色，先填充背景，再绘制文字
+                p.fillRect(QRect(f.posX, f.contentPosY, f.width, f.fontHeight),
+                           textItem.backgroundColor)  # 同行的填充色高度相同
+
+        flags = int(Qt.AlignLeft | Qt.AlignBottom | Qt.TextDontClip)
+        selected = []  # 选中的textItem的fragment，最后绘制选中的颜色
+        for group in groups.values():
+            textItem = group[0][0]
+            p.setFont(textItem.font)
+            p.setPen(textItem.textColor)
+            for textItem, f in group:
+                width = f.width if textItem.backgroundColor else f.width + 4  # 待优化 +4是为了应对斜体字的存在
+                p.drawText(QRect(f.posX, f.contentPosY, width, f.fontHeight), flags, f.text)
+                if textItem.isSelected:
+                    selected.append(f)
+        for f in selected:
+            p.fillRect(QRect(f.posX, f.posY, f.width, f.lineHeight), GlobalVars.SelColor)
         if self.selDrawRects:  # 选中状态
             for r in self.selDrawRects:
                 p.fillRect(r, GlobalVars.SelColor)  # 可优化，访问外部变量的时间较长
@@ -1226,8 +946,7 @@ class TextBlock(Block):
 
         if self.lastInputMethodLength:  # 输入法启动的时候点击，删除输入法的残留文字
             self.disableInputMethod = True
-            self.document.setFocus()  # 目的是为了清空输入法的内容
-            self.setFocus()
+            QApplication.inputMethod().reset()  # 清空输入法的内容
         self.findTextIndexWithCursorUpdate(
             event.pos())  # 更新currentTextItem,currentTextItemIndexmCurrentTextFragment,self.cursor坐标
         event.ignore()  # 向document传递信息
@@ -1242,46 +961,56 @@ class TextBlock(Block):
         super().setFocus_(sign)
         global CurrentTextItem
         global CurrentTextItemIndex
-        global CurrentTextFragment
         if sign:  # 后一段删除获得焦点
             CurrentTextItem = self.RootTextItem
-            CurrentTextFragment = self.RootTextItem.textFragments[0]
             CurrentTextItemIndex = 0
-            self.updateCursor()
         else:
             CurrentTextItem = self.LastTextItem
-            CurrentTextFragment = self.LastTextItem.textFragments[-1]
             CurrentTextItemIndex = len(self.LastTextItem.text)
-            self.updateCursor()
+        self.updateCursor()  # 同时更新CurrentTextFragment
 
     @test("失去焦点")
     def focusOutEvent(self, event):
         # 待完善，拾取焦点的时候输入法会有残留
-        self.delNullTextItem()
+        if not self.document.journal.lock:  # 撤销、重做的过程中焦点改变，不能产生新的修改
+            self.delNullTextItem()
         self.hideCursor()
         super().focusOutEvent(event)
 
     # 删除空的textItem
     @test("删除空的文本条")
-    def delNullTextItem(self):
+    def delNullTextItem(self):  # 返回是否删除了文本条
+        isDeleted = False
         textItem = self.RootTextItem
         while textItem:
             nextItem = textItem.nextTextItem
             if not textItem.text:  # 空的文本条
                 textItem.delTextItem(updateView=False)
+                isDeleted = True
             textItem = nextItem
+        return isDeleted
 
-    def optimize(self):  # 待优化，下面过程有重复
-        self.delNullTextItem()
+    def optimize(self):
+        """
+        删除空的文本条，合并相邻的格式相同的文本条，有变化时才重新断行
+        """
+        global CurrentTextItem
+        global CurrentTextItemIndex
+        isChanged = self.delNullTextItem()
         item = self.RootTextItem
         while item:
             nextItem = item.nextTextItem
             if nextItem and item.font == nextItem.font and item.textColor == nextItem.textColor and item.backgroundColor == nextItem.backgroundColor:
-                item.setText(item.text + nextItem.text)
-                nextItem.delTextItem()
+                if CurrentTextItem is nextItem:  # 光标所在的文本条被合并
+                    CurrentTextItem = item
+                    CurrentTextItemIndex += len(item.text)
+                item.setText(item.text + nextItem.text, updateView=UpdateView.updateNone)
+                nextItem.delTextItem(updateView=UpdateView.updateNone)
+                isChanged = True
             else:
                 item = nextItem
-        self.RootTextItem.updateAllTextFragments()
+        if isChanged:
+            self.RootTextItem.updateAllTextFragments()
 
     def delSelected(self):  # 删除选择内容
         selContext = self.Selector[0]  # 选中的内容 待完善，只是对一次选中的内容进行处理
@@ -1289,14 +1018,15 @@ class TextBlock(Block):
         if startItem is endItem:  # 选中同一个item
             startItem.delText(startIndex, endIndex)
         else:  # 选中不同的item
-            startItem.delText(startIndex, len(startItem.text) - 1, updateView=False)
-            item = startItem.nextTextItem
-            while item is not endItem:
-                nextItem = item.nextTextItem
-                item.delTextItem(updateView=False)
-                item = nextItem
-            endItem.delText(0, endIndex, updateView=False)
-            startItem.updateAllTextFragments()  # 更新视图
+            with self.document.layoutTransaction():  # 删除整段时会引起前后段落更新，统一进行
+                startItem.delText(startIndex, len(startItem.text) - 1, updateView=False)
+                item = startItem.nextTextItem
+                while item is not endItem:
+                    nextItem = item.nextTextItem
+                    item.delTextItem(updateView=False)
+                    item = nextItem
+                endItem.delText(0, endIndex, updateView=False)
+                startItem.updateAllTextFragments()  # 更新视图
 
     @test("输入文字")
     def keyPressEvent(self, event):
@@ -1328,16 +1058,17 @@ class TextBlock(Block):
             elif currentTextItem is self.RootTextItem and currentTextItemIndex == 0:
                 self.document.addTextBlockWithTextItem(self.preBlock)
             else:
-                textItem = CurrentTextItem
-                newTextItem = textItem.insertTextItem()
-
-                newBlock = TextBlock(self.document, preBlock=self)  # 增加一个新段
-                newBlock.copyFrom(self, startTextItem=newTextItem.nextTextItem)
-                item = newTextItem
-                while item:
-                    nextItem = item.nextTextItem
-                    item.delTextItem()
-                    item = nextItem
+                with self.document.layoutTransaction():  # 拆分段落涉及多个文本条和新段落，统一断行、分页
+                    textItem = CurrentTextItem
+                    newTextItem = textItem.insertTextItem()
+
+                    newBlock = TextBlock(self.document, preBlock=self)  # 增加一个新段
+                    newBlock.copyFrom(self, startTextItem=newTextItem.nextTextItem)
+                    item = newTextItem
+                    while item:
+                        nextItem = item.nextTextItem
+                        item.delTextItem()
+                        item = nextItem
         elif event.modifiers()==Qt.ControlModifier and key==Qt.Key_S:#待完善，为什么按钮的快捷键不能被识别
             pass
 
@@ -1349,18 +1080,17 @@ class TextBlock(Block):
 
     # 调用输入法事件
     def inputMethodEvent(self, event):
-        if self.lastInputMethodLength:  # 证明已经在调用输入法
-            self.setUpdatesEnabled(False)  # 暂停视图更新避免闪烁
-            CurrentTextItem.delText(CurrentTextItemIndex - self.lastInputMethodLength,
-                                    CurrentTextItemIndex - 1)  # 删除上一次文字
-        CurrentTextItem.insertText(event.preeditString(), CurrentTextItemIndex)
-        self.setUpdatesEnabled(True)
+        with self.document.journal.paused():  # 预编辑的文字是临时的，不记录撤销，只记录最终提交的文字
+            if self.lastInputMethodLength:  # 证明已经在调用输入法
+                self.setUpdatesEnabled(False)  # 暂停视图更新避免闪烁
+                CurrentTextItem.delText(CurrentTextItemIndex - self.lastInputMethodLength,
+                                        CurrentTextItemIndex - 1)  # 删除上一次文字
+            CurrentTextItem.insertText(event.preeditString(), CurrentTextItemIndex)
+            self.setUpdatesEnabled(True)
         self.lastInputMethodLength = len(event.preeditString())  # 值为0，代表一次输入事件结束
 
         if event.commitString():
             if self.disableInputMethod:  # 输入法禁用,在输入法输入时，点击了其他地方，目的是为了防止输入不必要的文字
                 self.disableInputMethod = False  # 重新启用,
-            else:
+            else:  # 与键盘输入一样只记录一次InsertText，可以与前后输入的文字合并
                 CurrentTextItem.insertText(event.commitString(), CurrentTextItemIndex)
-
-        super().inputMethodEvent(event)
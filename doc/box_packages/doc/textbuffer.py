@@ -0,0 +1,145 @@
+from bisect import bisect_right
+from itertools import accumulate
+
+
+class TextBuffer():
+    """
+    文本条文字的片段表(piece table)，插入和删除只修改片段列表，不需要复制整个字符串
+    每个片段为(字符串, 起始索引, 结束索引)，引用原有的字符串，按索引二分查找所在的片段
+    片段数超过上限时合并为一个字符串，保证查找和修改的开销有上限
+    需要完整的字符串时才拼接，拼接结果一直缓存到下一次修改
+    """
+    MaxPieces = 64  # 片段数超过此值时合并
+    ChunkSize = 256  # 按块读取时每块的最大长度，连续输入时不超过此长度的片段直接合并
+
+    def __init__(self, text=""):
+        self.pieces = []  # 所有片段，按顺序排列
+        self.offsets = []  # 每个片段在文字中的起始索引
+        self.length = 0
+        self.version = 0  # 每次修改加1，用于判断排版是否对应当前的文字
+        self.cache = None  # 拼接后的字符串，修改后失效
+        self.reset(text)
+
+    def reset(self, text):
+        self.pieces = [(text, 0, len(text))] if text else []
+        self.offsets = [0] if text else []
+        self.length = len(text)
+        self.cache = text
+
+    def __len__(self):
+        return self.length
+
+    def __str__(self):
+        if self.cache is None:
+            self.reset("".join([s[a:b] for s, a, b in self.pieces]))  # 拼接后只剩一个片段
+        return self.cache
+
+    def __repr__(self):
+        return "TextBuffer({!r})".format(str(self))
+
+    def __getitem__(self, key):
+        if self.cache is not None:
+            return self.cache[key]
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            if step != 1:
+                return str(self)[key]
+            return "".join(self.iterChunks(start, stop, self.length))
+        if key < 0:
+            key += self.length
+        if not 0 <= key < self.length:
+            raise IndexError("TextBuffer index out of range")
+        i = bisect_right(self.offsets, key) - 1
+        s, a, b = self.pieces[i]
+        return s[a + key - self.offsets[i]]
+
+    def iterChunks(self, start=0, stop=None, size=None):
+        """
+        依次返回文字从start到stop的各个部分，每部分不超过size，不会拼接整个字符串
+        """
+        if stop is None or stop > self.length:
+            stop = self.length
+        if size is None:
+            size = self.ChunkSize
+        if self.cache is not None:
+            for j in range(start, stop, size):
+                yield self.cache[j:min(j + size, stop)]
+            return
+        i = max(bisect_right(self.offsets, start) - 1, 0)
+        while i < len(self.pieces) and self.offsets[i] < stop:
+            s, a, b = self.pieces[i]
+            offset = self.offsets[i]
+            end = a + min(stop - offset, b - a)
+            for j in range(a + max(start - offset, 0), end, size):
+                yield s[j:min(j + size, end)]
+            i += 1
+
+    def changed(self):  # 片段改变后更新索引
+        self.offsets = [0] if self.pieces else []
+        self.offsets.extend(accumulate([b - a for s, a, b in self.pieces[:-1]]))
+        self.cache = None
+        self.version += 1
+        if len(self.pieces) > self.MaxPieces:
+            str(self)
+
+    def insert(self, index, text):
+        """
+        在index处插入文字
+        """
+        if not text:
+            return
+        pieces = self.pieces
+        index = max(0, min(index, self.length))
+        i = bisect_right(self.offsets, index) - 1  # index所在的片段，或者结束于index的片段
+        if i >= 0:
+            s, a, b = pieces[i]
+            k = a + index - self.offsets[i]
+            if k == a and i:  # 位于片段的开头，考虑与前一个片段合并
+                i -= 1
+                s, a, b = pieces[i]
+                k = b
+            if k == b and b - a < self.ChunkSize:  # 连续输入，直接与较短的片段合并
+                pieces[i] = (s[a:b] + text, 0, b - a + len(text))
+            elif k == b:
+                pieces.insert(i + 1, (text, 0, len(text)))
+            elif k == a:
+                pieces.insert(i, (text, 0, len(text)))
+            else:  # 拆分片段
+                pieces[i:i + 1] = [(s, a, k), (text, 0, len(text)), (s, k, b)]
+        else:  # 没有文字
+            pieces.append((text, 0, len(text)))
+        self.length += len(text)
+        self.changed()
+
+    def delete(self, start, stop):
+        """
+        删除从start到stop（不包括stop）的文字
+        """
+        start = max(start, 0)
+        stop = min(stop, self.length)
+        if start >= stop:
+            return
+        pieces = self.pieces
+        offsets = self.offsets
+        i = bisect_right(offsets, start) - 1
+        j = bisect_right(offsets, stop - 1) - 1
+        remain = []  # 首尾片段剩下的部分
+        s, a, b = pieces[i]
+        if start > offsets[i]:
+            remain.append((s, a, a + start - offsets[i]))
+        s, a, b = pieces[j]
+        if stop < offsets[j] + b - a:
+            remain.append((s, a + stop - offsets[j], b))
+        pieces[i:j + 1] = remain
+        self.length -= stop - start
+        self.changed()
+
+
+def iterChunks(text, start=0):
+    """
+    依次返回文字从start开始的各个部分，text可以是字符串或TextBuffer
+    """
+    if isinstance(text, TextBuffer):
+        return text.iterChunks(start)
+    size = TextBuffer.ChunkSize
+    return (text[i:i + size] for i in range(start, len(text), size))